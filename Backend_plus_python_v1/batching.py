@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class BatchingWorker:
+    """Funnel concurrent requests into batches run by a single model-owning thread
+
+    Request threads call submit() and block on the result. The worker takes
+    the first waiting request, keeps collecting for up to `max_latency`
+    seconds or until `max_batch_size` requests are waiting, then hands the
+    whole batch to `generate_batch(requests) -> results` and fans the results
+    back out in order. Only the worker thread ever touches the model; that,
+    not throughput, is what it buys when generate_batch runs its requests
+    one by one. A batch that fails, or returns the wrong number of results,
+    fails every request in it.
+    """
+
+    def __init__(self, generate_batch, max_batch_size=8, max_latency=0.02):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='batching-worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, request, timeout=None):
+        """Queue one request and wait for its result (re-raises generation errors)"""
+        future = Future()
+        self._queue.put((request, future))
+        return future.result(timeout)
+
+    def close(self):
+        """Finish queued work and stop the worker thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                results = list(self.generate_batch([request for request, _ in batch]))
+                if len(results) != len(batch):
+                    # Results pair up with requests by position, so none can be trusted
+                    raise RuntimeError(f"generate_batch returned {len(results)} results "
+                                       f"for {len(batch)} requests")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            self.batches += 1
+            self.requests += len(batch)
+
+    @property
+    def mean_batch_size(self):
+        return self.requests / self.batches if self.batches else 0.0
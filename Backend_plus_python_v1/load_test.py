@@ -0,0 +1,91 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from batching import BatchingWorker
+
+class StubGenerator:
+    """Stands in for the Magenta generator behind generate_sequences
+
+    Like generate_sequences, a batch is one generator.generate call per
+    item, serialised on one lock the way calls queue up on one TensorFlow
+    model, so a batch costs as much as its items run alone. `contended`
+    counts calls that found another thread already inside the model.
+    """
+
+    def __init__(self, call_cost=0.02):
+        self.call_cost = call_cost
+        self.contended = 0
+        self._lock = threading.Lock()
+
+    def generate_batch(self, requests):
+        results = []
+        for temperature in requests:
+            if not self._lock.acquire(blocking=False):
+                self.contended += 1
+                self._lock.acquire()
+            try:
+                time.sleep(self.call_cost)
+            finally:
+                self._lock.release()
+            results.append({'notes': [], 'temperature': temperature})
+        return results
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_load(call, clients, requests_per_client):
+    """Fire requests from `clients` threads; return (seconds, latencies)"""
+    latencies = []
+    lock = threading.Lock()
+    def client():
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            call()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+def report(label, seconds, latencies, extra=''):
+    print(f"{label:10s} {len(latencies)/seconds:8.1f} req/s   "
+          f"p50 {percentile(latencies, 0.5)*1000:7.1f} ms   "
+          f"p99 {percentile(latencies, 0.99)*1000:7.1f} ms{extra}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test for the batched generation worker')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=10, help='Requests per client')
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_latency_ms', type=float, default=20)
+    parser.add_argument('--url', default=None,
+                        help='Load test a running server instead, e.g. http://127.0.0.1:5000/generate-music')
+    args = parser.parse_args()
+
+    if args.url:
+        def fetch():
+            with urllib.request.urlopen(args.url) as response:
+                json.load(response)
+        report('server', *run_load(fetch, args.clients, args.requests))
+    else:
+        print(f"{args.clients} clients x {args.requests} requests against the stub generator")
+        # generate_sequences makes one model call per request, so the worker
+        # cannot raise throughput; what it removes is request threads
+        # contending for the model, which all run on its one thread instead
+        stub = StubGenerator()
+        seconds, latencies = run_load(lambda: stub.generate_batch([1.0]), args.clients, args.requests)
+        report('direct', seconds, latencies, f"   contended calls {stub.contended}")
+        for label, size in (('unbatched', 1), ('batched', args.max_batch_size)):
+            stub = StubGenerator()
+            worker = BatchingWorker(stub.generate_batch, size, args.max_latency_ms / 1000)
+            seconds, latencies = run_load(lambda: worker.submit(1.0), args.clients, args.requests)
+            worker.close()
+            report(label, seconds, latencies, f"   contended calls {stub.contended}"
+                                              f"   mean batch {worker.mean_batch_size:.1f}")
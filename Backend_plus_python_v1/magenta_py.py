@@ -1,29 +1,56 @@
-from flask import Flask, jsonify
-import magenta.music as mm
-from magenta.models.performance_rnn import performance_sequence_generator
-from magenta.models.shared import sequence_generator_bundle
-import tensorflow.compat.v1 as tf # type: ignore
+import argparse
+import os
+from flask import Flask, jsonify, request
+from batching import BatchingWorker
 
 app = Flask(__name__)
 
-# Load the Magenta model
 BUNDLE_FILE = "performance_rnn.mag"  # Ensure you have the correct model file
-bundle = sequence_generator_bundle.read_bundle_file(BUNDLE_FILE)
-generator = performance_sequence_generator.PerformanceRnnSequenceGenerator(bundle)
-generator.initialize()
+generator = None
+
+def load_generator():
+    """Load the Magenta model once; Magenta and TensorFlow are imported here,
+    so importing this module (or running --help) does not pay for them"""
+    global generator
+    if generator is None:
+        from magenta.models.performance_rnn import performance_sequence_generator
+        from magenta.models.shared import sequence_generator_bundle
+        bundle = sequence_generator_bundle.read_bundle_file(BUNDLE_FILE)
+        generator = performance_sequence_generator.PerformanceRnnSequenceGenerator(bundle)
+        generator.initialize()
+    return generator
+
+def generate_sequences(temperatures):
+    """Run one batch of requests against the shared generator
+
+    PerformanceRnnSequenceGenerator generates one sequence per call, so the
+    batch runs back to back here, on the worker thread that owns TensorFlow.
+    """
+    import magenta.music as mm
+    generator = load_generator()
+    sequences = []
+    for temperature in temperatures:
+        primer = mm.NoteSequence()
+        generator_options = generator.default_generate_options()
+        generator_options.args['temperature'].float_value = temperature  # Randomness
+        sequences.append(generator.generate(primer, generator_options))
+    return sequences
+
+# Concurrent requests are collected for up to MAX_LATENCY_MS and run together
+worker = BatchingWorker(generate_sequences,
+                        max_batch_size=int(os.environ.get('MAX_BATCH_SIZE', 8)),
+                        max_latency=float(os.environ.get('MAX_LATENCY_MS', 20)) / 1000)
 
 @app.route('/generate-music', methods=['GET'])
 def generate_music():
     """Generates a sequence of notes and returns them as JSON."""
     qpm = 120  # Tempo
-    primer = mm.NoteSequence()
-    
+    temperature = request.args.get('temperature', 1.0, type=float)
+
     # Generate a 4-bar phrase
-    generator_options = generator.default_generate_options()
-    generator_options.args['temperature'].float_value = 1.0  # Randomness
+    generated_sequence = worker.submit(temperature)
 
-    generated_sequence = generator.generate(primer, generator_options)
-    
+    import magenta.music as mm  # Already loaded by the worker
     notes = []
     for note in generated_sequence.notes:
         notes.append({
@@ -35,4 +62,14 @@ def generate_music():
     return jsonify({"notes": notes})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    parser = argparse.ArgumentParser(description='Magenta generation server')
+    parser.add_argument('--max_batch_size', type=int, default=worker.max_batch_size,
+                        help='Most requests run together (env MAX_BATCH_SIZE)')
+    parser.add_argument('--max_latency_ms', type=float, default=worker.max_latency * 1000,
+                        help='Longest a request waits for others to join (env MAX_LATENCY_MS)')
+    args = parser.parse_args()
+    worker.max_batch_size = args.max_batch_size
+    worker.max_latency = args.max_latency_ms / 1000
+    load_generator()  # Before serving, so the first request does not wait for it
+    # No reloader: it would load the bundle a second time in a child process
+    app.run(debug=True, port=5000, threaded=True, use_reloader=False)
@@ -3,6 +3,13 @@ import numpy as np
 import mido
 from mido import MidiFile, MidiTrack, Message, MetaMessage
 from collections import defaultdict
+try:
+    import model_cache
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import model_cache
 
 def parse_midi(midi_path):
     """Extract notes and timing from MIDI file"""
@@ -25,6 +32,26 @@ def parse_midi(midi_path):
                 })
     return notes, ticks_per_beat, tempos
 
+def load_or_build(midi_path, order=2, cache=None):
+    """parse_midi + build_markov_model, reusing a cached result for the same file"""
+    if cache is not None:
+        key = model_cache.cache_key(midi_path, 'LongMIDI', order=order)
+        hit = cache.load(key)
+        if hit is not None:
+            arrays, meta = hit
+            notes = model_cache.records_from_array(arrays['notes'])
+            model = model_cache.list_model_from_arrays(arrays)
+            return (notes, meta['ticks_per_beat'],
+                    model_cache.tempos_from_meta(meta['tempos']), model)
+    notes, ticks_per_beat, tempos = parse_midi(midi_path)
+    model = build_markov_model(notes, order)
+    if cache is not None:
+        arrays = model_cache.list_model_to_arrays(model, order)
+        arrays['notes'] = model_cache.records_to_array(notes, ('note', 'time', 'velocity'))
+        cache.save(key, arrays, {'ticks_per_beat': ticks_per_beat,
+                                 'tempos': model_cache.tempos_to_meta(tempos)})
+    return notes, ticks_per_beat, tempos, model
+
 def build_markov_model(notes, order=2):
     """Create Markov transition model"""
     model = defaultdict(list)
@@ -88,18 +115,20 @@ if __name__ == "__main__":
                        help='Number of notes to generate')
     parser.add_argument('--order', type=int, default=2,
                        help='Markov chain order (1-3)')
+    parser.add_argument('--cache_dir', default=None,
+                       help='Model cache directory')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Always re-parse and rebuild the model')
     
     args = parser.parse_args()
     
-    # Process MIDI
-    notes, ticks, tempos = parse_midi(args.input)
+    # Process MIDI and build model, or load both from the cache
+    cache = None if args.no_cache else model_cache.ModelCache(args.cache_dir)
+    notes, ticks, tempos, model = load_or_build(args.input, args.order, cache)
     if not notes:
         print("Error: No notes found in input file")
         exit(1)
     
-    # Build model
-    model = build_markov_model(notes, args.order)
-    
     # Generate continuation
     last_original = [n['note'] for n in notes[-args.order:]]
     new_notes = generate_continuation(model, last_original, args.length)
@@ -1,39 +1,97 @@
 import argparse
 import numpy as np
-from scipy.io import wavfile
-import mido
 from mido import MidiFile, MidiTrack, Message, MetaMessage
-from collections import defaultdict
+from collections import defaultdict, deque
+try:
+    import audio_codec
+    import model_cache
+    import synth
+    from tempo_map import TempoMap
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import audio_codec
+    import model_cache
+    import synth
+    from tempo_map import TempoMap
 
 # ===================== MIDI PROCESSING =====================
-def parse_midi(midi_path):
-    """Extract notes with proper timing"""
+def parse_midi(midi_path, sustain=True):
+    """Extract notes with proper timing
+
+    Note-offs are matched first-in first-out per (track, channel, pitch), so
+    pairing is a single pass. With sustain=True a released key keeps sounding
+    while the sustain pedal (CC 64) is down, until the pedal lifts or the same
+    key is struck again. Returns (notes, ticks_per_beat, tempo_map).
+    """
     mid = MidiFile(midi_path)
     notes = []
-    tempos = []
+    tempos = []  # (absolute tick, tempo) from every track
     ticks_per_beat = mid.ticks_per_beat
-    abs_time = 0  # Absolute time in ticks
     
     for track in mid.tracks:
+        abs_time = 0  # Absolute time in ticks; each track starts at the top
+        held = defaultdict(deque)     # (channel, pitch) -> notes whose key is down
+        pedal_down = set()            # channels with the sustain pedal pressed
+        sustained = defaultdict(dict) # channel -> {pitch: [notes]} kept by the pedal
         for msg in track:
             abs_time += msg.time
             if msg.type == 'set_tempo':
-                tempos.append(msg)
-            if msg.type == 'note_on' and msg.velocity > 0:
-                notes.append({
-                    'note': msg.note,
-                    'start': abs_time,
-                    'end': None,
-                    'velocity': msg.velocity
-                })
-            elif msg.type in ['note_off', 'note_on'] and msg.velocity == 0:
-                for note in notes:
-                    if note['note'] == msg.note and note['end'] is None:
+                tempos.append((abs_time, msg.tempo))
+            elif msg.type == 'note_on' and msg.velocity > 0:
+                # Re-striking a pedalled key cuts the old note
+                for note in sustained[msg.channel].pop(msg.note, ()):
+                    note['end'] = abs_time
+                note = {'note': msg.note, 'start': abs_time, 'end': None,
+                        'velocity': msg.velocity}
+                notes.append(note)
+                held[(msg.channel, msg.note)].append(note)
+            elif msg.type in ['note_off', 'note_on']:
+                waiting = held.get((msg.channel, msg.note))
+                if waiting:
+                    note = waiting.popleft()
+                    if msg.channel in pedal_down:
+                        sustained[msg.channel].setdefault(msg.note, []).append(note)
+                    else:
                         note['end'] = abs_time
-                        break
-    # Filter out incomplete notes
+            elif sustain and msg.type == 'control_change' and msg.control == 64:
+                if msg.value >= 64:
+                    pedal_down.add(msg.channel)
+                else:
+                    pedal_down.discard(msg.channel)
+                    for pedalled in sustained.pop(msg.channel, {}).values():
+                        for note in pedalled:
+                            note['end'] = abs_time
+        # The pedal never lifted: pedalled notes end with the track
+        for pedalled_notes in sustained.values():
+            for pedalled in pedalled_notes.values():
+                for note in pedalled:
+                    note['end'] = abs_time
+    # Filter out incomplete notes and merge tracks in time order
     notes = [n for n in notes if n['end'] is not None]
-    return notes, ticks_per_beat, tempos
+    notes.sort(key=lambda n: n['start'])
+    return notes, ticks_per_beat, TempoMap(ticks_per_beat, tempos)
+
+def load_or_build(midi_path, order=2, cache=None):
+    """parse_midi + build_markov_model, reusing a cached result for the same file"""
+    if cache is not None:
+        key = model_cache.cache_key(midi_path, 'MIDItoMAV', order=order)
+        hit = cache.load(key)
+        if hit is not None:
+            arrays, meta = hit
+            notes = model_cache.records_from_array(arrays['notes'])
+            model = model_cache.list_model_from_arrays(arrays)
+            return (notes, meta['ticks_per_beat'],
+                    TempoMap.from_meta(meta['ticks_per_beat'], meta['tempos']), model)
+    notes, ticks_per_beat, tempos = parse_midi(midi_path)
+    model = build_markov_model(notes, order)
+    if cache is not None:
+        arrays = model_cache.list_model_to_arrays(model, order)
+        arrays['notes'] = model_cache.records_to_array(notes, ('note', 'start', 'end', 'velocity'))
+        cache.save(key, arrays, {'ticks_per_beat': ticks_per_beat,
+                                 'tempos': tempos.to_meta()})
+    return notes, ticks_per_beat, tempos, model
 
 # ===================== MARKOV MODEL =====================
 def build_markov_model(notes, order=2):
@@ -57,18 +115,19 @@ def generate_continuation(model, last_notes, length=50):
     return continuation
 
 # ===================== MIDI GENERATION =====================
-def save_midi(original_notes, new_notes, ticks_per_beat, tempos, output_path):
-    """Save MIDI with proper event timing"""
+def continuation_midi(original_notes, new_notes, ticks_per_beat, tempos):
+    """Build the continuation as an in-memory MidiFile with proper event timing
+
+    `tempos` is the TempoMap from parse_midi; each change is written at its
+    own tick, ahead of notes on the same tick.
+    """
     mid = MidiFile(ticks_per_beat=ticks_per_beat)
     track = MidiTrack()
     mid.tracks.append(track)
     
-    # Add tempo events
-    for tempo in tempos:
-        track.append(tempo)
-    
-    # Create events list
-    events = []
+    # Create events list, tempo changes first so they stay first on a shared tick
+    events = [{'type': 'set_tempo', 'time': tick, 'message': message}
+              for tick, message in tempos.messages()]
     
     # Add original notes
     for note in original_notes:
@@ -92,50 +151,40 @@ def save_midi(original_notes, new_notes, ticks_per_beat, tempos, output_path):
     prev_time = 0
     for event in events:
         delta = event['time'] - prev_time
-        track.append(Message(event['type'], note=event['note'], 
-                    velocity=event['velocity'], time=delta))
+        if event['type'] == 'set_tempo':
+            track.append(event['message'].copy(time=delta))
+        else:
+            track.append(Message(event['type'], note=event['note'], 
+                        velocity=event['velocity'], time=delta))
         prev_time = event['time']
-    
-    mid.save(output_path)
+    return mid
+
+def save_midi(original_notes, new_notes, ticks_per_beat, tempos, output_path):
+    """Save MIDI with proper event timing"""
+    continuation_midi(original_notes, new_notes, ticks_per_beat, tempos).save(output_path)
 
 # ===================== WAV CONVERSION =====================
-def midi_to_wav(midi_path, wav_path, sample_rate=44100):
-    """Convert MIDI to WAV using basic synthesis"""
-    mid = MidiFile(midi_path)
-    audio = np.zeros(int(mid.length * sample_rate * 1.2))  # 20% padding
-    
-    for track in mid.tracks:
-        current_time = 0.0  # Time in seconds
-        active_notes = {}
-        
-        for msg in track:
-            # Convert delta time to seconds
-            delta_seconds = mido.tick2second(msg.time, mid.ticks_per_beat, 500000)
-            current_time += delta_seconds
-            
-            if msg.type == 'note_on' and msg.velocity > 0:
-                freq = 440.0 * (2 ** ((msg.note - 69) / 12))
-                start_sample = int(current_time * sample_rate)
-                active_notes[msg.note] = (start_sample, freq)
-                
-            elif msg.type in ['note_off', 'note_on'] and msg.velocity == 0:
-                if msg.note in active_notes:
-                    start_sample, freq = active_notes.pop(msg.note)
-                    duration = current_time - (start_sample / sample_rate)
-                    
-                    if duration > 0:
-                        t = np.linspace(0, duration, int(sample_rate * duration))
-                        wave = 0.3 * np.sin(2 * np.pi * freq * t)
-                        end_sample = start_sample + len(wave)
-                        
-                        if end_sample > len(audio):
-                            audio = np.pad(audio, (0, end_sample - len(audio)))
-                        
-                        audio[start_sample:end_sample] += wave
+def midi_to_wav(midi_path, wav_path, sample_rate=44100, streaming=False, normalize='two-pass',
+                workers=1, format='wav', bits=16):
+    """Convert MIDI to WAV (or FLAC) using basic synthesis
 
-    # Normalize and save
-    audio /= np.max(np.abs(audio))
-    wavfile.write(wav_path, sample_rate, (audio * 32767).astype(np.int16))
+    `midi_path` may also be a file object or an in-memory MidiFile, and
+    `wav_path` a writable binary file object. `format` is 'wav' or 'flac' and
+    `bits` 8 or 16. streaming=True renders and writes WAV in fixed-size blocks
+    so memory stays flat for arbitrarily long files; `normalize` picks
+    'two-pass' or 'limiter'. Otherwise `workers` processes render time
+    segments of the file in parallel.
+    """
+    if streaming and format != 'wav':
+        raise ValueError('streaming writes WAV only')
+    starts, durations, pitches, _ = synth.midi_note_events(midi_path)
+    if streaming:
+        synth.render_to_wav(wav_path, starts, durations, pitches,
+                            sample_rate=sample_rate, normalize=normalize, bits=bits)
+        return
+    audio = synth.render_notes(starts, durations, pitches, sample_rate=sample_rate,
+                               workers=workers)
+    audio_codec.write_audio(wav_path, audio, sample_rate, format, bits)
 
 # ===================== MAIN WORKFLOW =====================
 def main():
@@ -144,24 +193,44 @@ def main():
     parser.add_argument('output', help='Output base name')
     parser.add_argument('--length', type=int, default=50)
     parser.add_argument('--order', type=int, default=2)
+    parser.add_argument('--stream', action='store_true',
+                        help='Render the WAV in blocks with bounded memory')
+    parser.add_argument('--normalize', choices=['two-pass', 'limiter'], default='two-pass',
+                        help='Loudness strategy when streaming')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes rendering the WAV in parallel (not with --stream)')
+    parser.add_argument('--format', choices=audio_codec.FORMATS, default='wav',
+                        help='Audio output format (FLAC is lossless and smaller)')
+    parser.add_argument('--bits', type=int, choices=[8, 16], default=16,
+                        help='Bits per sample')
+    parser.add_argument('--sample_rate', type=int, default=44100)
+    parser.add_argument('--cache_dir', default=None, help='Model cache directory')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Always re-parse and rebuild the model')
     
     args = parser.parse_args()
+    if args.stream and args.format != 'wav':
+        parser.error('--stream writes WAV only')
     
-    notes, ticks, tempos = parse_midi(args.input)
+    cache = None if args.no_cache else model_cache.ModelCache(args.cache_dir)
+    notes, ticks, tempos, model = load_or_build(args.input, args.order, cache)
     if not notes:
         print("Error: No notes found")
         exit(1)
     
-    model = build_markov_model(notes, args.order)
     new_notes = generate_continuation(model, [n['note'] for n in notes[-args.order:]], args.length)
     
     midi_out = f"{args.output}.mid"
-    save_midi(notes, new_notes, ticks, tempos, midi_out)
+    mid = continuation_midi(notes, new_notes, ticks, tempos)
+    mid.save(midi_out)
     
-    wav_out = f"{args.output}.wav"
-    midi_to_wav(midi_out, wav_out)
+    # Render from the MidiFile already in memory rather than re-reading the file
+    audio_out = f"{args.output}.{args.format}"
+    midi_to_wav(mid, audio_out, args.sample_rate, streaming=args.stream,
+                normalize=args.normalize, workers=args.workers, format=args.format,
+                bits=args.bits)
     
-    print(f"Success! Created {midi_out} and {wav_out}")
+    print(f"Success! Created {midi_out} and {audio_out}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
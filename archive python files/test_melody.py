@@ -1,25 +1,49 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 try:
-    from test_model import generate_melody
+    from test_model import generate_melody, registry
 except ImportError:
     import sys
     sys.path.append('/path/to/your/module')
-    from test_model import generate_melody
+    from test_model import generate_melody, registry
 import numpy as np
+try:
+    from generation_server import ServiceError, ingest_notes
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from generation_server import ServiceError, ingest_notes
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS
 
 @app.route('/generate', methods=['POST'])
 def generate():
-    data = request.json
-    notes = data.get('notes')
-    if not notes:
-        return jsonify({'error': 'No notes provided'}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        # Numbers, names or recorded {note, time} objects, checked in one pass
+        notes = ingest_notes(data.get('notes'))
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status
 
-    generated_notes = generate_melody(notes)
+    generated_notes = generate_melody(notes['pitch'].tolist())
     return jsonify({'generated_notes': generated_notes})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify(registry.snapshot())
+
+@app.route('/reload', methods=['POST'])
+def reload():
+    """Swap in new weights (optionally from a new path) without a restart"""
+    data = request.get_json(silent=True) or {}
+    try:
+        registry.load(data.get('weights_path'))
+    except (OSError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(registry.snapshot())
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    registry.load()  # Build and warm up before the first request arrives
+    app.run(debug=True, use_reloader=False)
\ No newline at end of file
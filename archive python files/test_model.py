@@ -1,8 +1,14 @@
+import os
+import threading
+import time
 import numpy as np
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
+
+WEIGHTS_PATH = os.environ.get('MELODY_WEIGHTS', 'path_to_pretrained_model.h5')
 
 def create_model(input_shape):
+    # TensorFlow takes seconds to import; only building a model needs it
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import LSTM, Dense
     model = Sequential()
     model.add(LSTM(128, input_shape=input_shape, return_sequences=True))
     model.add(LSTM(128))
@@ -11,10 +17,115 @@ def create_model(input_shape):
     model.compile(optimizer='adam', loss='mse')
     return model
 
-def generate_melody(notes):
-    model = create_model((None, 1))
-    model.load_weights('path_to_pretrained_model.h5')  # Load your pre-trained model weights
+class ModelRegistry:
+    """Builds and loads the model once, shares it across request threads
+
+    The model is loaded on first use (or by calling load() at startup). If
+    the weights file changes on disk, a replacement is built and warmed up
+    in a background thread and swapped in atomically; requests keep using
+    the old model until then, so a reload never blocks serving.
+    """
+
+    def __init__(self, weights_path=WEIGHTS_PATH, input_shape=(None, 1), check_interval=5.0):
+        self.weights_path = weights_path
+        self.input_shape = input_shape
+        self.check_interval = check_interval
+        self._model = None
+        self._loaded_mtime = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+        self._reloading = False
+        self._stats_lock = threading.Lock()
+        self.metrics = {
+            'loads': 0,
+            'last_load_seconds': None,
+            'last_warmup_seconds': None,
+            'weights_path': weights_path,
+            'inferences': 0,
+            'inference_seconds_total': 0.0,
+            'last_inference_seconds': None,
+        }
+
+    def _build(self, weights_path):
+        """Create, load and warm up a fresh model; returns (model, mtime)"""
+        start = time.perf_counter()
+        mtime = os.path.getmtime(weights_path)
+        model = create_model(self.input_shape)
+        model.load_weights(weights_path)
+        loaded = time.perf_counter()
+        # First call traces the graph; pay that here rather than on a request
+        model(np.zeros((1, 1, 1), dtype=np.float32), training=False)
+        with self._stats_lock:
+            self.metrics['loads'] += 1
+            self.metrics['last_load_seconds'] = loaded - start
+            self.metrics['last_warmup_seconds'] = time.perf_counter() - loaded
+            self.metrics['weights_path'] = weights_path
+        return model, mtime
+
+    def _swap(self, weights_path):
+        model, mtime = self._build(weights_path)
+        self.weights_path = weights_path
+        self._model, self._loaded_mtime = model, mtime
+        self._last_check = time.monotonic()
+        return model
+
+    def load(self, weights_path=None):
+        """Load (or replace) the model now; the swap itself is a single assignment"""
+        with self._load_lock:
+            return self._swap(weights_path or self.weights_path)
 
-    input_sequence = np.array(notes).reshape((1, len(notes), 1))
-    generated_notes = model.predict(input_sequence)
-    return generated_notes.flatten().tolist()
\ No newline at end of file
+    def _reload_in_background(self):
+        def reload():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Keeping current model, reload failed: {str(e)}")
+            finally:
+                self._reloading = False
+        self._reloading = True
+        threading.Thread(target=reload, name='model-reload', daemon=True).start()
+
+    def get(self):
+        """The current model, loading it on first use"""
+        model = self._model
+        if model is None:
+            with self._load_lock:
+                # Another thread may have finished loading while we waited
+                return self._model if self._model is not None else self._swap(self.weights_path)
+        now = time.monotonic()
+        if not self._reloading and now - self._last_check > self.check_interval:
+            self._last_check = now
+            try:
+                changed = os.path.getmtime(self.weights_path) != self._loaded_mtime
+            except OSError:
+                changed = False
+            if changed:
+                self._reload_in_background()
+        return model
+
+    def predict(self, notes):
+        model = self.get()
+        input_sequence = np.array(notes, dtype=np.float32).reshape((1, len(notes), 1))
+        start = time.perf_counter()
+        # Calling the model directly skips predict()'s per-call dataset setup
+        generated_notes = np.asarray(model(input_sequence, training=False))
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.metrics['inferences'] += 1
+            self.metrics['inference_seconds_total'] += elapsed
+            self.metrics['last_inference_seconds'] = elapsed
+        return generated_notes
+
+    def snapshot(self):
+        with self._stats_lock:
+            metrics = dict(self.metrics)
+        count = metrics['inferences']
+        metrics['mean_inference_seconds'] = (metrics['inference_seconds_total'] / count
+                                             if count else None)
+        return metrics
+
+registry = ModelRegistry()
+
+def generate_melody(notes):
+    generated_notes = registry.predict(notes)
+    return generated_notes.flatten().tolist()
@@ -1,140 +1,161 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import numpy as np
-from scipy.io import wavfile
 import mido
 from mido import MidiFile, MidiTrack, Message, MetaMessage
 import random
-import math
+try:
+    import audio_codec
+    import synth
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import audio_codec
+    import synth
 
 # ===================== TEXT TO MUSIC PARAMETERS =====================
+DEFAULT_PARAMS = {
+    'scale': 'major',
+    'tempo': 120,
+    'articulation': 'legato',
+    'rhythm': 'medium',
+    'register': 'middle',
+    'complexity': 0.5
+}
+
+# (keywords, settings) in order of precedence: later rules override earlier ones
+MOOD_RULES = [
+    (('sad', 'dark', 'foreboding'), {'scale': 'minor', 'tempo': 80, 'articulation': 'legato'}),
+    (('happy', 'lighthearted'), {'tempo': 140, 'rhythm': 'bouncy'}),
+    (('angry', 'intense'), {'tempo': 160, 'articulation': 'staccato', 'complexity': 0.8}),
+    (('calm', 'relaxing'), {'tempo': 90, 'rhythm': 'slow'}),
+    (('blues',), {'scale': 'blues'}),
+    (('jazz',), {'scale': 'jazz'}),
+]
+
+# One lookahead alternation finds every keyword, overlapping ones included,
+# in a single scan; matches are substrings, so 'unhappy' still counts as happy
+_KEYWORD_RULE = {keyword: bit for bit, (keywords, _) in enumerate(MOOD_RULES) for keyword in keywords}
+_KEYWORDS = re.compile('(?=(%s))' % '|'.join(sorted(map(re.escape, _KEYWORD_RULE), key=len, reverse=True)))
+
+def _combine_rules(mask):
+    params = dict(DEFAULT_PARAMS)
+    for bit, (_, settings) in enumerate(MOOD_RULES):
+        if mask >> bit & 1:
+            params.update(settings)
+    return params
+
+# Parameters for every combination of matched rules, resolved once
+_MOOD_TABLE = [_combine_rules(mask) for mask in range(1 << len(MOOD_RULES))]
+
 def interpret_mood(text):
     """Convert text description to musical parameters"""
-    text = text.lower()
-    params = {
-        'scale': 'major',
-        'tempo': 120,
-        'articulation': 'legato',
-        'rhythm': 'medium',
-        'register': 'middle',
-        'complexity': 0.5
-    }
-
-    if 'sad' in text or 'dark' in text or 'foreboding' in text:
-        params['scale'] = 'minor'
-        params['tempo'] = 80
-        params['articulation'] = 'legato'
-    if 'happy' in text or 'lighthearted' in text:
-        params['tempo'] = 140
-        params['rhythm'] = 'bouncy'
-    if 'angry' in text or 'intense' in text:
-        params['tempo'] = 160
-        params['articulation'] = 'staccato'
-        params['complexity'] = 0.8
-    if 'calm' in text or 'relaxing' in text:
-        params['tempo'] = 90
-        params['rhythm'] = 'slow'
-    
-    if 'blues' in text:
-        params['scale'] = 'blues'
-    if 'jazz' in text:
-        params['scale'] = 'jazz'
-    
-    return params
+    mask = 0
+    for keyword in _KEYWORDS.findall(text.lower()):
+        mask |= 1 << _KEYWORD_RULE[keyword]
+    return dict(_MOOD_TABLE[mask])
+
+SCALES = {
+    'major': [0, 2, 4, 5, 7, 9, 11],
+    'minor': [0, 2, 3, 5, 7, 8, 10],
+    'blues': [0, 3, 5, 6, 7, 10],
+    'jazz': [0, 2, 4, 6, 7, 9, 10, 11]
+}
 
 def get_scale(root=60, scale_type='major'):
     """Return MIDI notes for different scales"""
-    scales = {
-        'major': [0, 2, 4, 5, 7, 9, 11],
-        'minor': [0, 2, 3, 5, 7, 8, 10],
-        'blues': [0, 3, 5, 6, 7, 10],
-        'jazz': [0, 2, 4, 6, 7, 9, 10, 11]
-    }
-    return [root + interval for interval in scales.get(scale_type, scales['major'])]
+    return [root + interval for interval in SCALES.get(scale_type, SCALES['major'])]
+
+ROOT_NOTE = 60  # Middle C
+_SCALE_NOTES = {name: get_scale(ROOT_NOTE, name) for name in SCALES}
+
+RHYTHM_DURATIONS = {'bouncy': [240, 480, 720], 'slow': [480, 960]}
 
 # ===================== MELODY GENERATION =====================
-def generate_melody_from_text(text, length=16):
-    """Generate melody based on text description"""
+def generate_melody_from_text(text, length=16, rng=random):
+    """Generate melody based on text description
+
+    `rng` is anything with choice() and randint(), e.g. a random.Random per
+    prompt so batch results do not depend on which worker ran them.
+    """
     params = interpret_mood(text)
-    root_note = 60  # Middle C
-    scale = get_scale(root_note, params['scale'])
+    scale = _SCALE_NOTES.get(params['scale'], _SCALE_NOTES['major'])
+    durations = RHYTHM_DURATIONS.get(params['rhythm'], [480])
     
     melody = []
-    current_note = root_note
+    position = 0  # The root, scale[0]
     
     for _ in range(length):
-        if params['rhythm'] == 'bouncy':
-            durations = [240, 480, 720]
-        elif params['rhythm'] == 'slow':
-            durations = [480, 960]
-        else:
-            durations = [480]
-        
-        step = random.choice([-2, -1, 1, 2])
-        current_note = scale[(scale.index(current_note) + step) % len(scale)]
+        step = rng.choice([-2, -1, 1, 2])
+        position = (position + step) % len(scale)
         
         melody.append({
-            'note': current_note,
-            'duration': random.choice(durations),
-            'velocity': random.randint(60, 100)
+            'note': scale[position],
+            'duration': rng.choice(durations),
+            'velocity': rng.randint(60, 100)
         })
     
     return melody, params
 
+def melody_to_midi(melody, tempo_bpm):
+    """One-track MidiFile playing the melody's notes back to back"""
+    mid = MidiFile()
+    track = MidiTrack()
+    mid.tracks.append(track)
+    track.append(MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo_bpm)))
+    
+    for note in melody:
+        track.append(Message('note_on', note=note['note'], 
+                         velocity=note['velocity'], time=0))
+        track.append(Message('note_off', note=note['note'], 
+                         velocity=0, time=note['duration']))
+    return mid
+
 # ===================== AUDIO SYNTHESIS =====================
-def midi_to_freq(note):
-    """Convert MIDI note number to frequency"""
-    return 440.0 * (2 ** ((note - 69) / 12))
-
-def synthesize_wav(midi_data, output_file, sample_rate=44100):
-    """Convert MIDI data to WAV using basic synthesis"""
-    # Calculate total duration in seconds
-    total_ticks = sum(n['duration'] for n in midi_data)
+ENVELOPE = (0.05, 0.1, 0.7, 0.2)  # attack, decay, sustain level, release
+
+def synthesize_wav(midi_data, output_file, sample_rate=44100, streaming=False, tempo=500000,
+                   voices=None, workers=1, format='wav', bits=16):
+    """Convert MIDI data to WAV (or FLAC) using basic synthesis
+
+    `output_file` is a path or a writable binary file object; `format` is
+    'wav' or 'flac' and `bits` 8 or 16. streaming=True renders WAV and writes
+    in fixed-size blocks (two-pass normalisation) instead of holding the whole
+    song in memory. `tempo` is in
+    microseconds per beat and should match the tempo written to the MIDI file.
+    Otherwise notes are mixed in float32 from a synth.VoiceCache (pass one in
+    `voices` to share it between calls), so each distinct (pitch, duration,
+    velocity) is rendered once; workers > 1 renders time segments in parallel
+    processes, each with its own cache.
+    """
     ticks_per_beat = 480  # Standard MIDI ticks per quarter note
-    tempo = 500000  # Default tempo (120 BPM)
-    total_time = mido.tick2second(total_ticks, ticks_per_beat, tempo)
+    durations = np.array([mido.tick2second(n['duration'], ticks_per_beat, tempo)
+                          for n in midi_data])
+    pitches = [n['note'] for n in midi_data]
+    velocities = np.array([n['velocity'] for n in midi_data], dtype=np.float32)
     
-    # Create empty audio buffer
-    audio = np.zeros(int(total_time * sample_rate))
+    if streaming:
+        if format != 'wav':
+            raise ValueError('streaming writes WAV only')
+        starts = np.concatenate([[0], np.cumsum(durations)[:-1]])
+        synth.render_to_wav(output_file, starts, durations, pitches, velocities,
+                            sample_rate=sample_rate, envelope=ENVELOPE, bits=bits)
+        return
     
-    current_sample = 0
-    for note in midi_data:
-        freq = midi_to_freq(note['note'])
-        duration = mido.tick2second(note['duration'], ticks_per_beat, tempo)
-        t = np.linspace(0, duration, int(duration * sample_rate))
-        wave = 0.3 * np.sin(2 * np.pi * freq * t)
-        
-        # Apply ADSR envelope
-        attack = 0.05
-        decay = 0.1
-        sustain_level = 0.7
-        release = 0.2
-        
-        envelope = np.ones_like(wave)
-        n_attack = int(attack * sample_rate)
-        n_decay = int(decay * sample_rate)
-        n_release = int(release * sample_rate)
-        
-        # Attack
-        envelope[:n_attack] = np.linspace(0, 1, n_attack)
-        # Decay
-        envelope[n_attack:n_attack+n_decay] = np.linspace(1, sustain_level, n_decay)
-        # Sustain
-        envelope[n_attack+n_decay:-n_release] = sustain_level
-        # Release
-        envelope[-n_release:] = np.linspace(sustain_level, 0, n_release)
-        
-        wave *= envelope
-        wave *= note['velocity'] / 127  # Velocity scaling
-        
-        end_sample = current_sample + len(wave)
-        if end_sample > len(audio):
-            audio = np.pad(audio, (0, end_sample - len(audio)))
-        
-        audio[current_sample:end_sample] += wave
-        current_sample += len(wave)
+    # Notes play back to back; whole-sample lengths keep equal durations equal
+    lengths = (durations * sample_rate).astype(np.int64)
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    gains = synth.AMPLITUDE * velocities / 127  # Velocity scaling
+    voices = voices or synth.VoiceCache(sample_rate)
+    audio = synth.mix_notes(first, lengths, pitches, gains, sample_rate,
+                            envelope=ENVELOPE, voices=voices, workers=workers)
     
     # Normalize and save
-    audio /= np.max(np.abs(audio))
-    wavfile.write(output_file, sample_rate, (audio * 32767).astype(np.int16))
+    audio_codec.write_audio(output_file, audio, sample_rate, format, bits)
 
 # ===================== MAIN INTERFACE =====================
 def main():
@@ -146,26 +167,106 @@ def main():
     output_base = "generated_melody"
     
     # Save MIDI
-    mid = MidiFile()
-    track = MidiTrack()
-    mid.tracks.append(track)
-    track.append(MetaMessage('set_tempo', tempo=mido.bpm2tempo(params['tempo'])))
-    
-    for note in melody:
-        track.append(Message('note_on', note=note['note'], 
-                         velocity=note['velocity'], time=0))
-        track.append(Message('note_off', note=note['note'], 
-                         velocity=0, time=note['duration']))
-    
-    mid.save(f"{output_base}.mid")
+    melody_to_midi(melody, params['tempo']).save(f"{output_base}.mid")
     
     # Generate WAV
-    synthesize_wav(melody, f"{output_base}.wav")
+    synthesize_wav(melody, f"{output_base}.wav", tempo=mido.bpm2tempo(params['tempo']))
     
     print(f"\n🎶 Created '{output_base}.mid' and '{output_base}.wav' with:")
     print(f"- Scale: {params['scale'].title()}")
     print(f"- Tempo: {params['tempo']} BPM")
     print(f"- Mood: {user_input}")
 
+# ===================== BATCH GENERATION =====================
+_voices = None  # Per-process voice cache, shared by every prompt a worker renders
+
+def render_prompts(first_index, prompts, output_dir, length=16, seed=None, wav=True):
+    """Write <index>.mid (and .wav) for consecutive prompts; returns their summaries
+
+    Prompt i draws from random.Random(f"{seed}:{i}"), so a seeded batch gives
+    the same files whatever the worker count.
+    """
+    global _voices
+    if wav and _voices is None:
+        _voices = synth.VoiceCache()
+    results = []
+    for index, prompt in enumerate(prompts, first_index):
+        rng = random.Random(None if seed is None else f"{seed}:{index}")
+        melody, params = generate_melody_from_text(prompt, length, rng)
+        base = os.path.join(output_dir, f"{index:06d}")
+        melody_to_midi(melody, params['tempo']).save(f"{base}.mid")
+        if wav:
+            synthesize_wav(melody, f"{base}.wav", tempo=mido.bpm2tempo(params['tempo']),
+                           voices=_voices)
+        results.append((index, prompt, params['scale'], params['tempo']))
+    return results
+
+def generate_batch(prompts, output_dir, length=16, seed=None, wav=True, workers=1, chunk=32):
+    """Generate one melody per prompt from any iterable, e.g. a file or stdin
+
+    Prompts are read lazily in chunks of `chunk`; with workers > 1 at most
+    two chunks per worker are in flight, so a stream of any length runs in
+    bounded memory. Yields each prompt's (index, prompt, scale, tempo) in
+    input order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prompts = iter(prompts)
+    chunks = ((index * chunk, batch) for index, batch in
+              enumerate(iter(lambda: list(islice(prompts, chunk)), [])))
+    if workers <= 1:
+        for first_index, batch in chunks:
+            yield from render_prompts(first_index, batch, output_dir, length, seed, wav)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = []
+        for first_index, batch in chunks:
+            pending.append(pool.submit(render_prompts, first_index, batch, output_dir,
+                                       length, seed, wav))
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+def read_prompts(source):
+    """Non-blank lines of a file or open stream, stripped"""
+    for line in source:
+        line = line.strip()
+        if line:
+            yield line
+
+def batch_main(args):
+    try:
+        source = sys.stdin if args.prompts == '-' else open(args.prompts, encoding='utf-8')
+    except OSError as e:
+        print(f"Error reading prompts: {str(e)}")
+        exit(1)
+    start = time.perf_counter()
+    count = 0
+    with source:
+        for index, prompt, scale, tempo in generate_batch(
+                read_prompts(source), args.output_dir, args.length, args.seed,
+                not args.no_wav, args.workers, args.chunk):
+            count += 1
+            if args.verbose:
+                print(f"{index:06d}  {scale:5s} {tempo:3d} BPM  {prompt}")
+    elapsed = time.perf_counter() - start
+    print(f"Generated {count} melodies in {args.output_dir} in {elapsed:.2f} s "
+          f"({count / elapsed if elapsed else 0:.1f} prompts/s)")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) == 1:
+        main()
+    else:
+        parser = argparse.ArgumentParser(description='Text-to-melody generation for many prompts')
+        parser.add_argument('prompts', help="File with one prompt per line, or '-' for stdin")
+        parser.add_argument('output_dir', help='Directory for <index>.mid and <index>.wav')
+        parser.add_argument('--length', type=int, default=16, help='Notes per melody (default: 16)')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Make every prompt reproducible from (seed, index), where the index '
+                                 'counts non-blank prompts from 0')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes writing files (default: one per CPU)')
+        parser.add_argument('--chunk', type=int, default=32, help='Prompts per worker task')
+        parser.add_argument('--no_wav', action='store_true', help='Write MIDI files only')
+        parser.add_argument('--verbose', action='store_true', help='Print a line per prompt')
+        batch_main(parser.parse_args())
\ No newline at end of file
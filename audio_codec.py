@@ -0,0 +1,283 @@
+import hashlib
+import io
+import wave
+import numpy as np
+
+FORMATS = ('wav', 'flac')
+FLAC_BLOCK_SIZE = 4096
+MAX_PARTITION_ORDER = 8
+MAX_RICE_PARAMETER = 14  # 4-bit parameters; 15 is the escape code
+
+def quantize(audio, bits=16):
+    """Peak-normalise float audio to signed `bits`-bit integers, like synth.write_wav"""
+    peak = np.max(np.abs(audio)) if len(audio) else 0
+    if peak > 0:
+        audio = audio / peak
+    return (audio * ((1 << (bits - 1)) - 1)).astype(np.int8 if bits == 8 else np.int16)
+
+def wav_bytes(samples, sample_rate, bits=16):
+    """Mono PCM WAV file contents; 8-bit WAV stores unsigned bytes"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(bits // 8)
+        out.setframerate(sample_rate)
+        if bits == 8:
+            out.writeframes((samples.astype(np.int16) + 128).astype(np.uint8).tobytes())
+        else:
+            out.writeframes(samples.astype('<i2').tobytes())
+    return buffer.getvalue()
+
+# ===== CRCs =====
+
+def _crc_table(poly, width):
+    top, mask = 1 << (width - 1), (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+_CRC8 = _crc_table(0x07, 8)
+_CRC16 = np.array(_crc_table(0x8005, 16), dtype=np.uint16)
+_crc16_by_distance = _CRC16[None, :]
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8[crc ^ byte]
+    return crc
+
+def _crc16_tables(length):
+    """Row d: the CRC-16 contribution of each byte value followed by d more bytes"""
+    global _crc16_by_distance
+    rows = [_crc16_by_distance]
+    last = _crc16_by_distance[-1].astype(np.int64)
+    for _ in range(length - len(_crc16_by_distance)):
+        # Feeding a zero byte: crc = (crc << 8) ^ table[crc >> 8]
+        last = ((last << 8) & 0xFFFF) ^ _CRC16[last >> 8]
+        rows.append(last[None, :].astype(np.uint16))
+    _crc16_by_distance = np.concatenate(rows)
+    return _crc16_by_distance
+
+def _crc16_many(data, starts):
+    """CRC-16 of each run data[starts[i]:starts[i+1]], all runs at once
+
+    The CRC is linear, so every byte contributes a table entry chosen by its
+    value and its distance from the end of its run; XOR-ing them gives the CRC.
+    """
+    ends = np.append(starts[1:], len(data))
+    run = np.repeat(np.arange(len(starts)), ends - starts)
+    distance = ends[run] - 1 - np.arange(len(data))
+    tables = _crc16_tables(int(np.max(ends - starts)) if len(starts) else 1)
+    return np.bitwise_xor.reduceat(tables[distance, data], starts)
+
+# ===== FLAC =====
+
+def _pack_bits(total_bits, starts, widths, values):
+    """Bitstream with each value's low `widths` bits written MSB first at `starts`"""
+    size = (total_bits + 7) // 8
+    byte, offset = starts >> 3, starts & 7
+    word = values.astype(np.uint64) << (64 - offset - widths).astype(np.uint64)
+    out = np.zeros(size + 8, dtype=np.float64)
+    lanes = int(np.max((offset + widths + 7) // 8)) if len(starts) else 0
+    for lane in range(lanes):
+        part = (word >> np.uint64(56 - 8 * lane)) & np.uint64(0xFF)
+        # Fields never share bits, so summing the bytes they touch is an OR
+        out += np.bincount(byte + lane, weights=part.astype(np.float64), minlength=len(out))
+    return out[:size].astype(np.uint8)
+
+def _utf8_number(number):
+    """FLAC's UTF-8-style coding of the frame number"""
+    if number < 0x80:
+        return bytes([number])
+    payload = []
+    while True:
+        payload.append(0x80 | (number & 0x3F))
+        number >>= 6
+        if number < (1 << (6 - len(payload))):
+            break
+    lead = (0xFF00 >> (len(payload) + 1)) & 0xFF | number
+    return bytes([lead] + payload[::-1])
+
+def _max_partition_order(block_size):
+    """Largest Rice partition order that splits a block evenly into partitions
+    longer than a 4th-order predictor's warm-up"""
+    order = 0
+    while (order < MAX_PARTITION_ORDER and block_size % (2 << order) == 0
+           and block_size >> (order + 1) > 4):
+        order += 1
+    return order
+
+def _frame_header(index, size, bits):
+    header = bytearray([0xFF, 0xF8,
+                        0x70,  # block size as 16 bits at the end, rate from STREAMINFO
+                        0x02 if bits == 8 else 0x08])  # mono, 8 or 16 bits per sample
+    header += _utf8_number(index)
+    header += (size - 1).to_bytes(2, 'big')
+    header.append(_crc8(header))
+    return bytes(header)
+
+def _encode_frames(samples, first_frame, bits, block_size):
+    """FLAC frames for `samples`, which start on a frame boundary"""
+    n = len(samples)
+    frame_starts = np.arange(0, n, block_size)
+    frame_sizes = np.minimum(block_size, n - frame_starts)
+    frames = len(frame_starts)
+    frame = np.repeat(np.arange(frames), frame_sizes)
+    position = np.arange(n) - frame_starts[frame]
+
+    # Fixed predictors of order 0-4 are repeated differences
+    x = samples.astype(np.int64)
+    residuals = np.zeros((5, n), dtype=np.int64)
+    residuals[0] = x
+    for order in range(1, 5):
+        residuals[order, order:] = np.diff(residuals[order - 1, order - 1:])
+    errors = np.stack([np.add.reduceat(np.abs(residuals[order]) * (position >= order), frame_starts)
+                       for order in range(5)])
+    errors[np.arange(5)[:, None] >= frame_sizes[None, :]] = np.iinfo(np.int64).max
+    orders = np.argmin(errors, axis=0)
+    order_of = orders[frame]
+    warmup = position < order_of
+    residual = residuals[order_of, np.arange(n)]
+    folded = np.where(warmup, 0, (residual << 1) ^ (residual >> 63))
+
+    # Rice cost of every parameter over the smallest partitions, summed up
+    # for the larger ones; parameter k costs (u >> k) + 1 + k bits per residual
+    partitions = _max_partition_order(block_size)
+    cells = np.arange(0, n, block_size >> partitions)
+    cell_index = np.arange(len(cells))
+    counts = np.add.reduceat(~warmup, cells).astype(np.int64)
+    parameters = np.arange(MAX_RICE_PARAMETER + 1)[:, None]
+    cost = np.stack([np.add.reduceat(folded >> k, cells)
+                     for k in range(MAX_RICE_PARAMETER + 1)]) + (parameters + 1) * counts
+    full = frame_sizes == block_size
+    best_bits = np.full(frames, np.iinfo(np.int64).max)
+    best_order = np.zeros(frames, dtype=np.int64)
+    for partition_order in range(partitions + 1):
+        slot = ((cell_index >> partitions << partition_order)
+                + ((cell_index & ((1 << partitions) - 1)) >> (partitions - partition_order)))
+        first = np.flatnonzero(np.diff(slot, prepend=-1))
+        merged = np.add.reduceat(cost, first, axis=1)
+        total = np.bincount(slot[first] >> partition_order, weights=merged.min(axis=0) + 4,
+                            minlength=frames).astype(np.int64)
+        if partition_order:
+            # The partial last frame keeps a single partition
+            total[~full] = np.iinfo(np.int64).max
+        better = total < best_bits
+        best_bits[better] = total[better]
+        best_order[better] = partition_order
+
+    # Subframe kind per frame: constant, fixed predictor, or verbatim
+    constant = np.maximum.reduceat(x, frame_starts) == np.minimum.reduceat(x, frame_starts)
+    fixed_bits = 8 + orders * bits + 6 + best_bits
+    verbatim_bits = 8 + frame_sizes * bits
+    kind = np.where(constant, 0, np.where(fixed_bits < verbatim_bits, 2, 1))
+    subframe_bits = np.select([kind == 0, kind == 2], [8 + bits, fixed_bits], verbatim_bits)
+    subframe_bytes = (subframe_bits + 7) // 8
+    subframe_start = np.concatenate([[0], np.cumsum(subframe_bytes)[:-1]]) * 8
+
+    mask = (1 << bits) - 1
+    fields = []  # (start bit, width, value) arrays
+    header = np.select([kind == 0, kind == 1], [0x00, 0x02], 0x10 | (orders << 1))
+    fields.append((subframe_start, np.full(frames, 8), header))
+    # Constant subframes hold their first sample, verbatim ones every sample
+    index = np.flatnonzero(((kind == 0)[frame] & (position == 0)) | (kind == 1)[frame])
+    fields.append((subframe_start[frame[index]] + 8 + position[index] * bits,
+                   np.full(len(index), bits), x[index] & mask))
+
+    fixed = kind == 2
+    if fixed.any():
+        in_fixed = fixed[frame]
+        index = np.flatnonzero(in_fixed & warmup)
+        fields.append((subframe_start[frame[index]] + 8 + position[index] * bits,
+                       np.full(len(index), bits), x[index] & mask))
+        rice_start = subframe_start + 8 + orders * bits
+        fields.append((rice_start[fixed], np.full(int(fixed.sum()), 6), best_order[fixed]))
+
+        # The cheapest parameter of each chosen partition, from the cell costs
+        cell_frame = cell_index >> partitions
+        cell_part = (cell_index & ((1 << partitions) - 1)) >> (partitions - best_order[cell_frame])
+        slot = (cell_frame << partitions) + cell_part
+        first = np.flatnonzero(np.diff(slot, prepend=-1))
+        parameter = np.zeros((frames, 1 << partitions), dtype=np.int64)
+        parameter[cell_frame[first], cell_part[first]] = np.argmin(
+            np.add.reduceat(cost, first, axis=1), axis=0)
+
+        index = np.flatnonzero(in_fixed & ~warmup)
+        owner = frame[index]
+        part = position[index] // (frame_sizes >> best_order)[owner]
+        u = folded[index]
+        k = parameter[owner, part]
+        code_bits = (u >> k) + 1 + k
+        # Bits before each code within its frame: earlier codes plus one
+        # 4-bit parameter per partition so far
+        before = np.cumsum(code_bits) - code_bits
+        frame_bits = np.bincount(owner, weights=code_bits, minlength=frames).astype(np.int64)
+        before -= (np.cumsum(frame_bits) - frame_bits)[owner]
+        code_start = rice_start[owner] + 6 + 4 * (part + 1) + before
+        fields.append((code_start + (u >> k), k + 1, (1 << k) | (u & ((1 << k) - 1))))
+        first_code = np.flatnonzero(np.diff(owner * (1 << partitions) + part, prepend=-1))
+        fields.append((code_start[first_code] - 4, np.full(len(first_code), 4), k[first_code]))
+
+    starts, widths, values = (np.concatenate([f[i] for f in fields]).astype(np.int64)
+                              for i in range(3))
+    packed = _pack_bits(int(subframe_bytes.sum()) * 8, starts, widths, values)
+
+    # Frame = header + subframe + CRC-16 of both
+    headers = [_frame_header(first_frame + i, int(size), bits) for i, size in enumerate(frame_sizes)]
+    pieces = []
+    offsets = np.concatenate([[0], np.cumsum(subframe_bytes)])
+    for i, head in enumerate(headers):
+        pieces.append(np.frombuffer(head, dtype=np.uint8))
+        pieces.append(packed[offsets[i]:offsets[i + 1]])
+    body = np.concatenate(pieces)
+    lengths = np.array([len(head) for head in headers]) + subframe_bytes
+    body_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    crcs = _crc16_many(body, body_starts)
+    out = bytearray()
+    for i in range(frames):
+        out += body[body_starts[i]:body_starts[i] + lengths[i]].tobytes()
+        out += int(crcs[i]).to_bytes(2, 'big')
+    return bytes(out)
+
+def flac_bytes(samples, sample_rate, bits=16, block_size=FLAC_BLOCK_SIZE, frames_per_chunk=64):
+    """Mono FLAC file contents using fixed predictors and partitioned Rice coding
+
+    Frames are encoded `frames_per_chunk` at a time with numpy, so memory
+    stays bounded for long renders.
+    """
+    samples = np.asarray(samples)
+    md5 = hashlib.md5(samples.astype('<i1' if bits == 8 else '<i2').tobytes()).digest()
+    info = (block_size << 128 | block_size << 112 | sample_rate << 44 | (bits - 1) << 36
+            | len(samples)) << 128 | int.from_bytes(md5, 'big')
+    out = bytearray(b'fLaC')
+    out += bytes([0x80]) + (34).to_bytes(3, 'big')  # last metadata block: STREAMINFO
+    out += info.to_bytes(34, 'big')
+    step = block_size * frames_per_chunk
+    for start in range(0, len(samples), step):
+        out += _encode_frames(samples[start:start + step], start // block_size, bits, block_size)
+    return bytes(out)
+
+def encode_audio(audio, sample_rate, format='wav', bits=16):
+    """Normalised float audio -> file contents in `format` ('wav' or 'flac'), 8 or 16 bits"""
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if bits not in (8, 16):
+        raise ValueError('bits must be 8 or 16')
+    samples = quantize(audio, bits)
+    if format == 'flac':
+        return flac_bytes(samples, sample_rate, bits)
+    return wav_bytes(samples, sample_rate, bits)
+
+def write_audio(output, audio, sample_rate, format='wav', bits=16):
+    """Encode to a path or a writable binary file object; returns the byte count"""
+    data = encode_audio(audio, sample_rate, format, bits)
+    if hasattr(output, 'write'):
+        output.write(data)
+    else:
+        with open(output, 'wb') as f:
+            f.write(data)
+    return len(data)
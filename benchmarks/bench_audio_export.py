@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from scipy.io import wavfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'archive python files'))
+import audio_codec
+import shortMIDI
+import synth
+import MIDItoMAV
+from bench_suite import synthetic_midi
+
+def best_of(repeats, fn, *args):
+    """(fastest seconds, result of the last call)"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def current_wav(audio, sample_rate, tmp):
+    """The previous export: peak-normalise, scipy's 16-bit WAV writer, to disk"""
+    path = os.path.join(tmp, 'current.wav')
+    peak = np.max(np.abs(audio))
+    wavfile.write(path, sample_rate, (audio / peak * 32767).astype(np.int16))
+    return os.path.getsize(path)
+
+def encoders(tmp):
+    yield 'current wav16 file', lambda audio, rate: current_wav(audio, rate, tmp)
+    for format in audio_codec.FORMATS:
+        for bits in (16, 8):
+            yield f'{format}{bits} bytes', (
+                lambda audio, rate, format=format, bits=bits:
+                len(audio_codec.encode_audio(audio, rate, format, bits)))
+
+def formats(label, path, sample_rates, repeats):
+    """Size and encode time of each format, rendering excluded"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        notes, _, tempo_map = shortMIDI.read_notes(path)
+    starts, durations, pitches, _ = synth.table_note_events(notes, tempo_map)
+    with tempfile.TemporaryDirectory() as tmp:
+        for rate in sample_rates:
+            audio = synth.render_notes(starts, durations, pitches, sample_rate=rate)
+            seconds = len(audio) / rate
+            print(f"\n== {label}: {len(notes)} notes, {seconds:.1f} s of audio at {rate} Hz ==")
+            print(f"{'encoder':20s} {'bytes':>11} {'ratio':>6} {'encode ms':>10} {'x realtime':>11}")
+            baseline = None
+            for name, encode in encoders(tmp):
+                elapsed, size = best_of(repeats, encode, audio, rate)
+                baseline = baseline or size
+                print(f"{name:20s} {size:11d} {size/baseline:6.3f} {elapsed*1e3:10.1f} "
+                      f"{seconds/elapsed:11.0f}")
+
+def round_trip(label, path, repeats):
+    """Whole export: the old save-then-reparse flow vs rendering in memory"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        notes, ticks_per_beat, tempo_map = shortMIDI.read_notes(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        midi_path, wav_path = os.path.join(tmp, 'out.mid'), os.path.join(tmp, 'out.wav')
+        def on_disk():
+            shortMIDI.write_midi(midi_path, [shortMIDI.encode_track(notes, tempo_map, True)],
+                                 ticks_per_beat)
+            MIDItoMAV.midi_to_wav(midi_path, wav_path)
+            with open(wav_path, 'rb') as f:
+                return len(f.read())
+        def in_memory(format):
+            buffer = io.BytesIO()
+            synth.render_table(notes, tempo_map, buffer, format=format)
+            return len(buffer.getvalue())
+        print(f"\n== {label}: end to end ==")
+        for name, fn, args in (('midi file -> wav file', on_disk, ()),
+                               ('table -> wav bytes', in_memory, ('wav',)),
+                               ('table -> flac bytes', in_memory, ('flac',))):
+            elapsed, size = best_of(repeats, fn, *args)
+            print(f"{name:24s} {elapsed*1e3:9.1f} ms {size:11d} bytes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Audio export: size and encode time per format')
+    parser.add_argument('--input', default=os.path.join(ROOT, 'Pirates.mid'))
+    parser.add_argument('--notes', type=int, default=20000, help='Synthetic corpus size')
+    parser.add_argument('--sample_rates', type=int, nargs='+', default=[22050, 44100, 48000])
+    parser.add_argument('--repeats', type=int, default=3, help='Timing runs (best is kept)')
+    args = parser.parse_args()
+
+    inputs = [(os.path.basename(args.input), args.input)]
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic = os.path.join(tmp, 'synthetic.mid')
+        synthetic_midi(synthetic, args.notes, tracks=2, tempo_changes=4, polyphony=3)
+        inputs.append(('synthetic', synthetic))
+        for label, path in inputs:
+            formats(label, path, args.sample_rates, args.repeats)
+            round_trip(label, path, args.repeats)
@@ -0,0 +1,90 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+from bench_generation import legacy_build_model
+
+def phrase_sequence(num_notes, seed=0):
+    """Pitches built from a small stock of recurring phrases, some notes altered,
+    so that long contexts repeat the way they do in real pieces"""
+    rng = np.random.default_rng(seed)
+    phrases = [np.clip(60 + np.cumsum(rng.integers(-4, 5, rng.integers(8, 17))), 36, 96)
+               for _ in range(64)]
+    parts, total = [], 0
+    while total < num_notes:
+        phrase = phrases[rng.integers(len(phrases))].copy()
+        altered = rng.random(len(phrase)) < 0.1
+        phrase[altered] += rng.integers(-2, 3, altered.sum())
+        parts.append(phrase)
+        total += len(phrase)
+    return np.concatenate(parts)[:num_notes]
+
+def table_nbytes(model):
+    return sum(array.nbytes for array in (*model.arrays().values(), model.cumulative,
+                                          model.totals, model._running))
+
+def measure(build):
+    """(result, seconds, bytes still allocated by the build, peak bytes during it)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = build()
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, retained, peak
+
+def sampling_rate(model, seed_notes, order, length):
+    start = time.perf_counter()
+    shortMIDI.generate_continuations(model, seed_notes, length, 1, order, seed=0)
+    return length / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Memory per state: dict model vs count tables vs suffix index')
+    parser.add_argument('--input', default=None, help='MIDI file to model (default: synthetic phrases)')
+    parser.add_argument('--notes', type=int, default=50000, help='Synthetic sequence length')
+    parser.add_argument('--orders', type=int, nargs='+', default=[3, 5, 8, 12, 24, 0],
+                        help='Orders to compare; 0 is unbounded (suffix index only)')
+    parser.add_argument('--dict_max_order', type=int, default=12,
+                        help='Skip the slow dict model above this order')
+    parser.add_argument('--length', type=int, default=20000, help='Notes sampled for the rate column')
+    args = parser.parse_args()
+
+    if args.input:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sequence = shortMIDI.parse_midi(args.input)[0]['pitch'].astype(np.int16)
+    else:
+        sequence = phrase_sequence(args.notes).astype(np.int16)
+    notes = shortMIDI.empty_note_table(len(sequence))
+    notes['pitch'] = sequence
+    print(f"{len(sequence)} notes")
+    print(f"{'order':>5} {'model':7} {'states':>9} {'MB':>8} {'B/state':>8} {'B/note':>7} "
+          f"{'peak MB':>8} {'build s':>8} {'notes/s':>9}")
+
+    for max_order in args.orders:
+        rows = []
+        if max_order and max_order <= args.dict_max_order:
+            model, elapsed, retained, peak = measure(
+                lambda: legacy_build_model(sequence.tolist(), max_order))
+            rows.append(('dict', len(model), retained, peak, elapsed, None))
+        if max_order:
+            (model, order), elapsed, retained, peak = measure(
+                lambda: shortMIDI.build_adaptive_model(notes, max_order, index='table'))
+            rows.append(('table', len(model), table_nbytes(model), peak, elapsed,
+                         sampling_rate(model, sequence.tolist(), order, args.length)))
+        (model, order), elapsed, retained, peak = measure(
+            lambda: shortMIDI.build_adaptive_model(notes, max_order or None, index='suffix'))
+        rows.append(('suffix', len(model), model.nbytes, peak, elapsed,
+                     sampling_rate(model, sequence.tolist(), order, args.length)))
+
+        for name, states, nbytes, peak, elapsed, rate in rows:
+            print(f"{max_order or 'inf':>5} {name:7} {states:9d} {nbytes/1e6:8.2f} "
+                  f"{nbytes/max(states, 1):8.1f} {nbytes/len(sequence):7.1f} {peak/1e6:8.1f} "
+                  f"{elapsed:8.3f} {f'{rate:9.0f}' if rate else '':>9}")
@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+
+def legacy_build_model(note_sequence, max_order):
+    """The original nested-defaultdict model builder"""
+    model = defaultdict(lambda: defaultdict(int))
+    for order in range(1, max_order+1):
+        for i in range(len(note_sequence)-order):
+            state = tuple(note_sequence[i:i+order])
+            model[state][note_sequence[i+order]] += 1
+    return model
+
+def legacy_generate(model, last_notes, length, max_order, all_notes):
+    """The original per-note renormalising sampler"""
+    continuation = []
+    current_state = tuple(last_notes[-max_order:])
+    for _ in range(length):
+        for order in range(len(current_state), 0, -1):
+            state = current_state[-order:]
+            if state in model:
+                probabilities = list(model[state].values())
+                total = sum(probabilities)
+                if total > 0:
+                    notes = list(model[state].keys())
+                    probs = [p/total for p in probabilities]
+                    next_note = np.random.choice(notes, p=probs)
+                    continuation.append(next_note)
+                    current_state = (*current_state, next_note)[-max_order:]
+                    break
+        else:
+            next_note = np.random.choice(all_notes) if all_notes else 60
+            continuation.append(next_note)
+            current_state = (*current_state, next_note)[-max_order:]
+    return continuation
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Markov model build and generation benchmark')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(__file__), '..', 'Pirates.mid'))
+    parser.add_argument('--length', type=int, default=100000)
+    parser.add_argument('--max_order', type=int, default=3)
+    args = parser.parse_args()
+
+    notes, _, _ = shortMIDI.parse_midi(args.input)
+    sequence = notes['pitch'].tolist()
+
+    old_build, old_model = timed(legacy_build_model, sequence, args.max_order)
+    new_build, (new_model, order) = timed(shortMIDI.build_adaptive_model, notes, args.max_order)
+    seed = sequence[-order:]
+    old_gen, _ = timed(legacy_generate, old_model, seed, args.length, order, sequence)
+    new_gen, _ = timed(shortMIDI.generate_safe_continuation,
+                       new_model, seed, args.length, order, sequence)
+
+    print(f"\n{len(sequence)} training notes, order {order}, {args.length} generated notes")
+    print(f"build     legacy {old_build*1000:9.1f} ms   frozen {new_build*1000:9.1f} ms")
+    print(f"generate  legacy {old_gen*1000:9.1f} ms   frozen {new_gen*1000:9.1f} ms "
+          f"({old_gen/new_gen:.0f}x)")
+    print(f"notes/s   legacy {args.length/old_gen:11.0f}   frozen {args.length/new_gen:11.0f}")
@@ -0,0 +1,119 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import shortMIDI
+from generation_server import note_name
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(port, workers):
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'generation_server.py'),
+                                '--port', str(port), '--workers', str(workers)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('generation server did not start')
+
+def run_load(host, port, bodies, clients, requests_per_client):
+    """Each client thread keeps one connection open; returns (seconds, latencies, failures)"""
+    latencies, failures = [], []
+    lock = threading.Lock()
+    def client(index):
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        for i in range(requests_per_client):
+            body = bodies[(index * requests_per_client + i) % len(bodies)]
+            start = time.perf_counter()
+            connection.request('POST', '/generate', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                if response.status != 200:
+                    failures.append(response.status)
+        connection.close()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, failures
+
+def report(label, seconds, latencies, failures):
+    print(f"{label:10s} {len(latencies)/seconds:8.1f} req/s   "
+          f"p50 {percentile(latencies, 0.5)*1000:7.1f} ms   "
+          f"p99 {percentile(latencies, 0.99)*1000:7.1f} ms   {len(failures)} failed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test for generation_server.py')
+    parser.add_argument('--input', default=os.path.join(ROOT, 'Pirates.mid'),
+                       help='MIDI file whose notes are used as seed melodies')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed_notes', type=int, default=400,
+                       help='Notes per seed melody (default: 400)')
+    parser.add_argument('--length', type=int, default=200)
+    parser.add_argument('--url', default=None,
+                       help='Load test a running server instead, e.g. http://127.0.0.1:5500')
+    args = parser.parse_args()
+
+    pitches = shortMIDI.read_notes(args.input)[0]['pitch'].tolist()
+    def body(offset, seed):
+        melody = pitches[offset:offset + args.seed_notes] or pitches
+        return json.dumps({'notes': melody, 'length': args.length, 'max_order': 3,
+                           'seed': seed}).encode()
+    def recording(seed):
+        """What script.js posts: recordedNotes objects with names and times"""
+        melody = [{'note': note_name(pitch), 'time': i * 0.25}
+                  for i, pitch in enumerate(pitches[:args.seed_notes])]
+        return json.dumps({'notes': melody, 'length': args.length, 'max_order': 3,
+                           'seed': seed}).encode()
+    total = args.clients * args.requests
+    # Same melody every time (model cache hits) vs a new melody every request
+    scenarios = [('cached', [body(0, seed) for seed in range(total)]),
+                 ('recorded', [recording(seed) for seed in range(total)]),
+                 ('uncached', [body(i % max(1, len(pitches) - args.seed_notes), i)
+                               for i in range(total)])]
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        process = start_server(port, args.workers)
+    try:
+        print(f"{args.clients} clients x {args.requests} requests, "
+              f"{args.seed_notes}-note seeds, length {args.length}")
+        for label, bodies in scenarios:
+            report(label, *run_load(host, port, bodies, args.clients, args.requests))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
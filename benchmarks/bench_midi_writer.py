@@ -0,0 +1,75 @@
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+from mido import Message, MidiFile, MidiTrack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+from tempo_map import TempoMap
+
+def legacy_append_notes(track, notes, tempo_map=None):
+    """The previous writer: two mido Messages per note, tempo changes interleaved"""
+    notes = notes[np.argsort(notes['onset'], kind='stable')]
+    tempo_events = tempo_map.messages() if tempo_map is not None else []
+    current_time, next_tempo = 0, 0
+    for pitch, velocity, onset in zip(notes['pitch'].tolist(),
+                                      notes['velocity'].tolist(),
+                                      notes['onset'].tolist()):
+        while next_tempo < len(tempo_events) and tempo_events[next_tempo][0] <= onset:
+            tick, tempo = tempo_events[next_tempo]
+            track.append(tempo.copy(time=tick - current_time))
+            current_time, next_tempo = tick, next_tempo + 1
+        track.append(Message('note_on', note=pitch, velocity=velocity, time=onset - current_time))
+        track.append(Message('note_off', note=pitch, velocity=0, time=0))
+        current_time = onset
+    for tick, tempo in tempo_events[next_tempo:]:
+        track.append(tempo.copy(time=tick - current_time))
+        current_time = tick
+
+def legacy_bytes(notes, tempo_map, ticks_per_beat):
+    mid = MidiFile(ticks_per_beat=ticks_per_beat)
+    track = MidiTrack()
+    mid.tracks.append(track)
+    legacy_append_notes(track, notes, tempo_map)
+    out = io.BytesIO()
+    mid.save(file=out)
+    return out.getvalue()
+
+def fast_bytes(notes, tempo_map, ticks_per_beat):
+    return shortMIDI.midi_bytes([shortMIDI.encode_track(notes, tempo_map)], ticks_per_beat)
+
+def synthetic_notes(num_notes, seed=0):
+    """Random notes, unsorted onsets with some ties and long gaps"""
+    rng = np.random.default_rng(seed)
+    notes = shortMIDI.empty_note_table(num_notes)
+    notes['onset'] = rng.integers(0, num_notes * 240, num_notes)
+    notes['onset'][::97] += 1 << 22  # Exercise 4-byte delta times
+    notes['offset'] = notes['onset']
+    notes['pitch'] = rng.integers(0, 128, num_notes)
+    notes['velocity'] = rng.integers(1, 128, num_notes)
+    return notes
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='mido Message writer vs bulk track encoder')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--tempo_changes', type=int, default=50)
+    args = parser.parse_args()
+
+    ticks_per_beat = 480
+    print(f"{'notes':>9} {'mido s':>8} {'bulk s':>8} {'speedup':>8}  identical")
+    for size in args.sizes:
+        notes = synthetic_notes(size)
+        rng = np.random.default_rng(size)
+        tempo_map = TempoMap(ticks_per_beat, zip(rng.integers(0, size * 240, args.tempo_changes),
+                                                 rng.integers(300000, 900000, args.tempo_changes)))
+        old_time, old = timed(legacy_bytes, notes, tempo_map, ticks_per_beat)
+        new_time, new = timed(fast_bytes, notes, tempo_map, ticks_per_beat)
+        print(f"{size:9d} {old_time:8.3f} {new_time:8.3f} {old_time/new_time:7.1f}x  {old == new}")
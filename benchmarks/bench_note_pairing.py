@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from mido import Message, MidiFile, MidiTrack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'archive python files'))
+import MIDItoMAV
+
+def legacy_parse_midi(midi_path):
+    """The original parser: every note-off rescans the note list from the start"""
+    mid = MidiFile(midi_path)
+    notes = []
+    tempos = []
+    abs_time = 0
+    for track in mid.tracks:
+        for msg in track:
+            abs_time += msg.time
+            if msg.type == 'set_tempo':
+                tempos.append(msg)
+            if msg.type == 'note_on' and msg.velocity > 0:
+                notes.append({'note': msg.note, 'start': abs_time, 'end': None,
+                              'velocity': msg.velocity})
+            elif msg.type in ['note_off', 'note_on'] and msg.velocity == 0:
+                for note in notes:
+                    if note['note'] == msg.note and note['end'] is None:
+                        note['end'] = abs_time
+                        break
+    notes = [n for n in notes if n['end'] is not None]
+    return notes, mid.ticks_per_beat, tempos
+
+def synthetic_midi(path, num_notes, tracks=4, seed=0):
+    """Overlapping random notes with occasional sustain pedal, split over tracks"""
+    rng = random.Random(seed)
+    mid = MidiFile(type=1, ticks_per_beat=480)
+    per_track = num_notes // tracks
+    for _ in range(tracks):
+        events = []
+        tick = 0
+        for i in range(per_track):
+            tick += rng.randrange(0, 120)
+            pitch = rng.randrange(48, 84)
+            events.append((tick, 1, Message('note_on', note=pitch, velocity=rng.randrange(40, 120))))
+            events.append((tick + rng.randrange(30, 960), 0, Message('note_off', note=pitch, velocity=0)))
+            if i % 64 == 0:
+                events.append((tick, 0, Message('control_change', control=64, value=127)))
+                events.append((tick + 480, 0, Message('control_change', control=64, value=0)))
+        events.sort(key=lambda event: (event[0], event[1]))
+        track = MidiTrack()
+        last = 0
+        for tick, _, msg in events:
+            track.append(msg.copy(time=tick - last))
+            last = tick
+        mid.tracks.append(track)
+    mid.save(path)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Note-on/off pairing benchmark for MIDItoMAV.parse_midi')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--legacy_max', type=int, default=20000,
+                       help='Largest size to run the quadratic legacy parser on')
+    args = parser.parse_args()
+
+    print(f"{'notes':>9} {'load s':>8} {'parse s':>8} {'us/note':>8} {'legacy s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f'synthetic_{size}.mid')
+            synthetic_midi(path, size)
+            # Reading the file is linear in mido; the rest of parse_midi is pairing
+            load_time, _ = timed(MidiFile, path)
+            parse_time, (notes, _, _) = timed(MIDItoMAV.parse_midi, path)
+            legacy = f"{timed(legacy_parse_midi, path)[0]:9.2f}" if size <= args.legacy_max else f"{'-':>9}"
+            print(f"{len(notes):9d} {load_time:8.2f} {parse_time:8.2f} "
+                  f"{parse_time / len(notes) * 1e6:8.2f} {legacy}")
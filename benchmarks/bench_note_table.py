@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from mido import MidiFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+
+def legacy_parse_midi(midi_path):
+    """The original dict-per-note parser, kept here as the baseline"""
+    mid = MidiFile(midi_path)
+    notes = []
+    tempos = []
+    current_time = 0
+    for track in mid.tracks:
+        for msg in track:
+            current_time += msg.time
+            if msg.type == 'set_tempo':
+                tempos.append(msg)
+            if msg.type == 'note_on' and msg.velocity > 0:
+                notes.append({
+                    'note': msg.note,
+                    'time': current_time,
+                    'velocity': msg.velocity
+                })
+    return notes, mid.ticks_per_beat, tempos
+
+def dict_list_bytes(notes):
+    """Approximate retained size of a list of small dicts"""
+    return sys.getsizeof(notes) + sum(sys.getsizeof(n) for n in notes)
+
+def scaled_copy(midi_path, factor, out_path):
+    """Write a file whose note tracks are repeated `factor` times"""
+    mid = MidiFile(midi_path)
+    big = MidiFile(type=1, ticks_per_beat=mid.ticks_per_beat)
+    big.tracks.append(mid.tracks[0])
+    for _ in range(factor):
+        big.tracks.extend(mid.tracks[1:])
+    big.save(out_path)
+
+def measure(parse, path, repeats):
+    """Return (best wall seconds, peak traced bytes, result)"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parse(path)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = parse(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+def report(label, path, repeats):
+    old_time, old_peak, (old_notes, _, _) = measure(legacy_parse_midi, path, repeats)
+    new_time, new_peak, (new_notes, _, _) = measure(shortMIDI.parse_midi, path, repeats)
+    # Building the model walks the notes again, so time it as well
+    start = time.perf_counter()
+    shortMIDI.build_adaptive_model(old_notes)
+    old_build = time.perf_counter() - start
+    start = time.perf_counter()
+    shortMIDI.build_adaptive_model(new_notes)
+    new_build = time.perf_counter() - start
+    print(f"\n== {label}: {len(new_notes)} notes ==")
+    print(f"parse   dicts {old_time*1000:9.1f} ms   table {new_time*1000:9.1f} ms")
+    print(f"build   dicts {old_build*1000:9.1f} ms   table {new_build*1000:9.1f} ms")
+    print(f"peak    dicts {old_peak/1e6:9.2f} MB   table {new_peak/1e6:9.2f} MB")
+    print(f"result  dicts {dict_list_bytes(old_notes)/1e6:9.2f} MB   "
+          f"table {new_notes.nbytes/1e6:9.2f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Dict list vs note table parse benchmark')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(__file__), '..', 'Pirates.mid'))
+    parser.add_argument('--scale', type=int, default=100,
+                       help='Repeat factor for the large input (default: 100)')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    report('original', args.input, args.repeats)
+    with tempfile.TemporaryDirectory() as tmp:
+        big_path = os.path.join(tmp, 'scaled.mid')
+        scaled_copy(args.input, args.scale, big_path)
+        report(f'x{args.scale}', big_path, 1)
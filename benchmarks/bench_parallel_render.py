@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import synth
+from bench_synth import dense_midi
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time-segment parallel rendering, scaling by worker count')
+    parser.add_argument('--seconds', type=int, default=600, help='Length of the dense test piece')
+    parser.add_argument('--voices', type=int, default=8, help='Overlapping tracks')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dense.mid')
+        dense_midi(path, args.seconds, args.voices)
+        starts, durations, pitches, velocities = synth.midi_note_events(path)
+
+    print(f"{len(pitches)} notes, {args.seconds} s x {args.voices} voices, "
+          f"{os.cpu_count()} CPUs available")
+    envelope = (0.01, 0.05, 0.8, 0.1)
+    reference, baseline = None, None
+    for workers in args.workers:
+        start = time.perf_counter()
+        audio = synth.render_notes(starts, durations, pitches, velocities,
+                                   envelope=envelope, workers=workers)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference, baseline = audio, elapsed
+        print(f"{workers:3d} workers {elapsed:7.2f} s   x{baseline/elapsed:4.1f}   "
+              f"identical to 1 worker: {np.array_equal(audio, reference)}")
@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import audio_codec
+from realtime import BlockSynth
+
+def dense_notes(polyphony, seconds, note_seconds=0.5, seed=0):
+    """`polyphony` overlapping note chains, staggered so that about that many
+    voices sound at every moment and note_ons land mid-block"""
+    rng = np.random.default_rng(seed)
+    starts, pitches = [], []
+    for chain in range(polyphony):
+        onsets = np.arange(chain * note_seconds / polyphony, seconds, note_seconds)
+        starts.append(onsets)
+        pitches.append(rng.integers(36, 96, len(onsets)))
+    starts = np.concatenate(starts)
+    return starts, np.full(len(starts), note_seconds * 0.95), np.concatenate(pitches)
+
+def underruns(times, period, buffers=1):
+    """Late blocks for a device with a ring of `buffers` blocks: block i can
+    start once block i - buffers has played, at (i - buffers + 1) * period, and
+    must be done by (i + 1) * period. A late block is dropped (heard as a gap)
+    and rendering carries on from its deadline."""
+    finish, late = 0.0, 0
+    for i, elapsed in enumerate(times.tolist()):
+        finish = max(finish, (i - buffers + 1) * period) + elapsed
+        if finish > (i + 1) * period:
+            late += 1
+            finish = (i + 1) * period
+    return late
+
+def run(polyphony, block_size, seconds, max_voices, sample_rate, keep=False):
+    """Render `seconds` block by block as an audio callback would, timing each block"""
+    engine = BlockSynth(sample_rate, block_size, max_voices)
+    starts, durations, pitches = dense_notes(polyphony, seconds)
+    engine.schedule_notes(starts, durations, pitches, velocities=np.full(len(starts), 90))
+    blocks = int(seconds * sample_rate) // block_size
+    times = np.empty(blocks)
+    sounding = np.empty(blocks)
+    audio = np.empty(blocks * block_size, dtype=np.float32) if keep else None
+    for i in range(blocks):
+        start = time.perf_counter()
+        block = engine.render()
+        times[i] = time.perf_counter() - start
+        sounding[i] = engine.voices_sounding
+        if keep:
+            audio[i * block_size:(i + 1) * block_size] = block
+    return times, sounding, engine.stolen, audio
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Headless real-time harness: per-block render time and underruns of BlockSynth')
+    parser.add_argument('--polyphony', type=int, nargs='+', default=[1, 8, 32, 64, 128])
+    parser.add_argument('--block_sizes', type=int, nargs='+', default=[128, 256, 512])
+    parser.add_argument('--seconds', type=float, default=10, help='Audio rendered per setting')
+    parser.add_argument('--max_voices', type=int, default=128, help='Voice pool size')
+    parser.add_argument('--sample_rate', type=int, default=44100)
+    parser.add_argument('--buffers', type=int, default=3,
+                        help='Device ring size, in blocks, for the buffered underrun column')
+    parser.add_argument('--output', default=None,
+                        help='Write the last setting rendered to this .wav or .flac file')
+    args = parser.parse_args()
+
+    print("Underruns: blocks not ready in time with a single-block callback, and with a "
+          f"{args.buffers}-block device ring.")
+    print(f"{'voices':>6} {'block':>5} {'budget ms':>9} {'mean ms':>8} {'p99 ms':>7} {'worst ms':>8} "
+          f"{'load':>6} {'under@1':>7} {f'under@{args.buffers}':>8} {'sounding':>8} {'stolen':>6}")
+    for polyphony in args.polyphony:
+        for block_size in args.block_sizes:
+            keep = args.output and (polyphony, block_size) == (args.polyphony[-1], args.block_sizes[-1])
+            times, sounding, stolen, audio = run(polyphony, block_size, args.seconds,
+                                                 args.max_voices, args.sample_rate, keep)
+            budget = block_size / args.sample_rate
+            print(f"{polyphony:6d} {block_size:5d} {budget*1e3:9.2f} {times.mean()*1e3:8.3f} "
+                  f"{np.percentile(times, 99)*1e3:7.3f} {times.max()*1e3:8.3f} "
+                  f"{times.mean()/budget:6.1%} {underruns(times, budget):7d} "
+                  f"{underruns(times, budget, args.buffers):8d} "
+                  f"{sounding.mean():8.1f} {stolen:6d}")
+    if args.output:
+        audio_codec.write_audio(args.output, audio, args.sample_rate,
+                                os.path.splitext(args.output)[1].lstrip('.').lower())
+        print(f"Wrote {args.output}")
@@ -0,0 +1,69 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+from bench_suite import synthetic_midi
+
+def shape(notes):
+    """Notes per onset, and the share of the most common inter-onset gap"""
+    onsets, sizes = np.unique(notes['onset'], return_counts=True)
+    gaps, counts = np.unique(np.diff(onsets), return_counts=True)
+    return sizes.mean(), counts.max() / max(counts.sum(), 1)
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def run(name, path, length, max_order):
+    with contextlib.redirect_stdout(io.StringIO()):
+        notes, ticks_per_beat, _ = shortMIDI.parse_midi(path)
+        build, model = timed(shortMIDI.build_rhythm_model, notes, ticks_per_beat, max_order)
+        pitch_build, (pitch_model, order) = timed(shortMIDI.build_adaptive_model, notes, max_order)
+    tokens = model.index.sequence
+
+    generate, samples = timed(model.generate, length, 1, 0)
+    decode, generated = timed(model.decode, samples[0], int(notes['onset'].max()))
+    np.random.seed(0)
+    pitch_generate, _ = timed(shortMIDI.generate_safe_continuation, pitch_model,
+                              notes['pitch'].tolist(), length, order)
+
+    # Real-time use: one chord at a time, decoded as soon as it is drawn
+    stream = shortMIDI.iter_continuation(model.index, tokens.tolist(), 2000, order, seed=0)
+    start = time.perf_counter()
+    onset = int(notes['onset'].max())
+    for token in stream:
+        chord = model.decode([token], onset)
+        onset = int(chord['onset'][0])
+    per_chord = (time.perf_counter() - start) / 2000
+
+    source_poly, source_gap = shape(notes)
+    poly, gap = shape(generated)
+    print(f"{name}: {len(notes)} notes, {len(tokens)} onset groups, {len(model.keys)} tokens "
+          f"(built in {build*1e3:.1f} ms; pitch model {pitch_build*1e3:.1f} ms)")
+    print(f"  batch      {length/generate:10.0f} chords/s  {len(generated)/(generate+decode):10.0f} notes/s"
+          f"   pitch-only model {length/pitch_generate:10.0f} notes/s")
+    print(f"  streaming  {per_chord*1e6:8.1f} us per chord, drawn and decoded")
+    print(f"  notes per onset {source_poly:.2f} -> {poly:.2f}   "
+          f"most common gap share {source_gap:.2f} -> {gap:.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rhythm-token model build and generation throughput')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(__file__), '..', 'Pirates.mid'))
+    parser.add_argument('--notes', type=int, default=50000, help='Synthetic polyphonic corpus size')
+    parser.add_argument('--length', type=int, default=100000, help='Chords per batch continuation')
+    parser.add_argument('--max_order', type=int, default=3)
+    args = parser.parse_args()
+
+    run(os.path.basename(args.input), args.input, args.length, args.max_order)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.mid')
+        synthetic_midi(path, args.notes, tracks=1, tempo_changes=4, polyphony=3)
+        run('synthetic', path, args.length, args.max_order)
@@ -0,0 +1,118 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+import fastmidi
+import job_daemon
+import shortMIDI
+from bench_suite import synthetic_midi
+
+SCRIPT = os.path.join(ROOT, 'shortMIDI.py')
+# `python -m shortMIDI` with the fast path allowed for any file size, to find
+# where the numpy path starts to win
+UNLIMITED = ("import runpy, sys, fastmidi; fastmidi.MAX_INPUT_BYTES = float('inf'); "
+             "runpy.run_module('shortMIDI', run_name='__main__', alter_sys=True)")
+
+def timed(command, repeats, env=None):
+    """Median and best wall time of a command run `repeats` times"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, env=env)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times)
+
+def imports(repeats, env):
+    """What each import adds to a bare interpreter start"""
+    base, _ = timed([sys.executable, '-c', 'pass'], repeats, env)
+    print(f"\n== start-up: bare interpreter {base*1e3:.1f} ms ==")
+    print(f"{'import':36s} {'ms added':>9}")
+    for statement in ('import fastmidi', 'import job_daemon', 'import mido', 'import numpy',
+                      'import numpy, mido, model_cache, profiling, tempo_map, audio_codec'):
+        median, _ = timed([sys.executable, '-c', statement], repeats, env)
+        print(f"{statement[:36]:36s} {(median - base)*1e3:9.1f}")
+
+def start_worker(socket_path, env):
+    worker = subprocess.Popen([sys.executable, SCRIPT, '--serve', socket_path],
+                              stdout=subprocess.PIPE, text=True, env=env)
+    worker.stdout.readline()  # "Worker listening on ..."
+    return worker
+
+def in_worker(argv, repeats):
+    """Per-job cost inside a running worker, client and socket excluded"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        status, output = job_daemon.run_job(shortMIDI.main, argv, os.getcwd())
+        times.append(time.perf_counter() - start)
+        assert status == 0, output
+    return statistics.median(times), min(times)
+
+def jobs(label, path, repeats, socket_path, env, tmp):
+    """One default job (50 notes, seeded) run each way"""
+    out = os.path.join(tmp, 'out.mid')
+    job = [path, out, '--seed', '1']
+    size = os.path.getsize(path)
+    eligible = size <= fastmidi.MAX_INPUT_BYTES
+    print(f"\n== {label}: {size} bytes "
+          f"({'fast path eligible' if eligible else 'over the fast path limit, forced here'}) ==")
+    print(f"{'mode':46s} {'median ms':>10} {'best ms':>8}")
+    script = [sys.executable, SCRIPT]
+    module = [sys.executable, '-m', 'shortMIDI'] if eligible else [sys.executable, '-c', UNLIMITED]
+    modes = [
+        ('cold, numpy path, no model cache', script + job + ['--no_fast_path', '--no_cache']),
+        ('cold, numpy path, warm model cache', script + job + ['--no_fast_path']),
+        ('cold, numpy path, -m, warm model cache', module + job + ['--no_fast_path']),
+        ('cold, fast path, python shortMIDI.py', script + job if eligible else None),
+        ('cold, fast path, python -m shortMIDI', module + job),
+        ('warm worker, -m ... --connect', module + job + ['--connect', socket_path]),
+    ]
+    outputs = {}
+    for name, command in modes:
+        if command is None:
+            continue
+        median, best = timed(command, repeats, env)
+        print(f"{name:46s} {median*1e3:10.1f} {best*1e3:8.1f}")
+        with open(out, 'rb') as f:
+            outputs[name] = f.read()
+    median, best = in_worker(job, repeats)
+    print(f"{'warm, inside the worker (no client)':46s} {median*1e3:10.1f} {best*1e3:8.1f}")
+    print("outputs identical" if len(set(outputs.values())) == 1 else "OUTPUTS DIFFER")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Cold and warm start of short shortMIDI.py jobs: numpy path, '
+                    'stdlib fast path and a persistent worker')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 2000, 8000, 20000],
+                        help='Synthetic inputs, in notes')
+    parser.add_argument('--repeats', type=int, default=10, help='Runs per mode (median is kept)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Cached bytecode, as on a normal install; scripts themselves are
+        # compiled on every run, modules run with -m are not
+        env = {name: value for name, value in os.environ.items()
+               if name != 'PYTHONDONTWRITEBYTECODE'}
+        env.update(TUNETUAH_CACHE_DIR=os.path.join(tmp, 'cache'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')])))
+        os.environ['TUNETUAH_CACHE_DIR'] = env['TUNETUAH_CACHE_DIR']  # For in_worker
+        imports(args.repeats, env)
+        socket_path = os.path.join(tmp, 'worker.sock')
+        worker = start_worker(socket_path, env)
+        try:
+            inputs = [('Pirates.mid', os.path.join(ROOT, 'Pirates.mid'))]
+            for notes in args.sizes:
+                path = os.path.join(tmp, f'synthetic_{notes}.mid')
+                synthetic_midi(path, notes, tracks=2, tempo_changes=4, polyphony=1)
+                inputs.append((f'synthetic {notes} notes', path))
+            for label, path in inputs:
+                jobs(label, path, args.repeats, socket_path, env, tmp)
+        finally:
+            worker.terminate()
+            worker.wait()
@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import numpy as np
+import mido
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'archive python files'))
+import shortMIDI
+import MIDItoMAV
+import userWrite
+from profiling import profile, stage
+
+# notes, tracks, tempo changes, notes per chord, userWrite melody length
+CORPORA = {
+    'small': dict(notes=2000, tracks=2, tempo_changes=4, polyphony=2, melody=500),
+    'medium': dict(notes=20000, tracks=4, tempo_changes=16, polyphony=3, melody=2000),
+    'large': dict(notes=200000, tracks=8, tempo_changes=64, polyphony=4, melody=4000),
+}
+GENERATE_LENGTH = 1000
+GENERATE_SAMPLES = 16
+TICKS_PER_BEAT = 480
+STEP = TICKS_PER_BEAT // 4  # One chord per sixteenth note
+
+def synthetic_midi(path, notes, tracks, tempo_changes, polyphony, seed=0, **_):
+    """A deterministic type-1 file: `tracks` tracks of `polyphony`-note chords on a
+    sixteenth-note grid, with `tempo_changes` set_tempo events spread across track 0"""
+    rng = np.random.default_rng(seed)
+    chords = max(1, notes // (tracks * polyphony))
+    length = chords * STEP
+    mid = MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    for index in range(tracks):
+        events = []
+        if index == 0:
+            ticks = np.linspace(0, length, tempo_changes, endpoint=False).astype(int).tolist()
+            for tick, bpm in zip(ticks, rng.integers(60, 180, tempo_changes).tolist()):
+                events.append((tick, 0, MetaMessage('set_tempo', tempo=mido.bpm2tempo(bpm))))
+        # A random walk per track, chords stacked on top of it
+        roots = np.clip(60 + np.cumsum(rng.integers(-3, 4, chords)), 36, 84)
+        for chord, root in enumerate(roots.tolist()):
+            onset = chord * STEP
+            duration = STEP * int(rng.integers(1, 5))
+            velocity = int(rng.integers(50, 110))
+            for pitch in range(root, root + 4 * polyphony, 4):
+                events.append((onset, 2, Message('note_on', note=pitch, velocity=velocity)))
+                events.append((onset + duration, 1, Message('note_off', note=pitch, velocity=0)))
+        events.sort(key=lambda event: (event[0], event[1]))
+        track = MidiTrack()
+        last = 0
+        for tick, _, msg in events:
+            track.append(msg.copy(time=tick - last))
+            last = tick
+        mid.tracks.append(track)
+    mid.save(path)
+
+def run_pipeline(path, spec, tmp):
+    """Every stage once; stage records come from the profiling hooks"""
+    out = os.path.join(tmp, 'continued.mid')
+    with contextlib.redirect_stdout(io.StringIO()):
+        notes, ticks_per_beat, tempos = shortMIDI.parse_midi(path)
+        model, order = shortMIDI.build_adaptive_model(notes, 3)
+        last_notes = notes['pitch'][-order:].tolist()
+        np.random.seed(0)
+        new_notes = shortMIDI.generate_safe_continuation(model, last_notes, GENERATE_LENGTH, order)
+        shortMIDI.generate_continuations(model, last_notes, GENERATE_LENGTH, GENERATE_SAMPLES,
+                                         order, seed=0)
+        shortMIDI.save_midi(notes, new_notes, ticks_per_beat, tempos, out)
+
+        with stage('miditomav_parse_midi') as record:
+            record['items'] = len(MIDItoMAV.parse_midi(out)[0])
+        # Render the input: continued.mid holds zero-length notes, which render silence
+        with stage('midi_to_wav', items=len(notes)):
+            MIDItoMAV.midi_to_wav(path, os.path.join(tmp, 'render.wav'))
+        with stage('midi_to_wav_stream', items=len(notes)):
+            MIDItoMAV.midi_to_wav(path, os.path.join(tmp, 'render.wav'), streaming=True)
+        random.seed(0)
+        melody, params = userWrite.generate_melody_from_text('happy and bouncy', spec['melody'])
+        with stage('synthesize_wav', items=len(melody)):
+            userWrite.synthesize_wav(melody, os.path.join(tmp, 'melody.wav'),
+                                     tempo=mido.bpm2tempo(params['tempo']))
+
+def measure(path, spec, tmp, repeats):
+    """Best-of-`repeats` wall and CPU time per stage, then one traced pass for memory"""
+    results = {}
+    for _ in range(repeats):
+        with profile(memory=False) as records:
+            run_pipeline(path, spec, tmp)
+        for record in records:
+            best = results.setdefault(record['stage'], {'items': record.get('items'),
+                                                        'wall_s': float('inf'),
+                                                        'cpu_s': float('inf')})
+            best['wall_s'] = min(best['wall_s'], record['wall_s'])
+            best['cpu_s'] = min(best['cpu_s'], record['cpu_s'])
+    # Allocation tracing slows everything down, so it never feeds the timings
+    with profile(memory=True) as records:
+        run_pipeline(path, spec, tmp)
+    for record in records:
+        results[record['stage']]['peak_bytes'] = record['alloc_peak_bytes']
+    return results
+
+def compare(current, baseline, tolerance, memory_tolerance, min_seconds):
+    """Print current vs baseline per stage; return the list of regressions"""
+    regressions = []
+    print(f"\n{'stage':42s} {'base s':>9} {'now s':>9} {'ratio':>6} {'base MB':>9} {'now MB':>9}")
+    for key in sorted(set(current) | set(baseline)):
+        now, base = current.get(key), baseline.get(key)
+        if now is None or base is None:
+            print(f"{key:42s} {'only in ' + ('baseline' if now is None else 'this run'):>45}")
+            continue
+        ratio = now['wall_s'] / base['wall_s'] if base['wall_s'] else float('inf')
+        flags = []
+        if ratio > 1 + tolerance and now['wall_s'] - base['wall_s'] > min_seconds:
+            flags.append('SLOWER')
+        if now.get('peak_bytes', 0) > base.get('peak_bytes', 0) * (1 + memory_tolerance) + 1024 * 1024:
+            flags.append('MORE MEMORY')
+        if flags:
+            regressions.append((key, flags))
+        print(f"{key:42s} {base['wall_s']:9.4f} {now['wall_s']:9.4f} {ratio:6.2f} "
+              f"{base.get('peak_bytes', 0)/1e6:9.1f} {now.get('peak_bytes', 0)/1e6:9.1f}"
+              f"  {' '.join(flags)}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Time and measure every pipeline stage on synthetic corpora. '
+                    'Save a baseline with --save, then check later runs with --compare.')
+    parser.add_argument('--corpora', nargs='+', choices=sorted(CORPORA), default=['small', 'medium'])
+    parser.add_argument('--repeats', type=int, default=5, help='Timing runs per corpus (best is kept)')
+    parser.add_argument('--save', default=None, metavar='JSON', help='Write this run as a baseline')
+    parser.add_argument('--compare', default=None, metavar='JSON', help='Baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed wall-time slowdown before failing (default: 0.25 = 25%%)')
+    parser.add_argument('--memory_tolerance', type=float, default=0.10,
+                        help='Allowed growth in peak allocations (default: 0.10)')
+    parser.add_argument('--min_seconds', type=float, default=0.02,
+                        help='Ignore slowdowns smaller than this, which are timer noise')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.corpora:
+            spec = CORPORA[name]
+            path = os.path.join(tmp, f'{name}.mid')
+            synthetic_midi(path, **spec)
+            print(f"{name}: {spec}")
+            for stage_name, result in measure(path, spec, tmp, args.repeats).items():
+                results[f"{name}/{stage_name}"] = result
+                print(f"  {stage_name:30s} {result['wall_s']:9.4f} s  {result['cpu_s']:9.4f} cpu s  "
+                      f"{result['peak_bytes']/1e6:8.1f} MB  {result['items']} items")
+
+    run = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'cpus': os.cpu_count(),
+                    'corpora': {name: CORPORA[name] for name in args.corpora}},
+           'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run, f, indent=1)
+        print(f"\nSaved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta']['corpora'] != run['meta']['corpora']:
+            print("Warning: corpus settings differ from the baseline")
+        regressions = compare(results, baseline['results'], args.tolerance,
+                              args.memory_tolerance, args.min_seconds)
+        if regressions:
+            print(f"\nFAIL: {len(regressions)} regression(s): "
+                  + ', '.join(f"{key} ({' '.join(flags)})" for key, flags in regressions))
+            sys.exit(1)
+        print("\nOK: no regressions against the baseline")
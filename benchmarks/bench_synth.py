@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import mido
+from mido import MidiFile, MidiTrack, Message
+from scipy.io import wavfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import synth
+
+def legacy_midi_to_wav(midi_path, wav_path, sample_rate=44100):
+    """The original per-note linspace/np.pad renderer"""
+    mid = MidiFile(midi_path)
+    audio = np.zeros(int(mid.length * sample_rate * 1.2))
+    for track in mid.tracks:
+        current_time = 0.0
+        active_notes = {}
+        for msg in track:
+            current_time += mido.tick2second(msg.time, mid.ticks_per_beat, 500000)
+            if msg.type == 'note_on' and msg.velocity > 0:
+                freq = 440.0 * (2 ** ((msg.note - 69) / 12))
+                active_notes[msg.note] = (int(current_time * sample_rate), freq)
+            elif msg.type in ['note_off', 'note_on'] and msg.velocity == 0:
+                if msg.note in active_notes:
+                    start_sample, freq = active_notes.pop(msg.note)
+                    duration = current_time - (start_sample / sample_rate)
+                    if duration > 0:
+                        t = np.linspace(0, duration, int(sample_rate * duration))
+                        wave = 0.3 * np.sin(2 * np.pi * freq * t)
+                        end_sample = start_sample + len(wave)
+                        if end_sample > len(audio):
+                            audio = np.pad(audio, (0, end_sample - len(audio)))
+                        audio[start_sample:end_sample] += wave
+    audio /= np.max(np.abs(audio))
+    wavfile.write(wav_path, sample_rate, (audio * 32767).astype(np.int16))
+
+def new_midi_to_wav(midi_path, wav_path, sample_rate=44100):
+    starts, durations, pitches, _ = synth.midi_note_events(midi_path)
+    audio = synth.render_notes(starts, durations, pitches, sample_rate=sample_rate)
+    synth.write_wav(wav_path, audio, sample_rate)
+
+def dense_midi(path, seconds, voices, ticks_per_beat=480):
+    """`voices` overlapping tracks of random one-beat notes lasting `seconds` at 120 BPM"""
+    rng = np.random.default_rng(0)
+    mid = MidiFile(type=1, ticks_per_beat=ticks_per_beat)
+    beats = int(seconds * 2)
+    for _ in range(voices):
+        track = MidiTrack()
+        mid.tracks.append(track)
+        for pitch in rng.integers(36, 96, beats).tolist():
+            track.append(Message('note_on', note=pitch, velocity=80, time=0))
+            track.append(Message('note_off', note=pitch, velocity=0, time=ticks_per_beat))
+    mid.save(path)
+
+def report(label, midi_path, renderers):
+    minutes = None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, render in renderers:
+            wav_path = os.path.join(tmp, f'{name}.wav')
+            start = time.perf_counter()
+            render(midi_path, wav_path)
+            results[name] = time.perf_counter() - start
+            rate, data = wavfile.read(wav_path)
+            minutes = len(data) / rate / 60
+    print(f"\n== {label}: {minutes:.2f} min of audio ==")
+    for name, seconds in results.items():
+        print(f"{name:8s} {seconds:8.2f} s total   {seconds/minutes:8.2f} s per audio minute")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='WAV renderer benchmark')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(__file__), '..', 'Pirates.mid'))
+    parser.add_argument('--seconds', type=int, default=120, help='Length of the dense test file')
+    parser.add_argument('--voices', type=int, default=200, help='Simultaneous voices in the dense test file')
+    args = parser.parse_args()
+
+    renderers = [('legacy', legacy_midi_to_wav), ('vector', new_midi_to_wav)]
+    report('input', args.input, renderers)
+    with tempfile.TemporaryDirectory() as tmp:
+        dense = os.path.join(tmp, 'dense.mid')
+        dense_midi(dense, args.seconds, args.voices)
+        report(f'{args.voices} voices', dense, renderers)
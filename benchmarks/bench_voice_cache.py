@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import mido
+from scipy.io import wavfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'archive python files'))
+import synth
+import userWrite
+
+def legacy_synthesize_wav(midi_data, output_file, sample_rate=44100, tempo=500000):
+    """The original renderer: float64 linspace, sine and four-part ADSR for every note"""
+    total_ticks = sum(n['duration'] for n in midi_data)
+    total_time = mido.tick2second(total_ticks, 480, tempo)
+    audio = np.zeros(int(total_time * sample_rate))
+    current_sample = 0
+    for note in midi_data:
+        freq = synth.midi_to_freq(note['note'])
+        duration = mido.tick2second(note['duration'], 480, tempo)
+        t = np.linspace(0, duration, int(duration * sample_rate))
+        wave = 0.3 * np.sin(2 * np.pi * freq * t)
+        envelope = np.ones_like(wave)
+        n_attack, n_decay, n_release = int(0.05 * sample_rate), int(0.1 * sample_rate), int(0.2 * sample_rate)
+        envelope[:n_attack] = np.linspace(0, 1, n_attack)
+        envelope[n_attack:n_attack+n_decay] = np.linspace(1, 0.7, n_decay)
+        envelope[n_attack+n_decay:-n_release] = 0.7
+        envelope[-n_release:] = np.linspace(0.7, 0, n_release)
+        wave *= envelope
+        wave *= note['velocity'] / 127
+        end_sample = current_sample + len(wave)
+        if end_sample > len(audio):
+            audio = np.pad(audio, (0, end_sample - len(audio)))
+        audio[current_sample:end_sample] += wave
+        current_sample += len(wave)
+    audio /= np.max(np.abs(audio))
+    wavfile.write(output_file, sample_rate, (audio * 32767).astype(np.int16))
+
+def uncached_synthesize_wav(midi_data, output_file, sample_rate=44100, tempo=500000):
+    """float32 mixing through synth, rendering every note afresh"""
+    durations = np.array([mido.tick2second(n['duration'], 480, tempo) for n in midi_data])
+    lengths = (durations * sample_rate).astype(np.int64)
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    gains = synth.AMPLITUDE * np.array([n['velocity'] for n in midi_data], dtype=np.float32) / 127
+    audio = synth.mix_notes(first, lengths, [n['note'] for n in midi_data], gains, sample_rate,
+                            envelope=userWrite.ENVELOPE)
+    synth.write_wav(output_file, audio, sample_rate)
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='userWrite.synthesize_wav with and without the voice cache')
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--text', default='happy and bouncy')
+    args = parser.parse_args()
+
+    random.seed(0)
+    melody, params = userWrite.generate_melody_from_text(args.text, args.notes)
+    tempo = mido.bpm2tempo(params['tempo'])
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {name: os.path.join(tmp, f'{name}.wav') for name in ('legacy', 'uncached', 'cached')}
+        voices = synth.VoiceCache()
+        times = {
+            'legacy': timed(legacy_synthesize_wav, melody, paths['legacy'], tempo=tempo),
+            'uncached': timed(uncached_synthesize_wav, melody, paths['uncached'], tempo=tempo),
+            'cached': timed(userWrite.synthesize_wav, melody, paths['cached'], tempo=tempo,
+                            voices=voices),
+        }
+        # A second call reusing the cache, as a batch of prompts would
+        warm = timed(userWrite.synthesize_wav, melody, paths['cached'], tempo=tempo, voices=voices)
+        # Compare the first minute; the whole thing is several GB as float64
+        head = 60 * 44100
+        audio = {name: wavfile.read(path, mmap=True)[1][:head].astype(np.float64) / 32767
+                 for name, path in paths.items()}
+        seconds = len(wavfile.read(paths['cached'], mmap=True)[1]) / 44100
+
+    print(f"{args.notes} notes, {seconds:.0f} s of audio at {params['tempo']} BPM")
+    for name, elapsed in times.items():
+        print(f"{name:9s} {elapsed:7.2f} s")
+    print(f"{'warm':9s} {warm:7.2f} s   (cache reused)")
+    print(f"voice cache: {len(voices.voices)} voices, {voices.nbytes/1e6:.1f} MB, "
+          f"{voices.hits} hits / {voices.misses} misses")
+    # Notes shorter than attack+decay+release differ: the legacy release slice
+    # overwrote the attack, while synth.adsr_segment clamps the corners
+    print(f"first minute: max |cached - legacy| {np.max(np.abs(audio['cached'] - audio['legacy'])):.4f}   "
+          f"max |cached - uncached| {np.max(np.abs(audio['cached'] - audio['uncached'])):.5f}")
@@ -0,0 +1,175 @@
+import argparse
+import os
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from shortMIDI import (PACKED_ORDER_LIMIT, read_notes, count_packed, unpack_counts,
+                       root_block, pack_model, save_model)
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MIDI_EXTENSIONS = ('.mid', '.midi')
+
+def find_midi_files(directory):
+    """Every MIDI file under `directory`, in a stable order"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if name.lower().endswith(MIDI_EXTENSIONS))
+    return paths
+
+def file_counts(midi_path, max_order):
+    """Pitch histogram plus packed pair counts for every order, for one file
+
+    Counting per file keeps sequences from running across file boundaries.
+    Returns (path, counts, error); counts is None when the file can't be read.
+    """
+    try:
+        notes, _, _ = read_notes(midi_path)
+    except Exception as e:
+        return midi_path, None, str(e) or type(e).__name__
+    sequence = np.ascontiguousarray(notes['pitch'], dtype=np.int64)
+    counts = {0: np.bincount(sequence, minlength=128)}
+    for order in range(1, max_order+1):
+        if len(sequence) > order:
+            counts[order] = count_packed(sequence, order)
+    return midi_path, counts, None
+
+class CountTable:
+    """Merged corpus counts, compacted whenever enough new pairs pile up
+
+    Each order keeps at most `max_pairs` distinct (context, next note) pairs;
+    on overflow the rarest pairs are dropped, which bounds memory no matter
+    how large the corpus is.
+    """
+
+    def __init__(self, max_order, max_pairs):
+        self.max_order = max_order
+        self.max_pairs = max_pairs
+        self.root = np.zeros(128, dtype=np.int64)
+        self.merged = {order: (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+                       for order in range(1, max_order+1)}
+        self.pending = {order: [] for order in range(1, max_order+1)}
+        self.pending_pairs = 0
+        self.pruned = 0
+
+    def add(self, counts):
+        self.root += counts[0]
+        for order in range(1, self.max_order+1):
+            if order in counts:
+                self.pending[order].append(counts[order])
+                self.pending_pairs += len(counts[order][0])
+        if self.pending_pairs > self.max_pairs:
+            self.compact()
+
+    def compact(self):
+        for order, parts in self.pending.items():
+            if not parts:
+                continue
+            keys = np.concatenate([self.merged[order][0]] + [k for k, _ in parts])
+            counts = np.concatenate([self.merged[order][1]] + [c for _, c in parts])
+            keys, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+            if len(keys) > self.max_pairs:
+                keep = np.sort(np.argpartition(-counts, self.max_pairs)[:self.max_pairs])
+                self.pruned += len(keys) - len(keep)
+                keys, counts = keys[keep], counts[keep]
+            self.merged[order] = (keys, counts)
+            parts.clear()
+        self.pending_pairs = 0
+
+    def freeze(self, min_count=1):
+        """Build a FrozenMarkovModel from pairs seen at least `min_count` times"""
+        self.compact()
+        blocks = [root_block(self.root)]
+        for order in range(1, self.max_order+1):
+            keys, counts = self.merged[order]
+            keep = counts >= min_count
+            blocks.append(unpack_counts(keys[keep], counts[keep], order))
+        return pack_model(self.max_order, blocks)
+
+def peak_memory_mb():
+    """Peak RSS of this process and of its (finished) workers, in MB"""
+    if resource is None:
+        return None, None
+    scale = 1 / (1024 * 1024) if sys.platform == 'darwin' else 1 / 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def train_corpus(directory, max_order=3, workers=None, max_pairs=2_000_000, min_count=1):
+    """Train one model on every MIDI file under `directory`
+
+    Returns (model, stats) where stats has files, failed, notes and seconds.
+    """
+    if not 1 <= max_order < PACKED_ORDER_LIMIT:
+        raise ValueError(f"max_order must be between 1 and {PACKED_ORDER_LIMIT-1}")
+    paths = find_midi_files(directory)
+    table = CountTable(max_order, max_pairs)
+    stats = {'files': 0, 'failed': 0, 'notes': 0}
+    start = time.perf_counter()
+    
+    work = partial(file_counts, max_order=max_order)
+    if workers == 1:
+        results = map(work, paths)
+        pool = None
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(work, paths, chunksize=8)
+    try:
+        for path, counts, error in results:
+            if counts is None:
+                print(f"Skipping {path}: {error}")
+                stats['failed'] += 1
+                continue
+            table.add(counts)
+            stats['files'] += 1
+            stats['notes'] += int(counts[0].sum())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    model = table.freeze(min_count)
+    stats['seconds'] = time.perf_counter() - start
+    stats['pruned'] = table.pruned
+    return model, stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train one Markov model on a directory of MIDI files')
+    parser.add_argument('corpus', help='Directory searched recursively for .mid/.midi files')
+    parser.add_argument('output', help='Model file, usable with shortMIDI.py --model')
+    parser.add_argument('--max_order', type=int, default=3,
+                       help='Maximum Markov order (default: 3)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Parser processes (default: one per CPU)')
+    parser.add_argument('--max_pairs', type=int, default=2_000_000,
+                       help='Distinct transitions kept per order before pruning (default: 2000000)')
+    parser.add_argument('--min_count', type=int, default=1,
+                       help='Drop transitions seen fewer times than this (default: 1)')
+    
+    args = parser.parse_args()
+    
+    try:
+        model, stats = train_corpus(args.corpus, args.max_order, args.workers,
+                                    args.max_pairs, args.min_count)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        exit(1)
+    if not stats['files']:
+        print("Error: No readable MIDI files found")
+        exit(1)
+    
+    save_model(model, args.output, files=stats['files'], notes=stats['notes'])
+    rate = (stats['files'] + stats['failed']) / stats['seconds']
+    print(f"Trained on {stats['files']} files ({stats['failed']} skipped, "
+          f"{stats['notes']} notes) in {stats['seconds']:.1f}s, {rate:.1f} files/sec")
+    print(f"Model: {len(model)} states, {len(model.counts)} transitions, "
+          f"{stats['pruned']} rare transitions pruned")
+    main_mb, worker_mb = peak_memory_mb()
+    if main_mb is not None:
+        print(f"Peak memory: {main_mb:.1f} MB main, {worker_mb:.1f} MB largest worker")
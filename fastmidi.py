@@ -0,0 +1,336 @@
+import os
+from bisect import bisect_right
+
+# ===================== STDLIB FAST PATH =====================
+# A short shortMIDI.py run spends most of its time importing numpy and mido,
+# not generating. For small inputs this module does the whole default job -
+# parse, adaptive table model, one continuation, write - with the standard
+# library only, and writes the same bytes as the numpy path: the same model
+# rows and edge order, the same sampling arithmetic, and for seeded runs the
+# same uniforms, from a pure Python SeedSequence + PCG64. Anything it does
+# not handle exactly (other options, big or unusual files) returns False
+# before printing or writing anything, and the caller takes the full path.
+
+# Around here a numpy run with a warm model cache catches up; with a cold
+# cache the fast path is still ahead (see benchmarks/bench_startup.py)
+MAX_INPUT_BYTES = 128 * 1024
+TABLE_ORDER_LIMIT = 4  # Mirrors shortMIDI.TABLE_ORDER_LIMIT for index='auto'
+MAX_MESSAGE_LENGTH = 1000000  # mido's limit on one event's data
+
+class Unsupported(Exception):
+    """Input the fast path does not reproduce exactly; use the full path"""
+
+# ===================== MIDI READING =====================
+# Data length of each channel message, by the high nibble of its status
+CHANNEL_DATA = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+# Meta events mido decodes, with the shortest data it can decode
+META_MIN_LENGTH = {0x20: 1, 0x51: 3, 0x54: 5, 0x58: 4, 0x59: 2}
+
+def _check_meta(kind, data):
+    """Raise Unsupported where mido would refuse to decode this meta event"""
+    if len(data) < META_MIN_LENGTH.get(kind, 0) or (kind == 0x00 and len(data) == 1):
+        raise Unsupported('short meta event')
+    if kind == 0x54 and data[0] >> 5 > 3:
+        raise Unsupported('unknown SMPTE frame rate')
+    if kind == 0x59 and (data[1] > 1 or not -7 <= (data[0] ^ 0x80) - 0x80 <= 7):
+        raise Unsupported('unknown key signature')
+
+def read_notes(data):
+    """Notes of a Standard MIDI File, as shortMIDI.read_notes reads them
+
+    Returns (notes, ticks_per_beat, tempo changes): notes are
+    (onset, pitch, velocity) tuples in onset order across tracks, tempo
+    changes sorted (tick, tempo) pairs where the last change at a tick wins.
+    Raises Unsupported for anything mido would reject or read differently.
+    """
+    if data[:4] != b'MThd' or len(data) < 14:
+        raise Unsupported('not a MIDI file')
+    header_size = int.from_bytes(data[4:8], 'big')
+    if header_size < 6:
+        raise Unsupported('short header')
+    num_tracks = int.from_bytes(data[10:12], 'big', signed=True)
+    ticks_per_beat = int.from_bytes(data[12:14], 'big', signed=True)
+    if ticks_per_beat <= 0:
+        raise Unsupported('SMPTE time division')
+
+    notes, tempos = [], {}
+    pos = 8 + header_size
+    for _ in range(num_tracks):
+        if data[pos:pos+4] != b'MTrk' or len(data) < pos + 8:
+            raise Unsupported('missing MTrk chunk')
+        end = pos + 8 + int.from_bytes(data[pos+4:pos+8], 'big')
+        if end > len(data):
+            raise Unsupported('truncated track')
+        pos += 8
+        tick, status = 0, None
+        open_notes = {}  # (channel, pitch) -> indices into notes still sounding
+        while pos < end:
+            delta = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+                if byte < 0x80:
+                    break
+            tick += delta
+            byte = data[pos]
+            if byte >= 0x80:
+                pos += 1
+                if byte == 0xFF:
+                    kind = data[pos]
+                    pos += 1
+                    length = 0
+                    while True:
+                        byte = data[pos]
+                        pos += 1
+                        length = (length << 7) | (byte & 0x7F)
+                        if byte < 0x80:
+                            break
+                    if length > MAX_MESSAGE_LENGTH:
+                        raise Unsupported('meta event too long')
+                    meta = data[pos:pos+length]
+                    pos += length
+                    _check_meta(kind, meta)
+                    if kind == 0x51:
+                        tempos[tick] = (meta[0] << 16) | (meta[1] << 8) | meta[2]
+                    continue
+                if byte >= 0xF0:
+                    raise Unsupported('system event')  # Sysex, or running status after one
+                status = byte
+            elif status is None:
+                raise Unsupported('running status without a status byte')
+            size = CHANNEL_DATA[status & 0xF0]
+            message = data[pos:pos+size]
+            pos += size
+            if len(message) < size or max(message) > 127:
+                raise Unsupported('bad channel message')
+            kind, channel = status & 0xF0, status & 0x0F
+            if kind == 0x90 and message[1] > 0:
+                open_notes.setdefault((channel, message[0]), []).append(len(notes))
+                notes.append([tick, message[0], message[1], tick])
+            elif kind == 0x80 or kind == 0x90:
+                rows = open_notes.get((channel, message[0]))
+                if rows:
+                    notes[rows.pop(0)][3] = tick
+        if pos != end:
+            raise Unsupported('event runs past the end of its track')
+    # Merge the tracks into one time-ordered stream (sorted() is stable)
+    notes = [(onset, pitch, velocity) for onset, pitch, velocity, _ in
+             sorted(notes, key=lambda note: note[0])]
+    return notes, ticks_per_beat, sorted(tempos.items())
+
+# ===================== MODEL =====================
+class TableModel:
+    """The rows and edges of shortMIDI's table FrozenMarkovModel, as lists
+
+    Row 0 is the empty context, then every context of order 1, 2, ... in
+    sorted order, each row's edges sorted by note: exactly the layout
+    build_adaptive_model packs, so sampling lands on the same edges.
+    """
+
+    def __init__(self, pitches, order):
+        self.order = order
+        rows = [()]
+        counts = [{}]
+        for pitch in pitches:
+            counts[0][pitch] = counts[0].get(pitch, 0) + 1
+        for size in range(1, order + 1):
+            level = {}
+            for i in range(len(pitches) - size):
+                edges = level.setdefault(tuple(pitches[i:i+size]), {})
+                note = pitches[i+size]
+                edges[note] = edges.get(note, 0) + 1
+            for context in sorted(level):
+                rows.append(context)
+                counts.append(level[context])
+        self.rows = {context: row for row, context in enumerate(rows)}
+
+        # Edge e of row r sits in [row_start[r], row_start[r+1]); edge_end is
+        # the running count total, which sample_batch searches
+        self.row_start, self.edge_end, self.next_note, self.next_row = [0], [], [], []
+        total = 0
+        for context, edges in zip(rows, counts):
+            for note in sorted(edges):
+                total += edges[note]
+                self.edge_end.append(total)
+                self.next_note.append(note)
+                self.next_row.append(self.lookup(context + (note,)))
+            self.row_start.append(len(self.edge_end))
+
+    def lookup(self, context):
+        """Row of the longest suffix of `context` present in the model"""
+        context = tuple(context)[-self.order:]
+        for size in range(len(context), 0, -1):
+            row = self.rows.get(context[-size:])
+            if row is not None:
+                return row
+        return 0
+
+    def sample(self, row, uniforms):
+        """FrozenMarkovModel.sample_batch for a single chain"""
+        row_start, edge_end, next_note, next_row = (self.row_start, self.edge_end,
+                                                    self.next_note, self.next_row)
+        continuation = []
+        for u in uniforms:
+            lo, hi = row_start[row], row_start[row+1]
+            if lo == hi:  # Empty model
+                continuation.append(60)  # Middle C
+                continue
+            base = edge_end[lo-1] if lo else 0
+            edge = min(bisect_right(edge_end, base + u * (edge_end[hi-1] - base), lo, hi), hi - 1)
+            continuation.append(next_note[edge])
+            row = next_row[edge]
+        return continuation
+
+# ===================== RANDOM STREAMS =====================
+# numpy's SeedSequence mixing and PCG64 (XSL-RR 128/64), so a seeded run
+# draws the uniforms of np.random.default_rng(SeedSequence(seed, spawn_key=(i,)))
+MASK32, MASK64, MASK128 = (1 << 32) - 1, (1 << 64) - 1, (1 << 128) - 1
+INIT_A, MULT_A, INIT_B, MULT_B = 0x43b0d7e5, 0x931e8875, 0x8b51f9dd, 0x58f38ded
+MIX_MULT_L, MIX_MULT_R = 0xca01f9dd, 0x4973f715
+POOL_SIZE = 4
+PCG_MULTIPLIER = 0x2360ED051FC65DA44385DF649FCCF645
+
+def _words(value):
+    """A non-negative int as little-endian uint32 words, as SeedSequence takes it"""
+    words = [value & MASK32]
+    value >>= 32
+    while value:
+        words.append(value & MASK32)
+        value >>= 32
+    return words
+
+def seed_state(seed, spawn_key=(), words=8):
+    """SeedSequence(seed, spawn_key).generate_state(words) as uint32 words"""
+    entropy = _words(seed)
+    spawn = [word for key in spawn_key for word in _words(key)]
+    if spawn and len(entropy) < POOL_SIZE:
+        entropy += [0] * (POOL_SIZE - len(entropy))
+    entropy += spawn
+
+    hash_const = INIT_A
+    def hashmix(value):
+        nonlocal hash_const
+        value = (value ^ hash_const) & MASK32
+        hash_const = (hash_const * MULT_A) & MASK32
+        value = (value * hash_const) & MASK32
+        return value ^ (value >> 16)
+    def mix(x, y):
+        result = (MIX_MULT_L * x - MIX_MULT_R * y) & MASK32
+        return result ^ (result >> 16)
+
+    pool = [hashmix(entropy[i] if i < len(entropy) else 0) for i in range(POOL_SIZE)]
+    for src in range(POOL_SIZE):
+        for dst in range(POOL_SIZE):
+            if src != dst:
+                pool[dst] = mix(pool[dst], hashmix(pool[src]))
+    for src in range(POOL_SIZE, len(entropy)):
+        for dst in range(POOL_SIZE):
+            pool[dst] = mix(pool[dst], hashmix(entropy[src]))
+
+    state, hash_const = [], INIT_B
+    for i in range(words):
+        value = (pool[i % POOL_SIZE] ^ hash_const) & MASK32
+        hash_const = (hash_const * MULT_B) & MASK32
+        value = (value * hash_const) & MASK32
+        state.append(value ^ (value >> 16))
+    return state
+
+def seeded_uniforms(seed, sample, length):
+    """The `length` uniforms sample `sample` of generate_continuations draws"""
+    words = seed_state(seed, (sample,))
+    # generate_state(4, uint64), then PCG64's set_seed(state, inc) on 128-bit halves
+    value = [words[2*i] | (words[2*i+1] << 32) for i in range(4)]
+    initstate, initseq = (value[0] << 64) | value[1], (value[2] << 64) | value[3]
+    increment = ((initseq << 1) | 1) & MASK128
+    # pcg_setseq_128_srandom_r: one step from state 0 leaves `increment`
+    state = ((increment + initstate) * PCG_MULTIPLIER + increment) & MASK128
+    uniforms = []
+    for _ in range(length):
+        state = (state * PCG_MULTIPLIER + increment) & MASK128
+        rotate = state >> 122
+        bits = ((state >> 64) ^ state) & MASK64
+        bits = ((bits >> rotate) | (bits << (64 - rotate))) & MASK64
+        uniforms.append((bits >> 11) * (1.0 / 9007199254740992.0))
+    return uniforms
+
+# ===================== MIDI WRITING =====================
+def _vlq(value):
+    if value >= 1 << 28:
+        raise Unsupported('delta time too large')  # The full path reports it
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+def encode_track(notes, tempos):
+    """shortMIDI.encode_track(durations=False) for (onset, pitch, velocity) notes"""
+    # Tempo changes sort ahead of notes on the same tick; notes keep their order
+    items = sorted([(tick * 2, 0xFF, tempo) for tick, tempo in tempos]
+                   + [(onset * 2 + 1, pitch, velocity) for onset, pitch, velocity in notes],
+                   key=lambda item: item[0])
+    # note_on and note_off alternate, so running status never applies
+    out, last_tick = bytearray(), 0
+    for key, first, second in items:
+        tick = key >> 1
+        out += _vlq(tick - last_tick)
+        last_tick = tick
+        if first == 0xFF:
+            out += bytes((0xFF, 0x51, 3, (second >> 16) & 0xFF, (second >> 8) & 0xFF,
+                          second & 0xFF))
+        else:
+            out += bytes((0x90, first, second, 0, 0x80, first, 0))  # note_off follows directly
+    out += b'\x00\xff\x2f\x00'  # end_of_track
+    return b'MTrk' + len(out).to_bytes(4, 'big') + bytes(out)
+
+# ===================== CLI =====================
+def eligible(args):
+    """Whether the fast path covers this shortMIDI.py invocation"""
+    table = args.index == 'table' or (args.index == 'auto' and args.max_order
+                                      and args.max_order <= TABLE_ORDER_LIMIT)
+    return (not args.no_fast_path and table and args.max_order > 0 and args.num_samples == 1
+            and not (args.rhythm or args.model or args.audio or args.profile
+                     or args.profile_cprofile or args.profile_tracemalloc)
+            and (args.seed is None or args.seed >= 0)
+            and os.path.isfile(args.input) and os.path.getsize(args.input) <= MAX_INPUT_BYTES)
+
+def run(args, uniforms=None):
+    """Do the job shortMIDI.py's default path would; False if it has to do it instead"""
+    try:
+        with open(args.input, 'rb') as f:
+            notes, ticks_per_beat, tempos = read_notes(f.read())
+        if not notes:
+            return False  # The full path reports it
+        pitches = [pitch for _, pitch, _ in notes]
+        order = max(min(args.max_order, len(pitches) - 1), 1)
+        model = TableModel(pitches, order)
+        row = model.lookup(pitches[-order:])
+        if args.seed is not None:
+            uniforms = seeded_uniforms(args.seed, 0, args.length)
+        elif uniforms is None:
+            from random import random
+            uniforms = [random() for _ in range(args.length)]
+        new_notes = model.sample(row, uniforms)
+        last_time = notes[-1][0]  # Notes are in onset order
+        generated = [(last_time + (i + 1) * ticks_per_beat, pitch, 64)
+                     for i, pitch in enumerate(new_notes)]
+        track = encode_track(notes + generated, tempos)
+    except (Unsupported, IndexError, OSError):
+        return False
+    header = (b'MThd' + (6).to_bytes(4, 'big') + (1).to_bytes(2, 'big')
+              + (1).to_bytes(2, 'big') + ticks_per_beat.to_bytes(2, 'big'))
+
+    print(f"Parsed {len(notes)} notes from MIDI file")
+    print(f"Using adaptive Markov order up to {order}")
+    if args.seed is not None:
+        print(f"Generating 1 samples with seed {args.seed}")
+    try:
+        with open(args.output, 'wb') as f:
+            f.write(header + track)
+        print(f"Successfully saved {len(new_notes)} new notes to {args.output}")
+    except Exception as e:
+        print(f"Error saving MIDI: {str(e)}")
+        exit(1)
+    return True
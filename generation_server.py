@@ -0,0 +1,505 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import signal
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import shortMIDI
+
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_LENGTH = 10000
+MAX_NOTES = 100000  # Posted notes per request
+MAX_NOTE_SECONDS = 24 * 3600  # Latest recorded note time, well inside int64 ticks
+MAX_ORDER = 12
+STREAM_CHUNK = 256  # Largest batch of notes fetched per round trip while streaming
+MAX_STREAMS = 1024  # Open streams per worker before the oldest is dropped
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+NOTE_NAME = re.compile(r'^([A-Ga-g])([#b]?)(-?\d)$')
+TICKS_PER_SECOND = 960  # 480 ticks per beat at 120 bpm, for recorded note times
+RECORDED_DURATION = 240  # script.js plays each key as an eighth note
+STATUS_TEXT = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large',
+               410: 'Gone', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+               503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+class ServiceError(Exception):
+    """A request failure reported to the client as {"error": {"code", "message"}}"""
+
+    def __init__(self, status, code, message):
+        super().__init__(status, code, message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+def note_number(note):
+    """MIDI number from an int or a Tone.js style name such as 'C#4'"""
+    if isinstance(note, int) and not isinstance(note, bool) and 0 <= note <= 127:
+        return note
+    match = NOTE_NAME.match(note) if isinstance(note, str) else None
+    if match:
+        letter, accidental, octave = match.groups()
+        number = (12 * (int(octave) + 1) + NOTE_NAMES.index(letter.upper())
+                  + {'#': 1, 'b': -1, '': 0}[accidental])
+        if 0 <= number <= 127:
+            return number
+    raise ServiceError(400, 'invalid_notes', f"Not a MIDI note: {note!r}")
+
+def note_name(number):
+    return f"{NOTE_NAMES[number % 12]}{number // 12 - 1}"
+
+# Every spelling note_number accepts, so a list of names converts with one
+# dict lookup per note
+_NOTE_NUMBERS = {f"{letter}{accidental}{octave}": number
+                 for letter in 'CDEFGABcdefgab' for accidental in ('', '#', 'b')
+                 for octave in range(-1, 10)
+                 for number in [12 * (octave + 1) + NOTE_NAMES.index(letter.upper())
+                                + {'#': 1, 'b': -1, '': 0}[accidental]]
+                 if 0 <= number <= 127}
+
+def _pitches(values):
+    """MIDI numbers for a list of numbers and/or names, checked in bulk"""
+    if set(map(type, values)) == {int} and 0 <= min(values) and max(values) <= 127:
+        return np.array(values, dtype=np.int16)
+    pitches = np.array([value if type(value) is int and 0 <= value <= 127
+                        else _NOTE_NUMBERS.get(value, -1) if type(value) is str else -1
+                        for value in values])
+    bad = pitches < 0
+    if bad.any():
+        note_number(values[int(np.argmax(bad))])  # Raises with the offending note
+    return pitches.astype(np.int16)
+
+def ingest_notes(notes):
+    """Validate posted notes in bulk into a note table ordered by onset
+
+    `notes` is a list of MIDI numbers or names ('C4', 'F#3'), one beat apart,
+    or script.js's recordedNotes objects {"note", "time"} with times in seconds.
+    """
+    if not isinstance(notes, list) or not notes:
+        raise ServiceError(400, 'no_notes', 'No notes provided')
+    if len(notes) > MAX_NOTES:
+        raise ServiceError(400, 'invalid_notes', f"At most {MAX_NOTES} notes per request")
+    table = shortMIDI.empty_note_table(len(notes))
+    if isinstance(notes[0], dict):
+        try:
+            values = [note['note'] for note in notes]
+            times = [note['time'] for note in notes]
+            # JSON numbers only: "1" and true would otherwise pass as 1.0
+            if not set(map(type, times)) <= {int, float}:
+                raise TypeError
+            times = np.array(times, dtype=np.float64)
+        except (TypeError, KeyError, OverflowError):
+            raise ServiceError(400, 'invalid_notes',
+                               'Recorded notes must be objects with a "note" and a numeric "time"')
+        if not np.isfinite(times).all() or (times < 0).any() or (times > MAX_NOTE_SECONDS).any():
+            raise ServiceError(400, 'invalid_notes',
+                               f"Note times must be seconds from 0 to {MAX_NOTE_SECONDS}")
+        table['onset'] = np.round(times * TICKS_PER_SECOND)
+        table['offset'] = table['onset'] + RECORDED_DURATION
+    else:
+        values = notes
+        table['onset'] = np.arange(len(notes)) * 480
+        table['offset'] = table['onset'] + 480
+    table['pitch'] = _pitches(values)
+    table['velocity'] = 64
+    return table[np.argsort(table['onset'], kind='stable')]
+
+def fingerprint(table):
+    """Digest of a recording's pitch sequence, which is all its model depends on"""
+    return hashlib.blake2b(table['pitch'].astype(np.uint8).tobytes(), digest_size=16).digest()
+
+# Each worker process keeps its own LRU of built models. Requests are routed
+# by seed, so repeats of a seed land on the worker that already holds it.
+_models = OrderedDict()
+_cache_size = 64
+
+def _init_worker(cache_size):
+    global _cache_size
+    _cache_size = cache_size
+
+def _cached_model(key, build):
+    """Return (model, order, hit), building and remembering it on a miss"""
+    if key in _models:
+        _models.move_to_end(key)
+        return (*_models[key], True)
+    model, order = build()
+    _models[key] = (model, order)
+    if len(_models) > _cache_size:
+        _models.popitem(last=False)
+    return model, order, False
+
+def _read_midi(data):
+    try:
+        notes, ticks_per_beat, tempos = shortMIDI.read_notes(io.BytesIO(data))
+    except Exception as e:
+        raise ServiceError(422, 'invalid_midi', f"Could not parse MIDI: {str(e) or type(e).__name__}")
+    if not len(notes):
+        raise ServiceError(422, 'no_notes', 'No notes found in MIDI file')
+    return notes, ticks_per_beat, tempos
+
+def parse_task(data):
+    notes, ticks_per_beat, tempos = _read_midi(data)
+    return {'ticks_per_beat': ticks_per_beat, 'tempos': tempos.to_meta(),
+            'notes': {column: notes[column].tolist()
+                      for column in ('onset', 'offset', 'pitch', 'velocity', 'track', 'channel')}}
+
+def _seed_model(table, digest, max_order):
+    """The recording's model, built once per (fingerprint, max_order) in this worker"""
+    return _cached_model(('notes', max_order, digest),
+                         lambda: shortMIDI.build_adaptive_model(table, max_order))
+
+def generate_task(table, digest, length, max_order, seed):
+    """Continue an ingested recording; returns (pitches, order, cache hit)"""
+    model, order, hit = _seed_model(table, digest, max_order)
+    last_notes = table['pitch'][-order:].tolist()
+    new_notes = shortMIDI.generate_continuations(model, last_notes, length, 1, order, seed)[0]
+    return new_notes.tolist(), order, hit
+
+def continue_task(data, digest, length, max_order, seed):
+    """Continue an uploaded MIDI file; returns (MIDI bytes, order, cache hit)"""
+    notes, ticks_per_beat, tempos = _read_midi(data)
+    model, order, hit = _cached_model(('midi', max_order, digest),
+                                      lambda: shortMIDI.build_adaptive_model(notes, max_order))
+    last_notes = notes['pitch'][-order:].tolist()
+    new_notes = shortMIDI.generate_continuations(model, last_notes, length, 1, order, seed)[0]
+    return shortMIDI.continuation_midi(notes, new_notes, ticks_per_beat, tempos), order, hit
+
+# Streams stay open in the worker that started them, as live note generators
+_streams = OrderedDict()
+
+def stream_open_task(stream_id, table, digest, length, max_order, seed):
+    """Start a continuation that stream_next_task draws from; returns (order, cache hit)"""
+    model, order, hit = _seed_model(table, digest, max_order)
+    _streams[stream_id] = shortMIDI.iter_continuation(model, table['pitch'][-order:].tolist(),
+                                                      length, order, seed=seed)
+    if len(_streams) > MAX_STREAMS:
+        _streams.popitem(last=False)  # Abandoned without a close
+    return order, hit
+
+def stream_next_task(stream_id, size):
+    """Up to `size` more notes; a short chunk means the stream is finished"""
+    notes = _streams.get(stream_id)
+    if notes is None:
+        raise ServiceError(410, 'stream_closed', f"Stream {stream_id} is no longer open")
+    chunk = list(islice(notes, size))
+    if len(chunk) < size:
+        del _streams[stream_id]
+    return chunk
+
+def stream_close_task(stream_id):
+    _streams.pop(stream_id, None)
+
+class GenerationService:
+    """Non-blocking HTTP front end for parsing, model building and generation
+
+    The event loop only reads requests and writes responses. Model building
+    and sampling run in single-process executors, one per worker; a request
+    goes to the worker picked by its recording's fingerprint (or the file's
+    digest), which is what makes that worker's model cache effective.
+    """
+
+    def __init__(self, workers=None, timeout=30.0, cache_size=64, max_pending=256):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self.open_streams = 0
+        self.stats = {'requests': 0, 'errors': 0, 'model_cache_hits': 0, 'model_builds': 0}
+        self._stream_ids = count()
+        self._pools = [ProcessPoolExecutor(1, initializer=_init_worker, initargs=(cache_size,))
+                       for _ in range(self.workers)]
+        # Start the workers now: forked on a first request they would inherit
+        # its socket, and closing the connection would no longer end a stream
+        for pool in self._pools:
+            pool.submit(int).result()
+        self.routes = {
+            '/health': ('GET', self.health),
+            '/parse': ('POST', self.parse),
+            '/generate': ('POST', self.generate),
+            '/generate/stream': ('POST', self.generate_stream),
+            '/continue': ('POST', self.continue_midi),
+        }
+
+    def close(self):
+        for pool in self._pools:
+            pool.shutdown(cancel_futures=True)
+
+    async def _run(self, route_key, function, *args):
+        """Run `function` on the worker owning `route_key`, with backpressure and a timeout"""
+        if self.pending >= self.max_pending:
+            raise ServiceError(503, 'busy', 'Too many requests in flight, retry shortly')
+        pool = self._pools[zlib.crc32(route_key) % len(self._pools)]
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, function, *args)
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ServiceError(504, 'timeout', f"Generation took longer than {self.timeout:g}s")
+        finally:
+            self.pending -= 1
+
+    def _count_model(self, hit):
+        self.stats['model_cache_hits' if hit else 'model_builds'] += 1
+
+    async def health(self, query, body):
+        return 200, {'status': 'ok', 'workers': self.workers, 'pending': self.pending,
+                     'open_streams': self.open_streams, **self.stats}
+
+    async def parse(self, query, body):
+        return 200, await self._run(body[:4096], parse_task, body)
+
+    def _generation_request(self, body):
+        """(note table, fingerprint, names?, length, max_order, seed) from a JSON body"""
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError as e:
+            raise ServiceError(400, 'invalid_json', str(e))
+        if not isinstance(data, dict):
+            raise ServiceError(400, 'invalid_json', 'Expected a JSON object')
+        notes = data.get('notes')
+        table = ingest_notes(notes)
+        first = notes[0]['note'] if isinstance(notes[0], dict) else notes[0]
+        return (table, fingerprint(table), isinstance(first, str), *_options(data))
+
+    async def generate(self, query, body):
+        """JSON {"notes": [...], "length", "max_order", "seed"} -> {"generated_notes": [...]}
+
+        Notes may be MIDI numbers, names ('C4', 'F#3') or recorded {"note", "time"}
+        objects (see ingest_notes); names come back as names. Re-posting the same
+        recording reuses its model, so only sampling is paid again.
+        """
+        table, digest, names, length, max_order, seed = self._generation_request(body)
+        new_notes, order, hit = await self._run(digest, generate_task, table, digest,
+                                                length, max_order, seed)
+        self._count_model(hit)
+        if names:
+            new_notes = [note_name(note) for note in new_notes]
+        return 200, {'generated_notes': new_notes, 'seed': seed, 'order': order,
+                     'fingerprint': digest.hex(), 'model_cached': hit}
+
+    async def generate_stream(self, query, body):
+        """The /generate request, answered as Server-Sent Events while notes are drawn
+
+        Events are "start" {seed, order}, one "note" {index, note} per note,
+        then "done" {count} or "error" {code, message}. The first note is sent
+        as soon as the model exists; later notes come in growing batches.
+        Closing the connection cancels the stream and its worker stops drawing.
+        """
+        table, route, names, length, max_order, seed = self._generation_request(body)
+        stream_id = next(self._stream_ids)
+        order, hit = await self._run(route, stream_open_task, stream_id, table, route,
+                                     length, max_order, seed)
+        self._count_model(hit)
+        self.open_streams += 1
+        return 200, self._note_events(route, stream_id, names, seed, order)
+
+    async def _note_events(self, route, stream_id, names, seed, order):
+        sent, size, finished = 0, 1, False
+        try:
+            # Inside the try: a client gone after "start" must still release the stream
+            yield _event('start', {'seed': seed, 'order': order})
+            while not finished:
+                chunk = await self._run(route, stream_next_task, stream_id, size)
+                finished = len(chunk) < size
+                yield b''.join(_event('note', {'index': sent + i,
+                                               'note': note_name(note) if names else note})
+                               for i, note in enumerate(chunk))
+                sent += len(chunk)
+                size = min(size * 2, STREAM_CHUNK)
+            yield _event('done', {'count': sent})
+        except ServiceError as e:
+            yield _event('error', {'code': e.code, 'message': e.message})
+        finally:
+            self.open_streams -= 1
+            if not finished:
+                try:
+                    await self._run(route, stream_close_task, stream_id)
+                except ServiceError:
+                    pass
+
+    async def continue_midi(self, query, body):
+        """MIDI file in the body, options in the query string -> original plus continuation"""
+        if not body:
+            raise ServiceError(400, 'no_midi', 'Send a MIDI file as the request body')
+        length, max_order, seed = _options({name: values[-1] for name, values in query.items()})
+        digest = hashlib.blake2b(body, digest_size=16).digest()  # Keys the model cache
+        data, order, hit = await self._run(digest, continue_task, body, digest,
+                                           length, max_order, seed)
+        self._count_model(hit)
+        return 200, data, {'X-Seed': str(seed), 'X-Order': str(order)}
+
+    async def dispatch(self, method, target, body):
+        """Returns (status, payload, extra headers)
+
+        The payload is JSON-able, bytes, or an async iterator of event-stream chunks.
+        """
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if method == 'OPTIONS':
+            return 204, b'', {}
+        if route is None:
+            raise ServiceError(404, 'not_found', f"No endpoint {url.path}")
+        if method != route[0]:
+            raise ServiceError(405, 'method_not_allowed', f"{url.path} expects {route[0]}")
+        result = await route[1](parse_qs(url.query), body)
+        return result if len(result) == 3 else (*result, {})
+
+    async def handle(self, reader, writer):
+        """Serve one connection, keeping it open between HTTP/1.1 requests"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = False
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        raise ServiceError(413, 'too_large', f"Body over {MAX_BODY_BYTES} bytes")
+                    body = await reader.readexactly(length) if length > 0 else b''
+                    keep_alive = (version == 'HTTP/1.1'
+                                  and headers.get('connection', '').lower() != 'close')
+                    self.stats['requests'] += 1
+                    status, payload, extra = await self.dispatch(method, target, body)
+                except ServiceError as e:
+                    status, payload, extra = e.status, _error(e.code, e.message), {}
+                except ValueError:
+                    status, payload, extra = 400, _error('bad_request', 'Malformed HTTP request'), {}
+                except Exception as e:
+                    status, payload, extra = 500, _error('internal', str(e) or type(e).__name__), {}
+                if status >= 400:
+                    self.stats['errors'] += 1
+                if hasattr(payload, '__aiter__'):
+                    # A stream's end is marked by closing the connection
+                    writer.write(_head(status, 'text/event-stream', None,
+                                       {'Cache-Control': 'no-cache', **extra}, False))
+                    await _write_stream(writer, payload)
+                    break
+                writer.write(_response(status, payload, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def _integer(value):
+    """A JSON integer or a query-string number; 1.5 or true would be silently
+    truncated by int(), so anything but int or str is refused"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise TypeError(f"not an integer: {value!r}")
+    return int(value)
+
+def _options(values):
+    """length, max_order, seed from a JSON body or query string, validated"""
+    try:
+        length = _integer(values.get('length', 50))
+        max_order = _integer(values.get('max_order', 3))
+        seed = values.get('seed')
+        seed = _integer(seed) if seed is not None else int.from_bytes(os.urandom(4), 'big')
+    except (TypeError, ValueError):
+        raise ServiceError(400, 'invalid_parameter', 'length, max_order and seed must be integers')
+    if not 1 <= length <= MAX_LENGTH:
+        raise ServiceError(400, 'invalid_parameter', f"length must be 1..{MAX_LENGTH}")
+    if not 1 <= max_order <= MAX_ORDER:
+        raise ServiceError(400, 'invalid_parameter', f"max_order must be 1..{MAX_ORDER}")
+    if seed < 0:
+        raise ServiceError(400, 'invalid_parameter', 'seed must be non-negative')
+    return length, max_order, seed
+
+def _error(code, message):
+    return {'error': {'code': code, 'message': message}}
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+async def _write_stream(writer, events):
+    """Write event-stream chunks until the events end or the client goes away
+
+    A client that has only half-closed (done sending) still gets every note;
+    a lost connection shows up as a closing transport or a failed drain,
+    which stops drawing notes for it.
+    """
+    try:
+        async for chunk in events:
+            if writer.is_closing():
+                break
+            if chunk:
+                writer.write(chunk)
+                await writer.drain()
+    finally:
+        await events.aclose()
+
+def _response(status, payload, extra, keep_alive):
+    if isinstance(payload, bytes):
+        body, content_type = payload, 'audio/midi'
+    else:
+        body, content_type = json.dumps(payload).encode(), 'application/json'
+    return _head(status, content_type, len(body), extra, keep_alive) + body
+
+def _head(status, content_type, length, extra, keep_alive):
+    headers = {
+        'Content-Type': content_type,
+        **({'Content-Length': str(length)} if length is not None else {}),
+        'Connection': 'keep-alive' if keep_alive else 'close',
+        # script.js posts from the page server on another port
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type',
+        **extra,
+    }
+    head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+    head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+    return head.encode('latin-1') + b'\r\n'
+
+async def serve(host, port, service):
+    server = await asyncio.start_server(service.handle, host, port)
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+    print(f"Generation service on http://{host}:{port} with {service.workers} workers")
+    async with server:
+        await stop.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Async HTTP service for Markov continuation')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5500,
+                       help='Port to listen on (default: 5500, where script.js posts)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Generation processes (default: one per CPU)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                       help='Seconds before a request fails with 504 (default: 30)')
+    parser.add_argument('--cache_size', type=int, default=64,
+                       help='Models kept per worker (default: 64)')
+    parser.add_argument('--max_pending', type=int, default=256,
+                       help='Requests in flight before answering 503 (default: 256)')
+    args = parser.parse_args()
+
+    service = GenerationService(args.workers, args.timeout, args.cache_size, args.max_pending)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Shut the worker processes down too, or they outlive the server
+        service.close()
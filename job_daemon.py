@@ -0,0 +1,88 @@
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+
+# ===================== PERSISTENT WORKER =====================
+# A scheduler that launches many short shortMIDI.py runs pays interpreter
+# start-up and the numpy/mido imports on every one. A worker started once
+# with --serve keeps all of that loaded and runs each job sent by
+# `shortMIDI.py ... --connect SOCKET` in-process. The protocol is one JSON
+# line each way over a Unix socket:
+#   request  {"argv": [...], "cwd": "/job/dir"}
+#   response {"status": 0, "output": "what the job printed"}
+# Jobs run one at a time, in the client's working directory, so relative
+# paths mean what they would have meant in a fresh process.
+
+def run_job(main, argv, cwd):
+    """Call main(argv) in `cwd` with its output captured; returns (status, output)"""
+    output = io.StringIO()
+    previous = os.getcwd()
+    status = 0
+    try:
+        os.chdir(cwd)
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            main(argv)
+    except SystemExit as e:
+        # exit(n), exit() and argparse errors, as the process would have exited
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            output.write(f"{e.code}\n")
+            status = 1
+    except Exception as e:
+        output.write(f"Error: {type(e).__name__}: {e}\n")
+        status = 1
+    finally:
+        os.chdir(previous)
+    return status, output.getvalue()
+
+def serve(path, main):
+    """Accept jobs on the Unix socket `path` until interrupted"""
+    import socketserver  # Clients never need it
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+                argv, cwd = list(map(str, request['argv'])), str(request['cwd'])
+            except (ValueError, KeyError, TypeError) as e:
+                status, output = 2, f"Error: bad job request: {e}\n"
+            else:
+                status, output = run_job(main, argv, cwd)
+            self.wfile.write(json.dumps({'status': status, 'output': output}).encode() + b'\n')
+
+    if os.path.exists(path):
+        os.unlink(path)  # Left behind by a worker that did not shut down cleanly
+    # SIGTERM stops the worker like Ctrl-C, so the socket file is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        print(f"Worker listening on {path}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+def submit(path, argv, timeout=None):
+    """Run a job in the worker on `path`, printing its output; returns its exit
+    status, or None when no worker answers so the caller can run it itself"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(path)
+        except OSError:
+            return None
+        # Once the worker has the job, a failure is the job's, not a reason to rerun it
+        try:
+            request = {'argv': list(argv), 'cwd': os.getcwd()}
+            client.sendall(json.dumps(request).encode() + b'\n')
+            with client.makefile('rb') as reply:
+                response = json.loads(reply.readline())
+        except (OSError, ValueError) as e:
+            print(f"Error: lost the worker on {path}: {e}")
+            return 1
+    print(response['output'], end='')
+    return response['status']
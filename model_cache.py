@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+# ===================== ON-DISK MODEL STORE =====================
+# Each entry is one file: a magic line, a little-endian uint32 header length,
+# a JSON header describing the arrays, then the raw array bytes at 64-byte
+# aligned offsets so they can be memory mapped straight back in.
+MAGIC = b'TTNMODEL1\n'
+ALIGN = 64
+SUFFIX = '.model'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+FORMAT_VERSION = 3  # Bump when what the scripts store changes
+
+def default_cache_dir():
+    """TUNETUAH_CACHE_DIR if set, otherwise ~/.cache/tunetuahnote"""
+    return os.environ.get('TUNETUAH_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'tunetuahnote'))
+
+def cache_key(midi_path, kind, **params):
+    """Hash the file's bytes together with the model kind and build parameters"""
+    digest = hashlib.sha256(b'%d\n' % FORMAT_VERSION)
+    with open(midi_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(json.dumps([kind, sorted(params.items())]).encode())
+    return digest.hexdigest()
+
+def tempos_to_meta(tempos):
+    """set_tempo messages -> JSON-friendly [tempo, delta] pairs"""
+    return [[msg.tempo, msg.time] for msg in tempos]
+
+def tempos_from_meta(pairs):
+    from mido import MetaMessage
+    return [MetaMessage('set_tempo', tempo=tempo, time=delta) for tempo, delta in pairs]
+
+def read_arrays(path):
+    """Return (arrays, meta) from an entry file, arrays memory mapped read-only"""
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(raw[:len(MAGIC)]) != MAGIC:
+        raise ValueError('bad magic')
+    start = len(MAGIC) + 4
+    size = int(raw[len(MAGIC):start].view('<u4')[0])
+    header = json.loads(bytes(raw[start:start+size]).decode())
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.lib.format.descr_to_dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        end = spec['offset'] + count * dtype.itemsize
+        arrays[name] = raw[spec['offset']:end].view(dtype).reshape(spec['shape'])
+    return arrays, header['meta']
+
+def write_arrays(path, arrays, meta):
+    """Write named arrays plus JSON metadata atomically to `path`"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    specs, offset = {}, 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        specs[name] = {'dtype': np.lib.format.dtype_to_descr(array.dtype),
+                       'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    # Offsets are relative to the data section until the header size is known
+    def encode(base):
+        shifted = {name: {**spec, 'offset': spec['offset'] + base}
+                   for name, spec in specs.items()}
+        return json.dumps({'meta': meta, 'arrays': shifted}).encode()
+    base = 0
+    while True:
+        header = encode(base)
+        needed = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+        if needed <= base:
+            break
+        base = needed
+    header = header.ljust(base - len(MAGIC) - 4)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header)).astype('<u4').tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(specs[name]['offset'] + base)
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+class ModelCache:
+    """Size-bounded LRU store of named NumPy arrays plus JSON metadata"""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key):
+        """Return (arrays, meta) with arrays memory mapped, or None on a miss"""
+        path = self.path(key)
+        try:
+            arrays, meta = read_arrays(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Discarding unreadable cache entry {path}: {str(e)}")
+            self._remove(path)
+            return None
+        # Touch the entry so eviction sees it as recently used
+        now = time.time()
+        os.utime(path, (now, now))
+        return arrays, meta
+
+    def save(self, key, arrays, meta):
+        """Write an entry atomically, then evict old entries over the size budget"""
+        write_arrays(self.path(key), arrays, meta)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the store fits max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# ===================== ARCHIVED SCRIPT MODELS =====================
+def records_to_array(records, fields):
+    """List of int-valued note dicts -> structured int64 array"""
+    dtype = np.dtype([(field, np.int64) for field in fields])
+    return np.array([tuple(r[f] for f in fields) for r in records], dtype=dtype)
+
+def records_from_array(array):
+    fields = array.dtype.names
+    return [dict(zip(fields, row)) for row in array.tolist()]
+
+def list_model_to_arrays(model, order):
+    """defaultdict(list) model of fixed `order` -> states, offsets, successors"""
+    states = sorted(model)
+    successors = [note for state in states for note in model[state]]
+    offsets = np.cumsum([0] + [len(model[state]) for state in states])
+    return {'states': np.array(states, dtype=np.int16).reshape(len(states), order),
+            'offsets': offsets.astype(np.int64),
+            'successors': np.array(successors, dtype=np.int16)}
+
+def list_model_from_arrays(arrays):
+    from collections import defaultdict
+    model = defaultdict(list)
+    offsets = arrays['offsets'].tolist()
+    successors = arrays['successors'].tolist()
+    for i, state in enumerate(arrays['states'].tolist()):
+        model[tuple(state)] = successors[offsets[i]:offsets[i+1]]
+    return model
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class Profiler:
+    """Opt-in per-stage wall time, CPU time, allocations and item counts
+
+    Code marks its stages with `with stage('name') as record:` and may set
+    record['items'] (or other fields). While disabled a stage costs one
+    attribute check; while enabled each finished stage is written as one
+    JSON line and kept in `records`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.memory = False
+        self.records = []
+        self._memory_stack = []
+
+    @contextmanager
+    def stage(self, name, **fields):
+        record = {'stage': name, **fields}
+        if not self.enabled:
+            yield record
+            return
+        if self.memory:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self._memory_stack.append([current, current])
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 6)
+            record['cpu_s'] = round(time.process_time() - cpu, 6)
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                start, inner_peak = self._memory_stack.pop()
+                peak = max(peak, inner_peak)
+                if self._memory_stack:
+                    # reset_peak() inside this stage hid the peak from the enclosing one
+                    self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+                record['alloc_peak_bytes'] = peak - start
+                record['alloc_net_bytes'] = current - start
+            record['time'] = round(time.time(), 3)
+            self.emit(record)
+
+    def emit(self, record):
+        self.records.append(record)
+        if self.output is not None:
+            self.output.write(json.dumps(record) + '\n')
+            self.output.flush()
+
+profiler = Profiler()
+stage = profiler.stage
+
+@contextmanager
+def profile(output=None, memory=True, cprofile_path=None, tracemalloc_path=None, top=25):
+    """Turn instrumentation on for the block; yields the list of stage records
+
+    `output` is a path or open text file for JSON lines ('-' for stderr).
+    memory=True traces allocations, which slows Python code noticeably.
+    cprofile_path writes a pstats file for the whole block, tracemalloc_path
+    a text report of the `top` allocation sites still live at the end.
+    """
+    close = False
+    if output == '-':
+        output = sys.stderr
+    elif isinstance(output, (str, os.PathLike)):
+        output, close = open(output, 'a'), True
+    memory = memory or tracemalloc_path is not None
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    previous = (profiler.enabled, profiler.output, profiler.memory, profiler.records)
+    profiler.enabled, profiler.output, profiler.memory = True, output, memory
+    profiler.records = records = []
+    cprofiler = None
+    if cprofile_path:
+        import cProfile  # Only --profile_cprofile runs pay for the profiler
+        cprofiler = cProfile.Profile()
+    if cprofiler:
+        cprofiler.enable()
+    try:
+        yield records
+    finally:
+        if cprofiler:
+            cprofiler.disable()
+            cprofiler.dump_stats(cprofile_path)
+        if tracemalloc_path:
+            snapshot = tracemalloc.take_snapshot()
+            with open(tracemalloc_path, 'w') as report:
+                for line in snapshot.statistics('lineno')[:top]:
+                    report.write(f"{line}\n")
+        profiler.enabled, profiler.output, profiler.memory, profiler.records = previous
+        if started_tracing:
+            tracemalloc.stop()
+        if close:
+            output.close()
@@ -0,0 +1,191 @@
+import heapq
+from itertools import count
+import numpy as np
+from synth import AMPLITUDE, SAMPLE_RATE, midi_to_freq
+
+ENVELOPE = (0.005, 0.1, 0.7, 0.2)  # attack, decay, sustain level, release (seconds)
+NOTE_ON, NOTE_OFF = 1, 0  # Sorts note_offs first when two events share a frame
+
+class BlockSynth:
+    """Block-based sine synth for live playback
+
+    Holds a fixed pool of `max_voices` voices and renders `block_size` samples
+    per render() call from a queue of timestamped note events. All per-voice
+    state lives in preallocated arrays and every block is a handful of
+    vectorised operations over the sounding voices, so the cost of a block
+    depends on polyphony, not on how much music is queued. Events take effect
+    at their exact sample: a block is split into segments at event frames.
+    When the pool is full a new note steals the voice furthest into its
+    release, or failing that the oldest voice.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=256, max_voices=64,
+                 envelope=ENVELOPE, amplitude=AMPLITUDE):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.amplitude = amplitude
+        attack, decay, self.sustain, release = envelope
+        self.attack = max(1.0, attack * sample_rate)
+        self.decay = max(1.0, decay * sample_rate)
+        self.release = max(1.0, release * sample_rate)
+        self.frame = 0  # First frame of the next block
+        self.events = []  # heap of (frame, kind, sequence, pitch, velocity)
+        self._sequence = count()
+        self.stolen = 0
+
+        # Voice pool
+        self.active = np.zeros(max_voices, dtype=bool)
+        self.released = np.zeros(max_voices, dtype=bool)
+        self.pitch = np.zeros(max_voices, dtype=np.int64)
+        self.gain = np.zeros(max_voices)
+        self.step = np.zeros(max_voices)  # Phase increment per sample
+        self.phase = np.zeros(max_voices)
+        self.age = np.zeros(max_voices)  # Samples since note_on
+        self.release_age = np.zeros(max_voices)
+        self.release_level = np.zeros(max_voices)
+        self.started = np.zeros(max_voices, dtype=np.int64)  # Event sequence of note_on, for stealing
+
+        # Render buffers
+        self._ramp = np.arange(block_size, dtype=np.float64)
+        self._wave = np.empty((max_voices, block_size))
+        self._envelope = np.empty((max_voices, block_size))
+        self._mix = np.empty(block_size)
+        self._block = np.zeros(block_size, dtype=np.float32)
+
+    # ----- events -----
+
+    def note_on(self, pitch, velocity=100, frame=None):
+        """Queue a note_on at absolute `frame` (default: the start of the next block)"""
+        self._push(frame, NOTE_ON, pitch, velocity)
+
+    def note_off(self, pitch, frame=None):
+        self._push(frame, NOTE_OFF, pitch, 0)
+
+    def _push(self, frame, kind, pitch, velocity):
+        frame = self.frame if frame is None else max(int(frame), self.frame)
+        heapq.heappush(self.events, (frame, kind, next(self._sequence), int(pitch), velocity))
+
+    def schedule_notes(self, starts, durations, pitches, velocities=None, delay=0.0):
+        """Queue whole notes (times in seconds) starting `delay` seconds from now,
+        e.g. a continuation from synth.table_note_events"""
+        base = self.frame + delay * self.sample_rate
+        first = (base + np.asarray(starts, dtype=np.float64) * self.sample_rate).astype(np.int64)
+        last = (base + (np.asarray(starts, dtype=np.float64) + np.asarray(durations))
+                * self.sample_rate).astype(np.int64)
+        velocities = np.full(len(first), 100) if velocities is None else velocities
+        for on, off, pitch, velocity in zip(first.tolist(), last.tolist(),
+                                            np.asarray(pitches).tolist(),
+                                            np.asarray(velocities).tolist()):
+            if off > on:
+                self._push(on, NOTE_ON, pitch, velocity)
+                self._push(off, NOTE_OFF, pitch, 0)
+
+    def _start(self, sequence, pitch, velocity):
+        free = np.flatnonzero(~self.active)
+        if len(free):
+            voice = free[0]
+        else:
+            self.stolen += 1
+            releasing = np.flatnonzero(self.released)
+            if len(releasing):
+                voice = releasing[np.argmax(self.age[releasing] - self.release_age[releasing])]
+            else:
+                voice = int(np.argmin(self.started))
+        self.active[voice] = True
+        self.released[voice] = False
+        self.pitch[voice] = pitch
+        self.gain[voice] = self.amplitude * velocity / 127
+        self.step[voice] = 2 * np.pi * midi_to_freq(pitch) / self.sample_rate
+        self.phase[voice] = 0.0
+        self.age[voice] = 0.0
+        self.started[voice] = sequence
+
+    def _stop(self, pitch):
+        # The oldest held voice of this pitch, as note pairing does elsewhere
+        held = np.flatnonzero(self.active & ~self.released & (self.pitch == pitch))
+        if len(held):
+            voice = held[np.argmin(self.started[held])]
+            self.release_level[voice] = self._held_level(self.age[voice])
+            self.release_age[voice] = self.age[voice]
+            self.released[voice] = True
+
+    # ----- rendering -----
+
+    def _held_level(self, age):
+        """Envelope level `age` samples after note_on, before any release"""
+        if age < self.attack:
+            return age / self.attack
+        return max(1 - (1 - self.sustain) * (age - self.attack) / self.decay, self.sustain)
+
+    def _render_segment(self, out, length):
+        voices = np.flatnonzero(self.active)
+        if not len(voices):
+            return
+        wave = self._wave[:len(voices), :length]
+        envelope = self._envelope[:len(voices), :length]
+        ramp = self._ramp[:length]
+        age = self.age[voices]
+
+        # Per-sample envelope, in place: min(attack ramp, max(decay ramp, sustain))
+        np.add(age[:, None], ramp, out=envelope)
+        slope = (1 - self.sustain) / self.decay
+        np.multiply(envelope, -slope, out=wave)
+        wave += 1 + slope * self.attack
+        np.maximum(wave, self.sustain, out=wave)
+        released = np.flatnonzero(self.released[voices])
+        if len(released):
+            rows = voices[released]
+            fade = 1 - (envelope[released] - self.release_age[rows][:, None]) / self.release
+            fade = self.release_level[rows][:, None] * np.maximum(fade, 0)
+        envelope /= self.attack
+        np.minimum(envelope, wave, out=envelope)
+        if len(released):
+            envelope[released] = fade
+        envelope *= self.gain[voices][:, None]
+
+        np.multiply(self.step[voices][:, None], ramp, out=wave)
+        wave += self.phase[voices][:, None]
+        np.sin(wave, out=wave)
+        wave *= envelope
+        out += np.sum(wave, axis=0, out=self._mix[:length])
+
+        self.phase[voices] = (self.phase[voices] + self.step[voices] * length) % (2 * np.pi)
+        self.age[voices] = age + length
+        finished = voices[self.released[voices]
+                          & (self.age[voices] - self.release_age[voices] >= self.release)]
+        self.active[finished] = False
+
+    def render(self):
+        """The next block as float32; the array is reused by the following call"""
+        block = self._block
+        block[:] = 0
+        position, end = 0, self.frame + self.block_size
+        while True:
+            boundary = self.events[0][0] if self.events and self.events[0][0] < end else end
+            if boundary > self.frame + position:
+                length = boundary - self.frame - position
+                self._render_segment(block[position:position + length], length)
+                position += length
+            if boundary == end:
+                break
+            _, kind, sequence, pitch, velocity = heapq.heappop(self.events)
+            if kind == NOTE_ON:
+                self._start(sequence, pitch, velocity)
+            else:
+                self._stop(pitch)
+        np.clip(block, -1, 1, out=block)
+        self.frame = end
+        return block
+
+    @property
+    def voices_sounding(self):
+        return int(self.active.sum())
+
+    def idle(self):
+        return not self.events and not self.active.any()
+
+    def blocks(self):
+        """Render until every queued note has finished its release"""
+        while not self.idle():
+            yield self.render()
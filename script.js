@@ -79,6 +79,7 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     recordButton.addEventListener("click", () => {
+        cancelGeneration();
         recordedNotes = [];
         recording = true;
         startTime = Tone.now();
@@ -106,6 +107,7 @@ document.addEventListener("DOMContentLoaded", () => {
     playbackButton.addEventListener("click", () => {
         generateButton.disabled = true;
         downloadButton.disabled = true;
+        cancelGeneration();
         console.log("Playing back recorded notes...");
         console.log(recordedNotes);
         Tone.Transport.stop();
@@ -120,6 +122,51 @@ document.addEventListener("DOMContentLoaded", () => {
         downloadButton.disabled = false;
     });
 
+    let generatedNotes = [];
+    let generation = null;  // AbortController for the continuation being streamed
+
+    function cancelGeneration() {
+        // Closing the stream also stops the server drawing notes for it
+        if (generation) {
+            generation.abort();
+            generation = null;
+        }
+    }
+
+    async function streamContinuation(notes, onNote, signal) {
+        // Server-sent events from /generate/stream, handled as they arrive
+        const response = await fetch('http://localhost:5500/generate/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ notes }),
+            signal
+        });
+        if (!response.ok) {
+            throw new Error((await response.json()).error.message);
+        }
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) return;
+            buffer += value;
+            const events = buffer.split("\n\n");
+            buffer = events.pop();
+            for (const block of events) {
+                const [eventLine, dataLine] = block.split("\n");
+                const event = eventLine.slice("event: ".length);
+                const data = JSON.parse(dataLine.slice("data: ".length));
+                if (event === "note") {
+                    onNote(data.note, data.index);
+                } else if (event === "error") {
+                    throw new Error(data.message);
+                }
+            }
+        }
+    }
+
     generateButton.addEventListener("click", async () => {
         recordButton.disabled = true;
         stopButton.disabled = true;
@@ -130,32 +177,33 @@ document.addEventListener("DOMContentLoaded", () => {
         console.log("Generate");
 
         console.log("Generating new melody...");
-        const response = await fetch('http://localhost:5500/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ notes: recordedNotes.map(note => note.note) })
-        });
-        const data = await response.json();
-        const generatedNotes = data.generated_notes;
-        console.log("Generated notes:", generatedNotes);
-    
-        // Concatenate the original recorded notes with the generated notes
-        const combinedNotes = recordedNotes.concat(generatedNotes.map((note, index) => ({
-            note,
-            time: recordedNotes.length > 0 ? recordedNotes[recordedNotes.length - 1].time + (index + 1) * 0.5 : (index + 1) * 0.5
-        })));
-    
-        // Play the combined notes
+        cancelGeneration();
+        generation = new AbortController();
+        generatedNotes = [];
+        const lastTime = recordedNotes.length > 0 ? recordedNotes[recordedNotes.length - 1].time : 0;
+
+        // Play the recorded notes now and each generated note as soon as it arrives
         Tone.Transport.stop();
         Tone.Transport.cancel();
-        combinedNotes.forEach(({ note, time }) => {
+        recordedNotes.forEach(({ note, time }) => {
             Tone.Transport.schedule((playTime) => {
                 synth.triggerAttackRelease(note, "8n", playTime);
             }, time);
         });
         Tone.Transport.start();
+        try {
+            await streamContinuation(recordedNotes.map(note => note.note), (note, index) => {
+                generatedNotes.push(note);
+                Tone.Transport.schedule((playTime) => {
+                    synth.triggerAttackRelease(note, "8n", playTime);
+                }, lastTime + (index + 1) * 0.5);
+            }, generation.signal);
+            console.log("Generated notes:", generatedNotes);
+        } catch (error) {
+            if (error.name !== "AbortError") {
+                console.error("Error generating melody:", error);
+            }
+        }
 
         // if (combinedNotes.length > 0) {
         //     downloadButton.disabled = false;
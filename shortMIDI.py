@@ -1,153 +1,1072 @@
 import argparse
+import os
+import sys
+from array import array
+from contextlib import nullcontext
+from bisect import bisect_left, bisect_right
+from itertools import islice
+import fastmidi
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description='MIDI Continuation for Small Files')
+    parser.add_argument('input', nargs='?', help='Input MIDI file')
+    parser.add_argument('output', nargs='?', help='Output MIDI file')
+    parser.add_argument('--length', type=int, default=50, 
+                       help='Notes to generate (default: 50)')
+    parser.add_argument('--max_order', type=int, default=3,
+                       help='Maximum Markov order (default: 3, 0 for unbounded)')
+    parser.add_argument('--index', choices=['auto', 'table', 'suffix'], default='auto',
+                       help='Model layout: count tables, or a suffix-array context index '
+                            'whose size does not grow with the order (default: auto)')
+    parser.add_argument('--num_samples', '--num-samples', type=int, default=1,
+                       help='Continuations to generate from one model (default: 1)')
+    parser.add_argument('--seed', type=int, default=None,
+                       help='Random seed; sample i is reproducible from (seed, i)')
+    parser.add_argument('--multitrack', action='store_true',
+                       help='Write all samples as tracks of one file instead of one file each')
+    parser.add_argument('--rhythm', action='store_true',
+                       help='Model whole chords with their timing, duration and velocity '
+                            'instead of single pitches one beat apart (--length counts chords)')
+    parser.add_argument('--audio', default=None, metavar='PATH',
+                       help='Also render the (first) continuation to PATH, a .wav or .flac file')
+    parser.add_argument('--bits', type=int, choices=[8, 16], default=16,
+                       help='Audio bits per sample (default: 16)')
+    parser.add_argument('--sample_rate', type=int, default=44100,
+                       help='Audio sample rate (default: 44100)')
+    parser.add_argument('--model', default=None,
+                       help='Generate from a saved model (e.g. from corpus_train.py) '
+                            'instead of one built from the input')
+    parser.add_argument('--cache_dir', default=None,
+                       help='Model cache directory (default: $TUNETUAH_CACHE_DIR or ~/.cache/tunetuahnote)')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Always re-parse and rebuild the model')
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='PATH',
+                       help='Write per-stage timings as JSON lines to PATH (default: stderr)')
+    parser.add_argument('--profile_no_memory', action='store_true',
+                       help='Skip allocation tracing, which slows the run down')
+    parser.add_argument('--profile_cprofile', default=None, metavar='PATH',
+                       help='Also dump cProfile stats for the whole run to PATH')
+    parser.add_argument('--profile_tracemalloc', default=None, metavar='PATH',
+                       help='Also write the top live allocation sites to PATH')
+    parser.add_argument('--no_fast_path', action='store_true',
+                       help='Always use the numpy path, even for small jobs the '
+                            'standard-library fast path covers')
+    parser.add_argument('--serve', default=None, metavar='SOCKET',
+                       help='Run as a worker: load everything once, then run jobs sent '
+                            'with --connect over the Unix socket SOCKET')
+    parser.add_argument('--connect', default=None, metavar='SOCKET',
+                       help='Run this job in the worker listening on SOCKET (runs it '
+                            'here if none answers)')
+    return parser
+
+if __name__ == "__main__":
+    # Jobs for a running worker and small jobs the stdlib fast path covers
+    # never need numpy or mido, so they are handled before importing either
+    args = cli_parser().parse_args()
+    if args.connect:
+        import job_daemon
+        status = job_daemon.submit(args.connect, sys.argv[1:])
+        if status is not None:
+            exit(status)
+    if args.serve is None and args.input and args.output and fastmidi.eligible(args):
+        if fastmidi.run(args):
+            exit(0)
+
 import numpy as np
-import mido
-from mido import MidiFile, MidiTrack, Message
-from collections import defaultdict
+from model_cache import ModelCache, cache_key, read_arrays, write_arrays
+from profiling import profile, stage
+import audio_codec
+from tempo_map import TempoMap
+
+# One row per note. Columns are fixed-width so a whole file's notes live in a
+# single contiguous buffer instead of one dict per note.
+NOTE_DTYPE = np.dtype([
+    ('onset', np.int64),     # absolute tick of the note_on
+    ('offset', np.int64),    # absolute tick of the matching note_off
+    ('track', np.uint16),
+    ('pitch', np.uint8),
+    ('velocity', np.uint8),
+    ('channel', np.uint8),
+])
+
+def empty_note_table(size=0):
+    """Return a zeroed note table with room for `size` notes"""
+    return np.zeros(size, dtype=NOTE_DTYPE)
+
+def as_note_table(notes):
+    """Accept a note table or a legacy list of {'note','time','velocity'} dicts"""
+    if isinstance(notes, np.ndarray) and notes.dtype == NOTE_DTYPE:
+        return notes
+    table = empty_note_table(len(notes))
+    if len(table):
+        table['pitch'] = [n['note'] for n in notes]
+        table['onset'] = [n['time'] for n in notes]
+        table['offset'] = table['onset']
+        table['velocity'] = [n.get('velocity', 64) for n in notes]
+    return table
+
+def read_notes(midi_path):
+    """Extract notes and timing from a MIDI file; raises on unreadable input
+
+    `midi_path` may also be an open binary file. Returns (notes,
+    ticks_per_beat, tempo_map); notes are ordered by onset across all tracks.
+    """
+    from mido import MidiFile  # Imported here: mido costs ~50 ms that fast paths skip
+    mid = MidiFile(file=midi_path) if hasattr(midi_path, 'read') else MidiFile(midi_path)
+    # Parallel typed columns, filled in one pass and packed at the end
+    pitch, velocity, channel = array('B'), array('B'), array('B')
+    track_no, onset, offset = array('H'), array('q'), array('q')
+    ticks_per_beat = mid.ticks_per_beat
+    
+    for index, track in enumerate(mid.tracks):
+        current_time = 0  # Every track's deltas start from the top of the file
+        open_notes = {}  # (channel, pitch) -> row indices still sounding
+        for msg in track:
+            current_time += msg.time
+            kind = msg.type
+            if kind == 'note_on' and msg.velocity > 0:
+                open_notes.setdefault((msg.channel, msg.note), []).append(len(pitch))
+                pitch.append(msg.note)
+                velocity.append(msg.velocity)
+                channel.append(msg.channel)
+                track_no.append(index)
+                onset.append(current_time)
+                offset.append(current_time)
+            elif kind == 'note_off' or kind == 'note_on':
+                rows = open_notes.get((msg.channel, msg.note))
+                if rows:
+                    offset[rows.pop(0)] = current_time
+        # Notes left hanging at the end of a track end with the track
+        for rows in open_notes.values():
+            for row in rows:
+                offset[row] = current_time
+    
+    notes = empty_note_table(len(pitch))
+    if len(notes):
+        notes['pitch'] = np.frombuffer(pitch, dtype=np.uint8)
+        notes['velocity'] = np.frombuffer(velocity, dtype=np.uint8)
+        notes['channel'] = np.frombuffer(channel, dtype=np.uint8)
+        notes['track'] = np.frombuffer(track_no, dtype=np.uint16)
+        notes['onset'] = np.frombuffer(onset, dtype=np.int64)
+        notes['offset'] = np.frombuffer(offset, dtype=np.int64)
+        # Merge the tracks into one time-ordered stream
+        notes = notes[np.argsort(notes['onset'], kind='stable')]
+    return notes, ticks_per_beat, TempoMap.from_midi(mid)
 
 def parse_midi(midi_path):
     """Extract notes and timing from MIDI file with validation"""
     try:
-        mid = MidiFile(midi_path)
-        notes = []
-        tempos = []
-        ticks_per_beat = mid.ticks_per_beat
-        current_time = 0
-        
-        for track in mid.tracks:
-            for msg in track:
-                current_time += msg.time
-                if msg.type == 'set_tempo':
-                    tempos.append(msg)
-                if msg.type == 'note_on' and msg.velocity > 0:
-                    notes.append({
-                        'note': msg.note,
-                        'time': current_time,
-                        'velocity': msg.velocity
-                    })
-        
+        with stage('parse_midi') as record:
+            notes, ticks_per_beat, tempos = read_notes(midi_path)
+            record['items'] = len(notes)
         print(f"Parsed {len(notes)} notes from MIDI file")
         return notes, ticks_per_beat, tempos
     except Exception as e:
         print(f"Error parsing MIDI: {str(e)}")
         exit(1)
 
-def build_adaptive_model(notes, max_order=3):
-    """Build variable-order Markov model"""
-    model = defaultdict(lambda: defaultdict(int))
-    note_sequence = [n['note'] for n in notes]
+# Pitches are 7-bit, so up to 9 of them pack into one int64 sort key
+PACKED_ORDER_LIMIT = 9
+
+# Table models store every context of every order; past this order the
+# suffix-array ContextIndex is smaller (see benchmarks/bench_context_index.py)
+TABLE_ORDER_LIMIT = 4
+
+def _pack_keys(columns):
+    """Pack each row of a 2-D pitch array into a single int64"""
+    packed = np.zeros(len(columns), dtype=np.int64)
+    for column in range(columns.shape[1]):
+        packed = (packed << 7) | columns[:, column]
+    return packed
+
+class FrozenMarkovModel:
+    """Read-only variable-order Markov model stored as flat count arrays.
+
+    Row 0 is the empty context (overall note frequencies), used when no
+    longer context matches. Every other row is one observed context of
+    1..order notes. The edges of row r live in [row_start[r], row_start[r+1])
+    and `next_row` holds, for every edge, the row of the longest context that
+    is still in the model after emitting that edge's note. Sampling a note is
+    therefore one uniform draw, a bisect inside one row and a table lookup.
+    """
+
+    def __init__(self, order, state_keys, state_lengths, row_start, next_note, counts,
+                 next_row=None):
+        self.order = order
+        self.state_keys = state_keys          # (rows, order) int16, left-padded with -1
+        self.state_lengths = state_lengths    # context length per row, 0 for the root
+        self.row_start = row_start            # (rows + 1,) edge offsets
+        self.next_note = next_note            # (edges,) pitch per edge
+        self.counts = counts                  # (edges,) transition counts
+        self._index = None
+        
+        # Per-row running totals: bisecting a uniform in [0, total) picks an edge
+        running = np.concatenate([[0], np.cumsum(counts)])
+        edge_rows = np.repeat(np.arange(len(state_lengths)), np.diff(row_start))
+        self.cumulative = running[1:] - running[row_start[:-1]][edge_rows]
+        self.totals = running[row_start[1:]] - running[row_start[:-1]]
+        self._running = running
+        
+        if next_row is None:
+            # Context after each edge: the edge's state plus its note, last `order` notes
+            after = np.concatenate([state_keys[edge_rows], next_note[:, None].astype(np.int16)],
+                                   axis=1)[:, 1:]
+            next_row = self.resolve(after, np.minimum(state_lengths[edge_rows] + 1, order))
+        self.next_row = next_row
+        self._lists = None
+
+    def arrays(self):
+        """The arrays needed to rebuild this model without re-resolving backoff"""
+        return {'state_keys': self.state_keys, 'state_lengths': self.state_lengths,
+                'row_start': self.row_start, 'next_note': self.next_note,
+                'counts': self.counts, 'next_row': self.next_row}
+
+    def _sampling_lists(self):
+        """Plain lists for the sampling loop; numpy scalar indexing is slower"""
+        if self._lists is None:
+            self._lists = (self.row_start.tolist(), self.cumulative.tolist(),
+                           self.totals.tolist(), self.next_note.tolist(),
+                           self.next_row.tolist())
+        return self._lists
+
+    @property
+    def index(self):
+        """{state tuple: row}, built on first use"""
+        if self._index is None:
+            order = self.order
+            self._index = {
+                tuple(key[order-size:]): row
+                for row, (key, size) in enumerate(zip(self.state_keys.tolist(),
+                                                      self.state_lengths.tolist()))
+            }
+        return self._index
+
+    def resolve(self, contexts, sizes):
+        """Row of the longest stored suffix for each left-padded context row"""
+        order = self.order
+        rows = np.zeros(len(contexts), dtype=np.int32)
+        if order > PACKED_ORDER_LIMIT:
+            for i, (key, size) in enumerate(zip(contexts.tolist(), sizes.tolist())):
+                rows[i] = self.lookup(key[order-size:])
+            return rows
+        pending = np.ones(len(contexts), dtype=bool)
+        for size in range(order, 0, -1):
+            # Rows of one context length are contiguous and sorted, so their
+            # packed keys can be binary searched
+            lo = np.searchsorted(self.state_lengths, size, side='left')
+            hi = np.searchsorted(self.state_lengths, size, side='right')
+            candidates = np.flatnonzero(pending & (sizes >= size))
+            if lo == hi or not len(candidates):
+                continue
+            stored = _pack_keys(self.state_keys[lo:hi, order-size:])
+            wanted = _pack_keys(contexts[candidates, order-size:])
+            at = np.minimum(np.searchsorted(stored, wanted), hi - lo - 1)
+            found = stored[at] == wanted
+            rows[candidates[found]] = lo + at[found]
+            pending[candidates[found]] = False
+        return rows
+
+    def lookup(self, context):
+        """Row of the longest suffix of `context` present in the model"""
+        context = tuple(context)[-self.order:]
+        if self.order <= PACKED_ORDER_LIMIT:
+            padded = np.full((1, self.order), -1, dtype=np.int16)
+            if context:
+                padded[0, self.order-len(context):] = context
+            return int(self.resolve(padded, np.array([len(context)]))[0])
+        for size in range(len(context), 0, -1):
+            row = self.index.get(context[-size:])
+            if row is not None:
+                return row
+        return 0
+
+    def __len__(self):
+        return len(self.state_lengths) - 1
+
+    def __contains__(self, state):
+        return len(state) > 0 and tuple(state) in self.index
+
+    def __getitem__(self, state):
+        row = self.index[tuple(state)]
+        lo, hi = self.row_start[row], self.row_start[row+1]
+        return dict(zip(self.next_note[lo:hi].tolist(), self.counts[lo:hi].tolist()))
+
+    def sample(self, row, uniforms):
+        """Walk the model from `row`, consuming one uniform in [0, 1) per note"""
+        row_start, cumulative, totals, next_note, next_row = self._sampling_lists()
+        continuation = []
+        for u in uniforms:
+            lo, hi = row_start[row], row_start[row+1]
+            if lo == hi:  # Empty model
+                continuation.append(60)  # Middle C
+                continue
+            edge = bisect_right(cumulative, u * totals[row], lo, hi)
+            continuation.append(next_note[edge])
+            row = next_row[edge]
+        return continuation
+
+    def iter_sample(self, row, uniforms):
+        """Generator form of sample(): yields each note as soon as it is drawn"""
+        row_start, cumulative, totals, next_note, next_row = self._sampling_lists()
+        for u in uniforms:
+            lo, hi = row_start[row], row_start[row+1]
+            if lo == hi:  # Empty model
+                yield 60  # Middle C
+                continue
+            edge = bisect_right(cumulative, u * totals[row], lo, hi)
+            yield next_note[edge]
+            row = next_row[edge]
+
+    def sample_batch(self, rows, uniforms):
+        """Walk one chain per row of `uniforms` in lockstep, one column per step"""
+        rows = np.asarray(rows, dtype=np.int64)
+        batch = np.full(uniforms.shape, 60, dtype=np.int16)  # Middle C if the model is empty
+        if not len(self.counts):
+            return batch
+        edge_end = self._running[1:]
+        for step in range(uniforms.shape[1]):
+            lo, hi = self.row_start[rows], self.row_start[rows+1]
+            target = self._running[lo] + uniforms[:, step] * self.totals[rows]
+            edges = np.minimum(np.searchsorted(edge_end, target, side='right'), hi - 1)
+            batch[:, step] = self.next_note[edges]
+            rows = self.next_row[edges]
+        return batch
+
+def context_suffix_array(sequence, order=None):
+    """Sort note positions by the notes before them, read backwards
+
+    Returns (suffixes, lcp): positions ordered by their left context (most
+    recent note first, truncated to `order` notes, shorter contexts first),
+    and for each entry the context length it shares with the one before it.
+    Every context of every length is then one contiguous run of `suffixes`.
+    Built by prefix doubling, so order=None costs O(n log^2 n), not O(n^2).
+    """
+    n = len(sequence)
+    if not n:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    sequence = np.asarray(sequence, dtype=np.int64)
+    # Level h ranks each position by its first 2**h context notes
+    first = np.concatenate([[-1], sequence[:-1]])  # Position 0 has an empty context
+    levels = [np.unique(first, return_inverse=True)[1].astype(np.int64)]
+    span = 1
+    while (order is None or span < order) and levels[-1].max() < n - 1:
+        rank = levels[-1]
+        further = np.full(n, -1, dtype=np.int64)
+        further[span:] = rank[:-span]
+        levels.append(np.unique(rank * (n + 1) + further + 1, return_inverse=True)[1])
+        span *= 2
+    suffixes = np.argsort(levels[-1], kind='stable')
+
+    # Shared context of neighbours by binary lifting over the levels
+    a, b = suffixes[:-1], suffixes[1:]
+    lcp = np.zeros(n - 1, dtype=np.int64)
+    for level in range(len(levels) - 1, -1, -1):
+        span = 1 << level
+        room = np.minimum(a, b) - lcp >= span
+        rank = levels[level]
+        same = room & (rank[np.where(room, a - lcp, 0)] == rank[np.where(room, b - lcp, 0)])
+        lcp += same * span
+    if order is not None:
+        np.minimum(lcp, order, out=lcp)
+    return suffixes.astype(np.int32), np.concatenate([[0], lcp]).astype(np.int32)
+
+class ContextIndex:
+    """Variable-order Markov model answered straight from a suffix array.
+
+    Instead of one table row per (order, context), every position of the
+    training sequence is sorted by the notes before it. All positions
+    sharing a context then sit in one run [lo, hi) of `suffixes`, for every
+    context length at once, and the note after a uniformly chosen position
+    is distributed exactly like the counts a table model would store. The
+    index is three flat arrays whatever the order, and order=None is
+    unbounded. A state is (lo, hi, depth): the run of the longest suffix of
+    the history seen in training, and its length.
+    """
+
+    def __init__(self, order, sequence, suffixes=None, lcp=None):
+        self.order = order
+        sequence = np.asarray(sequence)
+        # Pitches fit in a byte; rhythm tokens (see tokenize_notes) may not
+        wide = len(sequence) and sequence.max() > 255
+        self.sequence = np.ascontiguousarray(sequence, dtype=np.int32 if wide else np.uint8)
+        if suffixes is None:
+            suffixes, lcp = context_suffix_array(self.sequence, order)
+        self.suffixes = suffixes    # positions sorted by reversed left context
+        self.lcp = lcp              # context shared with the previous entry
+        self.rank = np.empty(len(suffixes), dtype=np.int32)
+        self.rank[suffixes] = np.arange(len(suffixes), dtype=np.int32)
+        # memoryviews index as plain ints without copying the arrays into lists
+        self._notes, self._suffixes = self.sequence.data, suffixes.data
+        self._lcp, self._rank = lcp.data, self.rank.data
+
+    def arrays(self):
+        """The arrays needed to rebuild this index without re-sorting"""
+        return {'sequence': self.sequence, 'suffixes': self.suffixes, 'lcp': self.lcp}
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (*self.arrays().values(), self.rank))
+
+    def __len__(self):
+        """Distinct non-empty contexts, i.e. the states a table model would store"""
+        lengths = self.suffixes.astype(np.int64)
+        if self.order is not None:
+            np.minimum(lengths, self.order, out=lengths)
+        return int(np.maximum(lengths - self.lcp, 0).sum())
+
+    def _note_before(self, depth):
+        notes = self._notes
+        return lambda position: notes[position - 1 - depth] if position > depth else -1
+
+    def lookup(self, context):
+        """State of the longest suffix of `context` seen in training, in one pass"""
+        context = list(context)
+        if self.order is not None:
+            context = context[len(context) - self.order:] if len(context) > self.order else context
+        lo, hi, depth = 0, len(self.suffixes), 0
+        for note in reversed(context):
+            key = self._note_before(depth)
+            start = bisect_left(self._suffixes, note, lo, hi, key=key)
+            end = bisect_right(self._suffixes, note, start, hi, key=key)
+            if start == end:
+                break
+            lo, hi, depth = start, end, depth + 1
+        return lo, hi, depth
+
+    def _around(self, row, depth, scan=8):
+        """Run of entries sharing the first `depth` context notes with entry `row`"""
+        lcp, n = self._lcp, len(self.suffixes)
+        lo, hi = row, row + 1
+        # Deep contexts are rare, so their runs are short: walk the lcp array
+        while lo > 0 and lcp[lo] >= depth and row - lo < scan:
+            lo -= 1
+        while hi < n and lcp[hi] >= depth and hi - row < scan:
+            hi += 1
+        if (lo > 0 and lcp[lo] >= depth) or (hi < n and lcp[hi] >= depth):
+            # A long run: binary search on the context itself
+            notes = self._notes
+            key = lambda position: notes[max(position - depth, 0):position].tolist()[::-1]
+            target = key(self._suffixes[row])
+            lo = bisect_left(self._suffixes, target, 0, row, key=key)
+            hi = bisect_right(self._suffixes, target, row + 1, n, key=key)
+        return lo, hi, depth
+
+    def iter_sample(self, state, uniforms):
+        """Walk the model from `state`, consuming one uniform in [0, 1) per note"""
+        notes, suffixes, rank = self._notes, self._suffixes, self._rank
+        n, order = len(suffixes), self.order
+        lo, hi, depth = state
+        for u in uniforms:
+            if lo == hi:  # Empty model
+                yield 60  # Middle C
+                continue
+            position = suffixes[lo + int(u * (hi - lo))]
+            note = notes[position]
+            yield note
+            # The history now ends like the training data just after `position`,
+            # and no longer match can exist or the previous one would have been longer
+            depth = depth + 1 if order is None or depth < order else order
+            if position + 1 < n:
+                lo, hi, depth = self._around(rank[position + 1], depth)
+            else:  # The end of the piece predicts nothing; back off
+                lo, hi, depth = self.lookup(notes[position + 1 - depth:position + 1])
+
+    def sample(self, state, uniforms):
+        return list(self.iter_sample(state, uniforms))
+
+    def sample_batch(self, states, uniforms):
+        return np.array([self.sample(state, row.tolist()) for state, row in zip(states, uniforms)],
+                        dtype=np.int16 if self.sequence.dtype == np.uint8 else np.int32
+                        ).reshape(uniforms.shape)
+
+    def counts(self, context):
+        """{next note: count} for the longest stored suffix of `context`"""
+        lo, hi, _ = self.lookup(context)
+        found = np.bincount(self.sequence[self.suffixes[lo:hi]], minlength=128)
+        return {int(note): int(found[note]) for note in np.flatnonzero(found)}
+
+def pack_model(order, blocks):
+    """Assemble (states, edge notes, edge counts) blocks into a frozen model"""
+    keys, lengths, starts, notes, counts = [], [], [], [], []
+    edges = 0
+    for states, edge_state, edge_note, edge_count in blocks:
+        size = states.shape[1]
+        padded = np.full((len(states), order), -1, dtype=np.int16)
+        if size:
+            padded[:, order-size:] = states
+        keys.append(padded)
+        lengths.append(np.full(len(states), size, dtype=np.int16))
+        starts.append(edges + np.searchsorted(edge_state, np.arange(len(states))))
+        notes.append(edge_note.astype(np.uint8))
+        counts.append(edge_count.astype(np.int64))
+        edges += len(edge_note)
+    starts.append([edges])
+    return FrozenMarkovModel(order, np.concatenate(keys), np.concatenate(lengths),
+                             np.concatenate(starts).astype(np.int64),
+                             np.concatenate(notes), np.concatenate(counts))
+
+def count_packed(sequence, order):
+    """Packed (context, next note) keys of one order and how often each occurs"""
+    windows = np.lib.stride_tricks.sliding_window_view(sequence, order+1)
+    return np.unique(_pack_keys(windows), return_counts=True)
+
+def unpack_counts(keys, pair_counts, order):
+    """Turn sorted packed keys of one order back into a model block"""
+    pairs = np.empty((len(keys), order+1), dtype=np.int16)
+    for column in range(order, -1, -1):
+        pairs[:, column] = keys & 127
+        keys = keys >> 7
+    return _group_pairs(pairs, pair_counts)
+
+def root_block(note_counts):
+    """Model block for the empty context from per-pitch counts"""
+    root_notes = np.flatnonzero(note_counts)
+    return (np.empty((1, 0), dtype=np.int16), np.zeros(len(root_notes), dtype=np.int64),
+            root_notes, note_counts[root_notes])
+
+def _group_pairs(pairs, pair_counts):
+    contexts = pairs[:, :-1]
+    first = np.ones(len(pairs), dtype=bool)
+    first[1:] = np.any(contexts[1:] != contexts[:-1], axis=1)
+    edge_state = np.cumsum(first) - 1
+    return contexts[first], edge_state, pairs[:, -1], pair_counts
+
+def _count_order(sequence, order):
+    """Count every (context of `order` notes, next note) pair in one pass"""
+    if order < PACKED_ORDER_LIMIT:
+        return unpack_counts(*count_packed(sequence, order), order)
+    windows = np.lib.stride_tricks.sliding_window_view(sequence, order+1)
+    return _group_pairs(*np.unique(windows, axis=0, return_counts=True))
+
+def build_adaptive_model(notes, max_order=3, index='auto'):
+    """Build variable-order Markov model
+
+    index='table' builds a FrozenMarkovModel, 'suffix' a ContextIndex, whose
+    size does not grow with the order; 'auto' takes the suffix index above
+    TABLE_ORDER_LIMIT. max_order=None (suffix index only) is unbounded.
+    """
+    with stage('build_adaptive_model', max_order=max_order) as record:
+        note_sequence = np.ascontiguousarray(as_note_table(notes)['pitch'], dtype=np.int16)
+    
+        # Determine safe maximum order based on input length
+        safe_max_order = None if max_order is None else min(max_order, len(note_sequence)-1)
+        if safe_max_order is not None and safe_max_order < 1:
+            safe_max_order = 1
+        if index == 'auto':
+            index = ('suffix' if max_order is None or max_order > TABLE_ORDER_LIMIT
+                     else 'table')
     
-    # Determine safe maximum order based on input length
-    safe_max_order = min(max_order, len(note_sequence)-1)
-    if safe_max_order < 1:
-        safe_max_order = 1
+        if index == 'suffix':
+            print(f"Using suffix context index up to order {safe_max_order}" if safe_max_order
+                  else "Using suffix context index with unbounded order")
+            model = ContextIndex(safe_max_order, note_sequence)
+        else:
+            print(f"Using adaptive Markov order up to {safe_max_order}")
     
-    print(f"Using adaptive Markov order up to {safe_max_order}")
+            # Root row: plain note frequencies, the last-resort fallback
+            blocks = [root_block(np.bincount(note_sequence, minlength=128))]
     
-    # Build multi-order model
-    for order in range(1, safe_max_order+1):
-        for i in range(len(note_sequence)-order):
-            state = tuple(note_sequence[i:i+order])
-            next_note = note_sequence[i+order]
-            model[state][next_note] += 1
+            # Build multi-order model
+            for order in range(1, safe_max_order+1):
+                if len(note_sequence) > order:
+                    blocks.append(_count_order(note_sequence, order))
     
+            model = pack_model(safe_max_order, blocks)
+        record['items'] = len(note_sequence)
+        record['states'] = len(model)
+        record['index'] = index
     return model, safe_max_order
 
+def freeze_model(model, max_order, all_notes=()):
+    """Convert a {state: {note: count}} mapping into a FrozenMarkovModel"""
+    if isinstance(model, (FrozenMarkovModel, ContextIndex)):
+        return model
+    blocks = [root_block(np.bincount(np.asarray(all_notes, dtype=np.int64), minlength=128))]
+    for order in range(1, max_order+1):
+        states = sorted(s for s in model if len(s) == order and sum(model[s].values()) > 0)
+        edge_state, edge_note, edge_count = [], [], []
+        for i, state in enumerate(states):
+            for note, count in sorted(model[state].items()):
+                if count > 0:
+                    edge_state.append(i)
+                    edge_note.append(note)
+                    edge_count.append(count)
+        blocks.append((np.array(states, dtype=np.int16).reshape(len(states), order),
+                       np.array(edge_state, dtype=np.int64),
+                       np.array(edge_note, dtype=np.int16),
+                       np.array(edge_count, dtype=np.int64)))
+    return pack_model(max_order, blocks)
+
 def generate_safe_continuation(model, last_notes, length=50, max_order=3, all_notes=[]):
     """Generate continuation with fallback strategies"""
-    continuation = []
-    current_state = tuple(last_notes[-max_order:])  # Start with max order
-    
-    for _ in range(length):
-        # Try progressively smaller orders
-        for order in range(len(current_state), 0, -1):
-            state = current_state[-order:] if order > 0 else tuple()
-            if state in model:
-                probabilities = list(model[state].values())
-                total = sum(probabilities)
-                if total > 0:
-                    notes = list(model[state].keys())
-                    probs = [p/total for p in probabilities]
-                    next_note = np.random.choice(notes, p=probs)
-                    continuation.append(next_note)
-                    current_state = (*current_state, next_note)[-max_order:]
-                    break
-        else:  # Fallback if no states found
-            next_note = np.random.choice(all_notes) if all_notes else 60  # Middle C
-            continuation.append(next_note)
-            current_state = (*current_state, next_note)[-max_order:]
-    
-    return continuation
-
-def save_midi(original_notes, new_notes, ticks_per_beat, tempos, output_path):
-    """Save MIDI file with error handling"""
+    # all_notes only matters for plain dict models; a frozen model already
+    # carries the note frequencies of its training data in the root row
+    with stage('generate_safe_continuation', items=length):
+        model = freeze_model(model, max_order, all_notes)
+        row = model.lookup(last_notes[-(max_order or 0):])  # Start with max order
+        return model.sample(row, np.random.random(length).tolist())
+
+def _uniform_stream(rng, chunk=64):
+    while True:
+        yield from rng.random(chunk).tolist()
+
+def iter_continuation(model, last_notes, length=None, max_order=3, all_notes=(), seed=None):
+    """Yield a continuation one note at a time; length=None runs until closed
+
+    With a seed, the notes are exactly sample 0 of generate_continuations
+    for that seed; without one they come from np.random like
+    generate_safe_continuation.
+    """
+    model = freeze_model(model, max_order, all_notes)
+    row = model.lookup(last_notes[-(max_order or 0):])
+    rng = (np.random if seed is None
+           else np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(0,))))
+    notes = model.iter_sample(row, _uniform_stream(rng))
+    return notes if length is None else islice(notes, length)
+
+def generate_continuations(model, last_notes, length=50, num_samples=1, max_order=3,
+                           seed=None, first_sample=0):
+    """Generate many continuations of one seed at once, as a (samples, length) array
+
+    Sample i draws from SeedSequence(seed, spawn_key=(i,)), so any single
+    sample can be regenerated alone with the same seed and first_sample=i.
+    """
+    with stage('generate_continuations', items=num_samples * length, samples=num_samples):
+        model = freeze_model(model, max_order)
+        uniforms = np.empty((num_samples, length))
+        for i in range(num_samples):
+            stream = np.random.SeedSequence(seed, spawn_key=(first_sample + i,))
+            uniforms[i] = np.random.default_rng(stream).random(length)
+        rows = [model.lookup(last_notes[-(max_order or 0):])] * num_samples
+        return model.sample_batch(rows, uniforms)
+
+# Onsets and durations snap to 1/12 beat, which holds sixteenths and triplets alike
+RHYTHM_GRID = 12
+VELOCITY_STEP = 8
+
+def tokenize_notes(notes, ticks_per_beat):
+    """One token per onset group: its pitch set, gap since the previous group,
+    duration and loudness
+
+    Returns (tokens, keys, grid): token ids indexing the rows of `keys`, the
+    distinct (pitch mask bits 0-63, bits 64-127, gap, duration, velocity
+    step) rows, and the tick size gaps and durations are counted in.
+    """
+    notes = as_note_table(notes)
+    grid = max(1, ticks_per_beat // RHYTHM_GRID)
+    if not len(notes):
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 5), dtype=np.int64), grid
+    onset = np.rint(notes['onset'] / grid).astype(np.int64)
+    order = np.argsort(onset, kind='stable')
+    notes, onset = notes[order], onset[order]
+    starts = np.flatnonzero(np.diff(onset, prepend=-1))
+
+    # A chord is a 128-bit pitch mask, so voicings compare as two integers
+    pitch = notes['pitch'].astype(np.uint64)
+    bit = np.left_shift(np.uint64(1), pitch % np.uint64(64))
+    low = np.bitwise_or.reduceat(np.where(pitch < 64, bit, np.uint64(0)), starts)
+    high = np.bitwise_or.reduceat(np.where(pitch >= 64, bit, np.uint64(0)), starts)
+
+    group_onset = onset[starts]
+    gap = np.diff(group_onset, prepend=group_onset[0])
+    length = np.rint((notes['offset'] - notes['onset']) / grid).astype(np.int64)
+    duration = np.maximum(np.maximum.reduceat(length, starts), 1)
+    size = np.diff(np.append(starts, len(notes)))
+    velocity = np.add.reduceat(notes['velocity'].astype(np.int64), starts) // size // VELOCITY_STEP
+    keys = np.stack([low.view(np.int64), high.view(np.int64), gap, duration, velocity], axis=1)
+    keys, tokens = np.unique(keys, axis=0, return_inverse=True)
+    return tokens.reshape(-1).astype(np.int32), keys, grid
+
+class RhythmModel:
+    """Polyphonic continuation model over onset-group tokens.
+
+    Every token is a whole chord with its timing and loudness (see
+    tokenize_notes), so sampling tokens from a ContextIndex carries voicings,
+    rhythm and dynamics over together, and each sampled token decodes
+    straight back into note rows.
+    """
+
+    def __init__(self, order, tokens, keys, grid):
+        self.order = order
+        self.keys = keys
+        self.grid = grid
+        self.index = ContextIndex(order, tokens)
+        # The pitches of token t are pitches[pitch_start[t]:pitch_start[t+1]]
+        bits = np.unpackbits(keys[:, :2].astype('<i8').view(np.uint8), axis=1, bitorder='little')
+        token, self.pitches = np.nonzero(bits)
+        self.pitch_start = np.searchsorted(token, np.arange(len(keys) + 1))
+        self.sizes = np.diff(self.pitch_start)
+
+    def generate(self, length, num_samples=1, seed=None, context=None):
+        """(samples, length) token ids continuing `context`, by default the training piece"""
+        if context is None:
+            context = self.index.sequence.tolist()
+        return generate_continuations(self.index, context, length, num_samples, self.order, seed)
+
+    def decode(self, tokens, start=0, channel=0):
+        """Note table for a token sequence; gaps count from a group at tick `start`"""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        keys = self.keys[tokens]
+        sizes = self.sizes[tokens]
+        onsets = start + np.cumsum(keys[:, 2]) * self.grid
+        notes = empty_note_table(int(sizes.sum()))
+        first = np.repeat(self.pitch_start[tokens] - (np.cumsum(sizes) - sizes), sizes)
+        notes['pitch'] = self.pitches[first + np.arange(len(notes))]
+        notes['onset'] = np.repeat(onsets, sizes)
+        notes['offset'] = notes['onset'] + np.repeat(keys[:, 3], sizes) * self.grid
+        notes['velocity'] = np.clip(np.repeat(keys[:, 4], sizes) * VELOCITY_STEP
+                                    + VELOCITY_STEP // 2, 1, 127)
+        notes['channel'] = channel
+        return notes
+
+def build_rhythm_model(notes, ticks_per_beat, max_order=3):
+    """Tokenize `notes` into onset groups and index them; max_order=None is unbounded"""
+    with stage('build_rhythm_model', max_order=max_order) as record:
+        tokens, keys, grid = tokenize_notes(notes, ticks_per_beat)
+        model = RhythmModel(max_order, tokens, keys, grid)
+        record['items'] = len(notes)
+        record['tokens'] = len(tokens)
+        record['vocabulary'] = len(keys)
+    print(f"Using {len(keys)} rhythm tokens over {len(tokens)} onset groups, "
+          f"order up to {max_order or 'unbounded'}")
+    return model
+
+def generate_rhythmic_continuations(model, original_notes, length=50, num_samples=1, seed=None):
+    """`num_samples` continuations of `length` onset groups, as note tables placed
+    after the last original onset"""
+    with stage('generate_rhythmic_continuations', items=num_samples * length,
+               samples=num_samples):
+        original = as_note_table(original_notes)
+        start = int(original['onset'].max()) if len(original) else 0
+        channel = int(original['channel'][-1]) if len(original) else 0
+        return [model.decode(tokens, start, channel)
+                for tokens in model.generate(length, num_samples, seed)]
+
+def save_model(model, path, **meta):
+    """Write a frozen model to a standalone file readable by load_model"""
+    write_arrays(path, model.arrays(), {'order': model.order, **meta})
+
+def model_from_arrays(arrays, meta):
+    """Rebuild whichever model kind wrote these arrays"""
+    kind = ContextIndex if 'suffixes' in arrays else FrozenMarkovModel
+    return kind(meta['order'], **arrays)
+
+def load_model(path):
+    """Memory map a model written by save_model (or corpus_train.py)"""
+    return model_from_arrays(*read_arrays(path))
+
+def load_or_build(midi_path, max_order=3, cache=None, index='auto'):
+    """parse_midi + build_adaptive_model, served from `cache` when the file was seen before
+
+    Returns (notes, ticks_per_beat, tempos, model, order).
+    """
+    if cache is None:
+        notes, ticks_per_beat, tempos = parse_midi(midi_path)
+        model, order = build_adaptive_model(notes, max_order, index)
+        return notes, ticks_per_beat, tempos, model, order
+    
     try:
-        mid = MidiFile(ticks_per_beat=ticks_per_beat)
-        track = MidiTrack()
-        mid.tracks.append(track)
-        
-        # Add tempo events
-        for tempo in tempos:
-            track.append(tempo)
-        
-        # Combine notes
-        last_time = max(n['time'] for n in original_notes) if original_notes else 0
-        all_notes = original_notes.copy()
-        
-        for i, note in enumerate(new_notes):
-            all_notes.append({
-                'note': note,
-                'time': last_time + (i+1)*ticks_per_beat,
-                'velocity': 64
-            })
-        
-        # Create messages
-        all_notes.sort(key=lambda x: x['time'])
-        current_time = 0
-        for note in all_notes:
-            delta = note['time'] - current_time
-            track.append(Message('note_on', note=note['note'], 
-                             velocity=note['velocity'], time=delta))
-            track.append(Message('note_off', note=note['note'], 
-                             velocity=0, time=0))
-            current_time = note['time']
-        
-        mid.save(output_path)
+        key = cache_key(midi_path, 'shortMIDI', max_order=max_order, index=index)
+    except OSError as e:
+        # Missing or unreadable input, reported as parse_midi would without the cache
+        print(f"Error parsing MIDI: {str(e)}")
+        exit(1)
+    hit = cache.load(key)
+    if hit is not None:
+        with stage('model_cache_load') as record:
+            arrays, meta = hit
+            notes = arrays.pop('notes')
+            model = model_from_arrays(arrays, meta)
+            record['items'] = len(notes)
+        print(f"Loaded cached model for {midi_path} ({len(notes)} notes)")
+        tempos = TempoMap.from_meta(meta['ticks_per_beat'], meta['tempos'])
+        return notes, meta['ticks_per_beat'], tempos, model, meta['order']
+    
+    notes, ticks_per_beat, tempos = parse_midi(midi_path)
+    model, order = build_adaptive_model(notes, max_order, index)
+    cache.save(key, {'notes': notes, **model.arrays()},
+               {'order': order, 'ticks_per_beat': ticks_per_beat,
+                'tempos': tempos.to_meta()})
+    return notes, ticks_per_beat, tempos, model, order
+
+def _continuation_table(original, new_notes, ticks_per_beat):
+    """Place generated pitches one beat apart after the last original note"""
+    if isinstance(new_notes, np.ndarray) and new_notes.dtype == NOTE_DTYPE:
+        return new_notes  # Already placed, e.g. by the rhythm model
+    last_time = int(original['onset'].max()) if len(original) else 0
+    generated = empty_note_table(len(new_notes))
+    generated['pitch'] = new_notes
+    generated['onset'] = last_time + np.arange(1, len(new_notes)+1) * ticks_per_beat
+    generated['offset'] = generated['onset']
+    generated['velocity'] = 64
+    return generated
+
+def as_tempo_map(tempos, ticks_per_beat):
+    """Accept a TempoMap or a legacy list of set_tempo messages"""
+    if isinstance(tempos, TempoMap):
+        return tempos
+    return TempoMap.from_messages(ticks_per_beat, tempos)
+
+def encode_track(notes, tempo_map=None, durations=False):
+    """Encode notes as note_on/note_off pairs plus tempo changes into one MTrk chunk
+
+    Produces the same bytes as appending mido Messages in onset order and
+    saving, without building a Message per event: events are ordered with
+    one stable argsort, then delta times, status and data bytes are written
+    column by column into a preallocated buffer, with running status where
+    consecutive channel messages share a status byte. Each note_off follows
+    its note_on directly unless durations=True, which ends notes at 'offset'.
+    """
+    notes = as_note_table(notes)
+    if len(notes) and max(notes['pitch'].max(), notes['velocity'].max()) > 127:
+        raise ValueError('note pitch and velocity must be in 0..127')
+    changes = tempo_map.changes if tempo_map is not None else []
+    tempo_ticks = np.array([tick for tick, _ in changes], dtype=np.int64)
+    tempo_values = np.array([tempo for _, tempo in changes], dtype=np.int64)
+    n_tempos = len(changes)
+
+    if durations:
+        # Every note_on and note_off at its own tick; on the same tick tempo
+        # changes go first, then note_offs, so a repeated pitch restrikes cleanly.
+        # A zero-length note (all of them in files written without durations)
+        # ends right after its own note_on instead, as encode_track writes it
+        # by default: rank breaks ties by row, and its note_off shares the on's rank
+        rows = np.arange(len(notes), dtype=np.int64)
+        zero = notes['offset'] <= notes['onset']
+        offsets = np.where(zero, notes['onset'], notes['offset'])
+        keys = np.concatenate([tempo_ticks * 4, offsets * 4 + np.where(zero, 2, 1),
+                               notes['onset'] * 4 + 2])
+        rank = np.concatenate([np.arange(n_tempos), rows * 2 + 1, rows * 2])
+        order = np.lexsort((rank, keys))
+        ticks = keys[order] >> 2
+        tempo_event = order < n_tempos
+        second = ~tempo_event & (order < n_tempos + len(notes))  # note_off
+        note_index = np.where(tempo_event, 0, (order - n_tempos) % max(len(notes), 1))
+        tempo_index = np.where(tempo_event, order, 0)
+    else:
+        # Tempo changes sort ahead of notes on the same tick; notes keep their order
+        keys = np.concatenate([tempo_ticks * 2, notes['onset'] * 2 + 1])
+        order = np.argsort(keys, kind='stable')
+        is_tempo = order < n_tempos
+        # A tempo item is one event, a note item two (note_on, then note_off)
+        per_item = np.where(is_tempo, 1, 2)
+        item = np.repeat(np.arange(len(order)), per_item)
+        second = np.zeros(len(item), dtype=bool)
+        second[1:] = item[1:] == item[:-1]
+        ticks = keys[order][item] >> 1
+        tempo_event = is_tempo[item]
+        note_index = np.where(tempo_event, 0, order[item] - n_tempos)
+        tempo_index = np.where(tempo_event, order[item], 0)
+
+    # Payload: up to 6 bytes per event (set_tempo is FF 51 03 tt tt tt)
+    payload = np.zeros((len(ticks), 6), dtype=np.uint8)
+    status = np.where(tempo_event, 0xFF, np.where(second, 0x80, 0x90))
+    payload[:, 0] = status
+    if len(notes):
+        payload[:, 1] = notes['pitch'][note_index]
+        payload[:, 2] = np.where(second, 0, notes['velocity'][note_index])
+    if n_tempos:
+        tempo = tempo_values[tempo_index]
+        payload[tempo_event, 1:3] = (0x51, 3)
+        for j, shift in ((3, 16), (4, 8), (5, 0)):
+            payload[:, j] = (tempo >> shift) & 0xFF
+    payload_len = np.where(tempo_event, 6, 3)
+    previous = np.concatenate([[-1], status[:-1]])
+    skip = ((status < 0xF0) & (status == previous)).astype(np.int64)
+
+    delta = np.diff(ticks, prepend=0)
+    if len(delta) and delta.max() >= 1 << 28:
+        raise ValueError('delta time too large for a MIDI variable-length quantity')
+    vlq_len = 1 + (delta >= 1 << 7) + (delta >= 1 << 14) + (delta >= 1 << 21)
+    sizes = vlq_len + payload_len - skip
+    starts = 8 + np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    length = int(sizes.sum()) + 4
+
+    chunk = np.empty(8 + length, dtype=np.uint8)
+    chunk[:8] = np.frombuffer(b'MTrk' + length.to_bytes(4, 'big'), dtype=np.uint8)
+    for k in range(4):
+        has = vlq_len > k
+        remaining = vlq_len[has] - 1 - k
+        chunk[starts[has] + k] = ((delta[has] >> (7 * remaining)) & 0x7F) | np.where(remaining > 0, 0x80, 0)
+    body = starts + vlq_len - skip
+    for j in range(6):
+        has = (j >= skip) & (j < payload_len)
+        chunk[body[has] + j] = payload[has, j]
+    chunk[-4:] = (0x00, 0xFF, 0x2F, 0x00)  # end_of_track
+    return chunk.tobytes()
+
+def midi_bytes(tracks, ticks_per_beat, midi_type=1):
+    """A whole Standard MIDI File: MThd header followed by encoded MTrk chunks"""
+    header = (b'MThd' + (6).to_bytes(4, 'big') + midi_type.to_bytes(2, 'big')
+              + len(tracks).to_bytes(2, 'big') + ticks_per_beat.to_bytes(2, 'big'))
+    return b''.join([header, *tracks])
+
+def write_midi(output_path, tracks, ticks_per_beat, midi_type=1):
+    """Write encoded MTrk chunks to a MIDI file"""
+    with open(output_path, 'wb') as f:
+        f.write(midi_bytes(tracks, ticks_per_beat, midi_type))
+
+def _continuation_track(original, new_notes, ticks_per_beat, tempos, durations=False):
+    # Combine notes, with tempo events at their own ticks
+    generated = _continuation_table(original, new_notes, ticks_per_beat)
+    return encode_track(np.concatenate([original, generated]),
+                        as_tempo_map(tempos, ticks_per_beat), durations)
+
+def continuation_midi(original_notes, new_notes, ticks_per_beat, tempos, durations=False):
+    """The original notes followed by the continuation, as MIDI file bytes"""
+    track = _continuation_track(as_note_table(original_notes), new_notes,
+                                ticks_per_beat, tempos, durations)
+    return midi_bytes([track], ticks_per_beat)
+
+def save_midi(original_notes, new_notes, ticks_per_beat, tempos, output_path, durations=False):
+    """Save MIDI file with error handling; durations=True keeps note lengths"""
+    try:
+        with stage('save_midi', items=len(original_notes) + len(new_notes)):
+            with open(output_path, 'wb') as f:
+                f.write(continuation_midi(original_notes, new_notes, ticks_per_beat, tempos,
+                                          durations))
         print(f"Successfully saved {len(new_notes)} new notes to {output_path}")
     except Exception as e:
         print(f"Error saving MIDI: {str(e)}")
         exit(1)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='MIDI Continuation for Small Files')
-    parser.add_argument('input', help='Input MIDI file')
-    parser.add_argument('output', help='Output MIDI file')
-    parser.add_argument('--length', type=int, default=50, 
-                       help='Notes to generate (default: 50)')
-    parser.add_argument('--max_order', type=int, default=3,
-                       help='Maximum Markov order (default: 3)')
+def render_continuation(original_notes, new_notes, ticks_per_beat, tempos, output,
+                        sample_rate=44100, format='wav', bits=16):
+    """Render the original notes and the continuation straight from the note table
+
+    `output` is a path or a binary file object. Pitch-only continuations
+    are written as zero-length notes, so here each one sounds for its beat.
+    """
+    import synth  # Only runs that render audio pay for the synth
+    original = as_note_table(original_notes)
+    generated = _continuation_table(original, new_notes, ticks_per_beat)
+    if generated is not new_notes:
+        generated['offset'] += ticks_per_beat
+    notes = np.concatenate([original, generated])
+    with stage('render_audio', items=len(notes), format=format):
+        synth.render_table(notes, as_tempo_map(tempos, ticks_per_beat), output, sample_rate,
+                           format, bits)
+
+def save_midi_batch(original_notes, samples, ticks_per_beat, tempos, output_path,
+                    multitrack=False, durations=False):
+    """Save many continuations, one file each or one track each in a single file"""
+    try:
+        with stage('save_midi_batch', items=sum(len(n) for n in samples), samples=len(samples)):
+            original = as_note_table(original_notes)
+            if multitrack:
+                # Track 0 holds tempos and the original notes, track i+1 sample i
+                tracks = [encode_track(original, as_tempo_map(tempos, ticks_per_beat), durations)]
+                for new_notes in samples:
+                    tracks.append(encode_track(_continuation_table(original, new_notes, ticks_per_beat),
+                                               durations=durations))
+                write_midi(output_path, tracks, ticks_per_beat)
+                paths = [output_path]
+            else:
+                base, ext = os.path.splitext(output_path)
+                width = max(3, len(str(len(samples)-1)))
+                paths = []
+                for i, new_notes in enumerate(samples):
+                    path = f"{base}_{i:0{width}d}{ext or '.mid'}"
+                    write_midi(path, [_continuation_track(original, new_notes, ticks_per_beat,
+                                                          tempos, durations)],
+                               ticks_per_beat)
+                    paths.append(path)
+        print(f"Successfully saved {len(samples)} continuations to {', '.join(paths[:3])}"
+              f"{' ...' if len(paths) > 3 else ''}")
+        return paths
+    except Exception as e:
+        print(f"Error saving MIDI: {str(e)}")
+        exit(1)
+
+def main(argv=None):
+    """Run one command line job; a --serve worker calls this once per job"""
+    parser = cli_parser()
+    args = parser.parse_args(argv)
+    if not (args.input and args.output):
+        parser.error('the following arguments are required: input, output')
     
-    args = parser.parse_args()
+    audio_format = os.path.splitext(args.audio)[1].lstrip('.').lower() if args.audio else None
+    if args.audio and audio_format not in audio_codec.FORMATS:
+        print("Error: --audio must end in .wav or .flac")
+        exit(1)
+    def render(new_notes):
+        if args.audio:
+            render_continuation(notes, new_notes, ticks, tempos, args.audio, args.sample_rate,
+                                audio_format, args.bits)
+            print(f"Rendered audio to {args.audio}")
     
-    # Process MIDI
-    notes, ticks, tempos = parse_midi(args.input)
+    profiling = args.profile or args.profile_cprofile or args.profile_tracemalloc
+    with (profile(args.profile, not args.profile_no_memory, args.profile_cprofile,
+                  args.profile_tracemalloc) if profiling else nullcontext()):
+        if args.rhythm:
+            notes, ticks, tempos = parse_midi(args.input)
+            if not len(notes):
+                print("Error: No notes found in input file")
+                exit(1)
+            model = build_rhythm_model(notes, ticks, args.max_order or None)
+            samples = generate_rhythmic_continuations(model, notes, args.length,
+                                                      args.num_samples, args.seed)
+            if args.num_samples > 1:
+                save_midi_batch(notes, samples, ticks, tempos, args.output, args.multitrack,
+                                durations=True)
+            else:
+                save_midi(notes, samples[0], ticks, tempos, args.output, durations=True)
+            render(samples[0])
+            exit(0)
     
-    if not notes:
-        print("Error: No notes found in input file")
-        exit(1)
+        # Process MIDI and build adaptive model, or load both from the cache
+        if args.model:
+            notes, ticks, tempos = parse_midi(args.input)
+            model = load_model(args.model)
+            actual_order = model.order
+            print(f"Loaded {len(model)}-state order-{actual_order} model from {args.model}")
+        else:
+            cache = None if args.no_cache else ModelCache(args.cache_dir)
+            max_order = args.max_order or None
+            if max_order is None and args.index == 'table':
+                print("Error: an unbounded order needs the suffix index")
+                exit(1)
+            notes, ticks, tempos, model, actual_order = load_or_build(args.input, max_order, cache,
+                                                                      args.index)
     
-    # Build adaptive model
-    model, actual_order = build_adaptive_model(notes, args.max_order)
-    all_notes = [n['note'] for n in notes]
-    
-    # Generate continuation
-    last_original = [n['note'] for n in notes[-actual_order:]]
-    new_notes = generate_safe_continuation(
-        model, 
-        last_original,
-        args.length,
-        actual_order,
-        all_notes
-    )
-    
-    # Save result
-    save_midi(notes, new_notes, ticks, tempos, args.output)
\ No newline at end of file
+        if not len(notes):
+            print("Error: No notes found in input file")
+            exit(1)
+    
+        all_notes = notes['pitch'].tolist()
+    
+        last_original = notes['pitch'][-(actual_order or 0):].tolist()
+    
+        if args.num_samples > 1 or args.seed is not None:
+            # Batch mode: one model, many seeded continuations
+            seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+            print(f"Generating {args.num_samples} samples with seed {seed}")
+            samples = generate_continuations(model, last_original, args.length,
+                                             args.num_samples, actual_order, seed)
+            # Like --rhythm, per-sample file names only when there are several
+            if args.num_samples > 1:
+                save_midi_batch(notes, samples, ticks, tempos, args.output, args.multitrack)
+            else:
+                save_midi(notes, samples[0], ticks, tempos, args.output)
+            render(samples[0])
+            exit(0)
+    
+        # Generate continuation
+        new_notes = generate_safe_continuation(
+            model, 
+            last_original,
+            args.length,
+            actual_order,
+            all_notes
+        )
+    
+        # Save result
+        save_midi(notes, new_notes, ticks, tempos, args.output)
+        render(new_notes)
+
+if __name__ == "__main__":
+    if args.serve:
+        import job_daemon
+        job_daemon.serve(args.serve, main)
+    else:
+        main()
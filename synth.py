@@ -0,0 +1,367 @@
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from mido import MidiFile
+from tempo_map import TempoMap
+import audio_codec
+
+# ===================== ADDITIVE SINE SYNTHESIS =====================
+SAMPLE_RATE = 44100
+AMPLITUDE = 0.3  # Per-voice level before normalisation
+
+def midi_to_freq(note):
+    """Convert MIDI note number to frequency"""
+    return 440.0 * (2 ** ((note - 69) / 12))
+
+class WavetableCache:
+    """Per-pitch sine tables starting at phase 0, grown on demand up to `max_seconds`
+
+    A note segment is then a slice of its pitch's table, so rendering never
+    recomputes a sine. Segments past the cap are computed directly, which
+    keeps the cache bounded however long a note is held.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, max_seconds=10):
+        self.sample_rate = sample_rate
+        self.max_length = int(max_seconds * sample_rate)
+        self.tables = {}
+
+    def segment(self, pitch, offset, count):
+        """Samples [offset, offset+count) of a phase-0 sine at `pitch`"""
+        end = offset + count
+        if end > self.max_length:
+            step = 2 * np.pi * midi_to_freq(pitch) / self.sample_rate
+            return np.sin(step * np.arange(offset, end)).astype(np.float32)
+        table = self.tables.get(pitch)
+        if table is None or len(table) < end:
+            size = min(max(end, self.sample_rate), self.max_length)  # At least one second
+            step = 2 * np.pi * midi_to_freq(pitch) / self.sample_rate
+            table = np.sin(step * np.arange(size)).astype(np.float32)
+            self.tables[pitch] = table
+        return table[offset:end]
+
+    def get(self, pitch, length):
+        return self.segment(pitch, 0, length)
+
+def adsr_segment(envelope, length, offset, count, sample_rate=SAMPLE_RATE):
+    """Samples [offset, offset+count) of an ADSR envelope over a `length`-sample note
+
+    `envelope` is (attack, decay, sustain_level, release) with times in seconds.
+    """
+    attack, decay, sustain_level, release = envelope
+    n_attack = int(attack * sample_rate)
+    n_decay = int(decay * sample_rate)
+    n_release = int(release * sample_rate)
+    corners = np.minimum([0, n_attack, n_attack + n_decay, length - n_release, length], length)
+    corners = np.maximum.accumulate(np.maximum(corners, 0))
+    levels = [0, 1, sustain_level, sustain_level, 0]
+    return np.interp(np.arange(offset, offset + count), corners, levels).astype(np.float32)
+
+def _note_samples(starts, durations, velocities, sample_rate, amplitude):
+    """First sample, length in samples and gain of every note"""
+    starts = np.asarray(starts, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    first = (starts * sample_rate).astype(np.int64)
+    lengths = ((starts + durations) * sample_rate).astype(np.int64) - first
+    gains = np.full(len(starts), amplitude, dtype=np.float32)
+    if velocities is not None:
+        gains *= np.asarray(velocities, dtype=np.float32) / 127
+    return first, lengths, gains
+
+def _voice(wavetables, pitch, gain, length, offset, count, envelope):
+    """Samples [offset, offset+count) of one note of `length` samples"""
+    voice = gain * wavetables.segment(pitch, offset, count)
+    if envelope is not None:
+        voice *= adsr_segment(envelope, length, offset, count, wavetables.sample_rate)
+    return voice
+
+class VoiceCache:
+    """LRU of whole rendered notes keyed by (pitch, length, gain, envelope)
+
+    Melodies reuse a handful of pitches, durations and velocities, so after
+    the first occurrence a note is a cached array added into the mix.
+    Entries are evicted oldest-first once they hold more than `max_bytes`.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, max_bytes=64 * 1024 * 1024, wavetables=None):
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.wavetables = wavetables or WavetableCache(sample_rate)
+        self.voices = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def voice(self, pitch, gain, length, envelope=None):
+        key = (pitch, length, gain, envelope)
+        voice = self.voices.get(key)
+        if voice is not None:
+            self.voices.move_to_end(key)
+            self.hits += 1
+            return voice
+        self.misses += 1
+        voice = _voice(self.wavetables, pitch, gain, length, 0, length, envelope)
+        if voice.nbytes <= self.max_bytes:
+            self.voices[key] = voice
+            self.nbytes += voice.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.voices.popitem(last=False)[1].nbytes
+        return voice
+
+# Caches kept by each render worker process across the segments it is given
+_process_caches = {}
+
+def _render_segment(shm_name, size, lo, hi, first, lengths, pitches, gains, sample_rate,
+                    envelope, cache_voices):
+    """Add every note's samples inside [lo, hi) to the shared buffer"""
+    if sample_rate not in _process_caches:
+        wavetables = WavetableCache(sample_rate)
+        _process_caches[sample_rate] = (wavetables, VoiceCache(sample_rate, wavetables=wavetables))
+    wavetables, voices = _process_caches[sample_rate]
+    shm = SharedMemory(name=shm_name)
+    try:
+        audio = np.ndarray(size, dtype=np.float32, buffer=shm.buf)
+        for start, length, pitch, gain in zip(first.tolist(), lengths.tolist(),
+                                              pitches.tolist(), gains.tolist()):
+            a, b = max(start, lo), min(start + length, hi)
+            if cache_voices and a == start and b == start + length:
+                audio[a:b] += voices.voice(pitch, gain, length, envelope)
+            else:
+                # Notes crossing a boundary render only their own part, from
+                # the same phase and envelope position, so segments join exactly
+                audio[a:b] += _voice(wavetables, pitch, gain, length, a - start, b - a, envelope)
+        del audio  # Release the view before the mapping is closed
+    finally:
+        shm.close()
+
+def _mix_parallel(first, lengths, pitches, gains, size, sample_rate, envelope, cache_voices,
+                  workers, segments_per_worker=4):
+    """mix_notes split into time segments rendered by a process pool into shared memory"""
+    shm = SharedMemory(create=True, size=size * 4)
+    try:
+        audio = np.ndarray(size, dtype=np.float32, buffer=shm.buf)
+        audio[:] = 0
+        ends = first + lengths
+        # More segments than workers so a dense passage doesn't hold up the rest
+        bounds = np.linspace(0, size, workers * segments_per_worker + 1).astype(np.int64).tolist()
+        with ProcessPoolExecutor(workers) as pool:
+            jobs = []
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                # Keeping the input order keeps the sum order of render_notes
+                inside = (first < hi) & (ends > lo) & (lengths > 0)
+                jobs.append(pool.submit(_render_segment, shm.name, size, lo, hi, first[inside],
+                                        lengths[inside], pitches[inside], gains[inside],
+                                        sample_rate, envelope, cache_voices))
+            for job in jobs:
+                job.result()
+        result = audio.copy()
+        del audio
+        return result
+    finally:
+        shm.close()
+        shm.unlink()
+
+def mix_notes(first, lengths, pitches, gains, sample_rate=SAMPLE_RATE, wavetables=None,
+              envelope=None, voices=None, workers=1):
+    """Mix notes given in samples (first sample, length) into a float32 buffer
+
+    With a VoiceCache in `voices`, repeated notes are rendered once. With
+    workers > 1 the piece is cut into time segments rendered by that many
+    processes; the result is the same as a single-process render.
+    """
+    first, lengths = np.asarray(first, dtype=np.int64), np.asarray(lengths, dtype=np.int64)
+    # The last sample any note reaches fixes the buffer size up front
+    size = int((first + lengths).max()) if len(first) else 0
+    if workers > 1 and size:
+        return _mix_parallel(first, lengths, np.asarray(pitches, dtype=np.int64),
+                             np.asarray(gains, dtype=np.float32), size, sample_rate,
+                             envelope, voices is not None, workers)
+    audio = np.zeros(size, dtype=np.float32)
+    wavetables = wavetables or WavetableCache(sample_rate)
+    for start, length, pitch, gain in zip(first.tolist(), lengths.tolist(),
+                                          np.asarray(pitches).tolist(),
+                                          np.asarray(gains, dtype=np.float32).tolist()):
+        if length > 0:
+            if voices is not None:
+                audio[start:start+length] += voices.voice(pitch, gain, length, envelope)
+            else:
+                audio[start:start+length] += _voice(wavetables, pitch, gain, length, 0, length,
+                                                    envelope)
+    return audio
+
+def render_notes(starts, durations, pitches, velocities=None, sample_rate=SAMPLE_RATE,
+                 amplitude=AMPLITUDE, wavetables=None, envelope=None, voices=None, workers=1):
+    """Mix sine voices into one preallocated float32 buffer
+
+    starts and durations are in seconds. velocities (0-127) scale each voice;
+    without them every voice plays at `amplitude`. `envelope` is an optional
+    ADSR tuple (see adsr_segment). Any number of voices may overlap; each one
+    is a single vectorised add into the buffer. workers > 1 renders time
+    segments in parallel (see mix_notes).
+    """
+    first, lengths, gains = _note_samples(starts, durations, velocities, sample_rate, amplitude)
+    return mix_notes(first, lengths, pitches, gains, sample_rate, wavetables, envelope, voices,
+                     workers)
+
+def render_blocks(starts, durations, pitches, velocities=None, sample_rate=SAMPLE_RATE,
+                  amplitude=AMPLITUDE, block_size=65536, envelope=None, wavetables=None):
+    """Yield the mix as consecutive float32 blocks of `block_size` samples
+
+    Notes are visited through a cursor in start order and only the notes
+    sounding inside the current block are kept active, so memory depends on
+    block size and polyphony, not on the length of the piece.
+    """
+    first, lengths, gains = _note_samples(starts, durations, velocities, sample_rate, amplitude)
+    order = np.argsort(first, kind='stable')
+    first, lengths, gains = first[order].tolist(), lengths[order].tolist(), gains[order].tolist()
+    pitches = np.asarray(pitches)[order].tolist()
+    total = max((s + n for s, n in zip(first, lengths)), default=0)
+    wavetables = wavetables or WavetableCache(sample_rate)
+
+    cursor, active = 0, []
+    for block_start in range(0, total, block_size):
+        block_end = min(block_start + block_size, total)
+        block = np.zeros(block_end - block_start, dtype=np.float32)
+        while cursor < len(first) and first[cursor] < block_end:
+            if lengths[cursor] > 0:
+                active.append(cursor)
+            cursor += 1
+        still_active = []
+        for note in active:
+            start, length = first[note], lengths[note]
+            lo, hi = max(start, block_start), min(start + length, block_end)
+            block[lo-block_start:hi-block_start] += _voice(
+                wavetables, pitches[note], gains[note], length, lo - start, hi - lo, envelope)
+            if start + length > block_end:
+                still_active.append(note)
+        active = still_active
+        yield block
+
+def write_wav_blocks(wav_path, blocks, sample_rate=SAMPLE_RATE, gain=1.0, limit=False, bits=16):
+    """Write float blocks to 8- or 16-bit PCM as they arrive
+
+    `wav_path` may also be a writable binary file object. With limit=True the
+    gain only ever ramps down: each block is held back until the next one has
+    been seen, and when that one would clip the held block ramps to the lower
+    gain, so the loud block starts at a level that fits. Returns the gain in
+    effect at the end.
+    """
+    def write(block):
+        if bits == 8:
+            pcm = ((np.clip(block, -1, 1) * 127).astype(np.int16) + 128).astype(np.uint8)
+        else:
+            pcm = (np.clip(block, -1, 1) * 32767).astype('<i2')
+        out.writeframes(pcm.tobytes())
+
+    with wave.open(wav_path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(bits // 8)
+        out.setframerate(sample_rate)
+        held = None  # With limit=True, the block before the current one, not yet written
+        for block in blocks:
+            if not limit:
+                write(block * gain)
+                continue
+            if not len(block):
+                continue
+            peak = float(np.max(np.abs(block)))
+            target = min(gain, 1 / peak) if peak > 0 else gain
+            if held is not None:
+                if target < gain:
+                    write(held * np.linspace(gain, target, len(held), dtype=np.float32))
+                else:
+                    write(held * gain)
+            gain = target  # The first block has nothing before it to ramp in
+            held = block
+        if held is not None:
+            write(held * gain)
+    return gain
+
+def render_to_wav(wav_path, starts, durations, pitches, velocities=None,
+                  sample_rate=SAMPLE_RATE, amplitude=AMPLITUDE, block_size=65536,
+                  envelope=None, normalize='two-pass', bits=16):
+    """Render straight to a WAV file (path or file object) in blocks, never
+    holding the whole song
+
+    normalize='two-pass' renders once to find the peak and again to write,
+    matching write_wav's output; 'limiter' renders once, starting at the
+    level of a single full voice and backing off whenever the mix would clip.
+    """
+    wavetables = WavetableCache(sample_rate)
+    def blocks():
+        return render_blocks(starts, durations, pitches, velocities, sample_rate,
+                             amplitude, block_size, envelope, wavetables)
+    if normalize == 'two-pass':
+        peak = max((float(np.max(np.abs(b))) for b in blocks() if len(b)), default=0)
+        write_wav_blocks(wav_path, blocks(), sample_rate, 1 / peak if peak > 0 else 1.0,
+                         bits=bits)
+    elif normalize == 'limiter':
+        write_wav_blocks(wav_path, blocks(), sample_rate, 1 / amplitude, limit=True, bits=bits)
+    else:
+        write_wav_blocks(wav_path, blocks(), sample_rate, bits=bits)
+
+def midi_note_events(midi, tempo=None):
+    """Note start times, durations (seconds), pitches and velocities of a MIDI file
+
+    `midi` is a path, a binary file object or an already loaded MidiFile.
+    Times follow the file's tempo map; pass `tempo` to force a constant tempo.
+    """
+    if isinstance(midi, MidiFile):
+        mid = midi
+    elif hasattr(midi, 'read'):
+        mid = MidiFile(file=midi)
+    else:
+        mid = MidiFile(midi)
+    tempo_map = TempoMap.from_midi(mid) if tempo is None else TempoMap(mid.ticks_per_beat,
+                                                                      [(0, tempo)])
+    onsets, offsets, pitches, velocities = [], [], [], []
+    for track in mid.tracks:
+        current_time = 0  # Ticks; each track starts at the top of the file
+        open_notes = {}  # (channel, pitch) -> [(onset, velocity), ...]
+        for msg in track:
+            current_time += msg.time
+            if msg.type == 'note_on' and msg.velocity > 0:
+                open_notes.setdefault((msg.channel, msg.note), []).append(
+                    (current_time, msg.velocity))
+            elif msg.type in ('note_off', 'note_on'):
+                stack = open_notes.get((msg.channel, msg.note))
+                if stack:
+                    onset, velocity = stack.pop(0)
+                    onsets.append(onset)
+                    offsets.append(current_time)
+                    pitches.append(msg.note)
+                    velocities.append(velocity)
+    starts = tempo_map.to_seconds(np.array(onsets, dtype=np.int64))
+    ends = tempo_map.to_seconds(np.array(offsets, dtype=np.int64))
+    return (starts, ends - starts,
+            np.array(pitches, dtype=np.int64), np.array(velocities, dtype=np.int64))
+
+def table_note_events(notes, tempo_map):
+    """Start times, durations (seconds), pitches and velocities of a note table
+
+    `notes` has shortMIDI's NOTE_DTYPE fields, with onsets and offsets in
+    ticks on `tempo_map`, so nothing goes through a MIDI file.
+    """
+    starts = tempo_map.to_seconds(notes['onset'].astype(np.int64))
+    ends = tempo_map.to_seconds(notes['offset'].astype(np.int64))
+    return (starts, ends - starts,
+            notes['pitch'].astype(np.int64), notes['velocity'].astype(np.int64))
+
+def render_table(notes, tempo_map, output=None, sample_rate=SAMPLE_RATE, format='wav', bits=16,
+                 workers=1):
+    """Render a note table straight to encoded audio
+
+    Writes to `output`, a path or a binary file object, or returns the encoded
+    bytes when output is None. See audio_codec.encode_audio for format and bits.
+    """
+    starts, durations, pitches, _ = table_note_events(notes, tempo_map)
+    audio = render_notes(starts, durations, pitches, sample_rate=sample_rate, workers=workers)
+    if output is None:
+        return audio_codec.encode_audio(audio, sample_rate, format, bits)
+    audio_codec.write_audio(output, audio, sample_rate, format, bits)
+
+def write_wav(wav_path, audio, sample_rate=SAMPLE_RATE):
+    """Peak-normalise and write 16-bit PCM to a path or binary file object"""
+    audio_codec.write_audio(wav_path, audio, sample_rate)
@@ -0,0 +1,84 @@
+import numpy as np
+
+DEFAULT_TEMPO = 500000  # Microseconds per beat (120 BPM), the MIDI default
+
+class TempoMap:
+    """Tick <-> second conversion for a whole file, built from its set_tempo events
+
+    Breakpoints are kept as sorted arrays (tick, tempo, seconds at that tick),
+    so converting any number of times is one np.searchsorted plus a
+    multiply-add, O(log changes) per value, however the tempo moves.
+    """
+
+    def __init__(self, ticks_per_beat, changes=()):
+        self.ticks_per_beat = ticks_per_beat
+        # Explicit (tick, tempo) changes; at equal ticks the last one wins
+        latest = {}
+        for tick, tempo in sorted(changes, key=lambda change: change[0]):
+            latest[int(tick)] = int(tempo)
+        self.changes = sorted(latest.items())
+
+        breakpoints = self.changes if 0 in latest else [(0, DEFAULT_TEMPO)] + self.changes
+        self.ticks = np.array([tick for tick, _ in breakpoints], dtype=np.int64)
+        self.tempos = np.array([tempo for _, tempo in breakpoints], dtype=np.int64)
+        # Seconds per tick inside each segment, and elapsed seconds at its start
+        self.scale = self.tempos / (1e6 * ticks_per_beat)
+        self.seconds = np.concatenate([[0.0], np.cumsum(np.diff(self.ticks) * self.scale[:-1])])
+
+    @classmethod
+    def from_midi(cls, mid):
+        """Merge set_tempo events from every track of a mido.MidiFile"""
+        changes = []
+        for track in mid.tracks:
+            tick = 0  # Track times are deltas from the start of their own track
+            for msg in track:
+                tick += msg.time
+                if msg.type == 'set_tempo':
+                    changes.append((tick, msg.tempo))
+        return cls(mid.ticks_per_beat, changes)
+
+    @classmethod
+    def from_messages(cls, ticks_per_beat, messages):
+        """Build from set_tempo messages whose `time` fields are consecutive deltas"""
+        changes, tick = [], 0
+        for msg in messages:
+            tick += msg.time
+            changes.append((tick, msg.tempo))
+        return cls(ticks_per_beat, changes)
+
+    def to_meta(self):
+        return [[tick, tempo] for tick, tempo in self.changes]
+
+    @classmethod
+    def from_meta(cls, ticks_per_beat, pairs):
+        return cls(ticks_per_beat, pairs)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def _segments(self, ticks):
+        return np.searchsorted(self.ticks, ticks, side='right') - 1
+
+    def to_seconds(self, ticks):
+        """Absolute ticks (scalar or array) -> seconds from the start"""
+        ticks = np.asarray(ticks, dtype=np.int64)
+        segment = np.maximum(self._segments(ticks), 0)
+        seconds = self.seconds[segment] + (ticks - self.ticks[segment]) * self.scale[segment]
+        return float(seconds) if seconds.ndim == 0 else seconds
+
+    def to_ticks(self, seconds):
+        """Seconds from the start (scalar or array) -> nearest absolute tick"""
+        seconds = np.asarray(seconds, dtype=np.float64)
+        segment = np.maximum(np.searchsorted(self.seconds, seconds, side='right') - 1, 0)
+        ticks = self.ticks[segment] + np.rint((seconds - self.seconds[segment]) / self.scale[segment])
+        ticks = ticks.astype(np.int64)
+        return int(ticks) if ticks.ndim == 0 else ticks
+
+    def tempo_at(self, tick):
+        """Microseconds per beat in effect at `tick`"""
+        return int(self.tempos[max(int(self._segments(tick)), 0)])
+
+    def messages(self):
+        """(tick, MetaMessage) pairs for writing the explicit changes back out"""
+        from mido import MetaMessage
+        return [(tick, MetaMessage('set_tempo', tempo=tempo)) for tick, tempo in self.changes]
@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+import mido
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+from tempo_map import TempoMap
+
+def note_table(rows):
+    """Note table from (onset, offset, pitch) rows"""
+    notes = shortMIDI.empty_note_table(len(rows))
+    notes['onset'], notes['offset'], notes['pitch'] = np.array(rows).T
+    notes['velocity'] = 64
+    return notes
+
+def note_messages(track_bytes, ticks_per_beat=480):
+    mid = mido.MidiFile(file=io.BytesIO(shortMIDI.midi_bytes([track_bytes], ticks_per_beat)))
+    tick, events = 0, []
+    for msg in mid.tracks[0]:
+        tick += msg.time
+        if msg.type in ('note_on', 'note_off'):
+            events.append((tick, 'off' if msg.type == 'note_off' else 'on', msg.note))
+    return events
+
+def test_zero_length_notes_end_after_their_own_note_on():
+    # As written by shortMIDI without durations: every note starts and ends on one tick
+    notes = note_table([(0, 0, 60), (0, 0, 64), (480, 480, 60), (960, 960, 62)])
+    assert note_messages(shortMIDI.encode_track(notes, durations=True)) == [
+        (0, 'on', 60), (0, 'off', 60), (0, 'on', 64), (0, 'off', 64),
+        (480, 'on', 60), (480, 'off', 60), (960, 'on', 62), (960, 'off', 62)]
+    # Which is what the default mode writes for them
+    assert shortMIDI.encode_track(notes, durations=True) == shortMIDI.encode_track(notes)
+
+def test_zero_length_notes_keep_their_length_when_read_back():
+    notes = note_table([(0, 0, 60), (0, 240, 64), (480, 480, 64), (480, 960, 60)])
+    data = shortMIDI.midi_bytes([shortMIDI.encode_track(notes, durations=True)], 480)
+    read, _, _ = shortMIDI.read_notes(io.BytesIO(data))
+    assert read[['onset', 'offset', 'pitch']].tolist() == notes[['onset', 'offset', 'pitch']].tolist()
+
+def test_note_off_before_restrike_of_the_same_pitch():
+    notes = note_table([(0, 480, 60), (480, 960, 60)])
+    assert note_messages(shortMIDI.encode_track(notes, durations=True)) == [
+        (0, 'on', 60), (480, 'off', 60), (480, 'on', 60), (960, 'off', 60)]
+
+def test_tempo_changes_come_first_on_their_tick():
+    notes = note_table([(0, 0, 60), (480, 720, 62)])
+    track = shortMIDI.encode_track(notes, TempoMap(480, [(0, 400000), (480, 600000)]), durations=True)
+    mid = mido.MidiFile(file=io.BytesIO(shortMIDI.midi_bytes([track], 480)))
+    assert [msg.type for msg in mid.tracks[0]] == [
+        'set_tempo', 'note_on', 'note_off', 'set_tempo', 'note_on', 'note_off', 'end_of_track']
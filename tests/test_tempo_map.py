@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+import mido
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import shortMIDI
+from tempo_map import DEFAULT_TEMPO, TempoMap
+
+# 120, 240, 60 and 100 bpm at 480 ticks per beat
+CHANGES = [(0, 500000), (960, 250000), (1920, 1000000), (2400, 600000)]
+
+def test_ticks_to_seconds_across_tempo_changes():
+    tempos = TempoMap(480, CHANGES)
+    ticks = [0, 480, 960, 1440, 1920, 2160, 2400, 3360]
+    seconds = [0.0, 0.5, 1.0, 1.25, 1.5, 2.0, 2.5, 3.7]
+    assert tempos.to_seconds(np.array(ticks)) == pytest.approx(seconds)
+    assert tempos.to_ticks(np.array(seconds)).tolist() == ticks
+    assert tempos.to_seconds(1440) == pytest.approx(1.25)
+    assert [tempos.tempo_at(tick) for tick in (0, 959, 960, 2399, 2400)] == [
+        500000, 500000, 250000, 1000000, 600000]
+
+def test_seconds_round_trip_every_tick():
+    tempos = TempoMap(96, [(100, 300000), (150, 700000), (151, 450000), (900, 2000000)])
+    ticks = np.arange(2000)
+    assert (tempos.to_ticks(tempos.to_seconds(ticks)) == ticks).all()
+
+def test_default_tempo_before_the_first_change():
+    tempos = TempoMap(480, [(960, 250000)])
+    assert tempos.tempo_at(0) == DEFAULT_TEMPO
+    assert tempos.to_seconds(1440) == pytest.approx(1.25)
+    assert tempos.changes == [(960, 250000)]
+
+@pytest.mark.parametrize('durations', [False, True])
+def test_written_file_keeps_every_tempo_change(durations):
+    notes = shortMIDI.empty_note_table(8)
+    notes['onset'] = np.arange(8) * 480
+    notes['offset'] = notes['onset'] + (240 if durations else 0)
+    notes['pitch'] = 60 + np.arange(8)
+    notes['velocity'] = 64
+    data = shortMIDI.midi_bytes([shortMIDI.encode_track(notes, TempoMap(480, CHANGES), durations)], 480)
+
+    mid = mido.MidiFile(file=io.BytesIO(data))
+    tick, written = 0, []
+    for msg in mid.tracks[0]:
+        tick += msg.time
+        if msg.type == 'set_tempo':
+            written.append((tick, msg.tempo))
+    assert written == CHANGES
+
+    read, ticks_per_beat, tempos = shortMIDI.read_notes(io.BytesIO(data))
+    assert ticks_per_beat == 480 and tempos.changes == CHANGES
+    assert read['onset'].tolist() == notes['onset'].tolist()
+    assert tempos.to_seconds(read['onset']) == pytest.approx(
+        TempoMap(480, CHANGES).to_seconds(notes['onset']))